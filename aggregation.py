@@ -0,0 +1,121 @@
+""" Vectorized aggregation of recipe ingredients for shopping lists.
+
+Ingredients from every recipe are laid out as columnar NumPy arrays
+(ingredient id, unit code, quantity), converted to base units in one pass and
+summed with a group-by keyed on (ingredient id, base unit). Quantities in
+different base units, such as cups and grams of flour, are never summed.
+"""
+
+from array import array
+
+import numpy as np
+
+import units
+
+
+def aggregate_ingredient_lists(ingredient_lists):
+    """ Takes in a list of ingredient lists, one per recipe, and returns aggregated ingredients.
+
+    Ingredients need id, amount, unitLong, name and aisle. Returns a dictionary
+    of ingredient id to {'quantity', 'unit', 'name', 'aisle'}, the structure
+    shopping lists are built from. An ingredient in more than one base unit
+    also has 'other_units', a list of (quantity, unit) for the units after
+    the first.
+    """
+
+    ingredients = [ingredient for ingredient_list in ingredient_lists for ingredient in ingredient_list]
+    if not ingredients:
+        return {}
+
+    ingredient_ids = np.array([ingredient['id'] for ingredient in ingredients], dtype=np.int64)
+    amounts = np.array([ingredient['amount'] for ingredient in ingredients], dtype=np.float64)
+    unit_names = [ingredient['unitLong'] for ingredient in ingredients]
+
+    return aggregate_ingredient_columns(ingredient_ids, amounts, unit_names,
+                                        lambda index: (ingredients[index]['name'], ingredients[index]['aisle']))
+
+
+def aggregate_recipes(recipes):
+    """ Takes in a list of CompactRecipes and returns aggregated ingredients,
+    like aggregate_ingredient_lists.
+
+    The recipes' id and amount arrays are joined without building a
+    dictionary per ingredient.
+    """
+
+    recipes = [recipe for recipe in recipes if len(recipe.ingredient_ids)]
+    if not recipes:
+        return {}
+
+    ingredient_ids = array('l')
+    amounts = array('d')
+    for recipe in recipes:
+        ingredient_ids.extend(recipe.ingredient_ids)
+        amounts.extend(recipe.amounts)
+
+    ingredient_ids = np.array(ingredient_ids, dtype=np.int64)
+    amounts = np.array(amounts, dtype=np.float64)
+    unit_names = [unit_name for recipe in recipes for unit_name in recipe.unit_longs]
+    names = [name for recipe in recipes for name in recipe.names]
+    aisles = [aisle for recipe in recipes for aisle in recipe.aisles]
+
+    return aggregate_ingredient_columns(ingredient_ids, amounts, unit_names,
+                                        lambda index: (names[index], aisles[index]))
+
+
+def aggregate_ingredient_columns(ingredient_ids, amounts, unit_names, get_details):
+    """ Aggregates ingredients given as columns.
+
+    Takes in an array of ingredient ids, an array of amounts and a sequence of
+    unit names of the same length, plus get_details, which returns (name,
+    aisle) for a row index. Name and aisle come from the first row seen for
+    each ingredient. An ingredient still in more than one unit after
+    conversion gets the total of the first unit seen as its quantity, and the
+    totals of the others, not added to it, in 'other_units'.
+    """
+
+    # Each distinct unit name is resolved once
+    raw_unit_codes = dict((unit_name, code) for code, unit_name in enumerate(set(unit_names)))
+    raw_codes = np.array([raw_unit_codes[unit_name] for unit_name in unit_names], dtype=np.int64)
+
+    base_unit_codes = {}
+    base_units = []
+    raw_factors = np.ones(len(raw_unit_codes))
+    raw_base_codes = np.zeros(len(raw_unit_codes), dtype=np.int64)
+
+    for unit_name, raw_code in raw_unit_codes.items():
+        entry = units.resolve_unit(unit_name)
+        (base_unit, factor) = (entry[1], entry[2]) if entry else (unit_name, 1.0)
+        if base_unit not in base_unit_codes:
+            base_unit_codes[base_unit] = len(base_units)
+            base_units.append(base_unit)
+        raw_factors[raw_code] = factor
+        raw_base_codes[raw_code] = base_unit_codes[base_unit]
+
+    quantities = amounts * raw_factors[raw_codes]
+    unit_codes = raw_base_codes[raw_codes]
+
+    # Group by (ingredient id, base unit) and sum quantities
+    group_keys = ingredient_ids * len(base_units) + unit_codes
+    (unique_keys, first_indexes, group_indexes) = np.unique(group_keys, return_index=True, return_inverse=True)
+    group_quantities = np.bincount(group_indexes, weights=quantities)
+
+    aggregated_ingredients = {}
+
+    # Groups in the order their ingredient first appears
+    for group in np.argsort(first_indexes, kind='mergesort'):
+        first_index = first_indexes[group]
+        ingredient_id = int(ingredient_ids[first_index])
+
+        if ingredient_id not in aggregated_ingredients:
+            (name, aisle) = get_details(first_index)
+            aggregated_ingredients[ingredient_id] = {'quantity': float(group_quantities[group]),
+                                                     'unit': base_units[unit_codes[first_index]],
+                                                     'name': name,
+                                                     'aisle': aisle,
+                                                     }
+        else:
+            aggregated_ingredients[ingredient_id].setdefault('other_units', []).append((float(group_quantities[group]),
+                                                                                       base_units[unit_codes[first_index]]))
+
+    return aggregated_ingredients
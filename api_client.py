@@ -0,0 +1,92 @@
+""" Pooled HTTP client for the Spoonacular API.
+
+One requests.Session is shared by the whole process, so connections (and
+their TLS sessions) are kept alive and reused across calls and threads
+instead of being set up again for every request. Pool size, timeouts and the
+API base URL can be set through environment variables.
+"""
+
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+API_BASE_URL = os.environ.get('SPOONACULAR_BASE_URL', 'https://spoonacular-recipe-food-nutrition-v1.p.mashape.com')
+
+# Connections kept open per host; at least the recipe fan-out width per worker
+API_POOL_SIZE = int(os.environ.get('SPOONACULAR_POOL_SIZE', 10))
+
+# Seconds to wait for a connection and then for each read
+API_CONNECT_TIMEOUT = float(os.environ.get('SPOONACULAR_CONNECT_TIMEOUT', 3.05))
+API_READ_TIMEOUT = float(os.environ.get('SPOONACULAR_READ_TIMEOUT', 10))
+
+
+class ApiResponse(object):
+    """ Status code and parsed body of an API response."""
+
+    def __init__(self, code, body):
+        self.code = code
+        self.body = body
+
+
+class ApiError(Exception):
+    """ Raised for an API response other than 200 OK, such as a quota or server error."""
+
+    def __init__(self, response):
+        Exception.__init__(self, 'API responded with status %s' % response.code)
+        self.response = response
+
+
+class ApiClient(object):
+    """ Keep-alive HTTP client backed by a pooled session."""
+
+    def __init__(self, headers=None, pool_size=API_POOL_SIZE,
+                 connect_timeout=API_CONNECT_TIMEOUT, read_timeout=API_READ_TIMEOUT):
+        self.headers = {'Accept': 'application/json',
+                        'Accept-Encoding': 'gzip, deflate',
+                        }
+        self.headers.update(headers or {})
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self._session = None
+        self._lock = threading.Lock()
+
+    def session(self):
+        """ Returns the shared session, creating it on first use."""
+
+        with self._lock:
+            if self._session is None:
+                session = requests.Session()
+                session.headers.update(self.headers)
+                # Connections beyond pool_size are opened when busy but not kept
+                adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                self._session = session
+
+            return self._session
+
+    def get(self, url, headers=None):
+        """ Takes in a url and optional extra headers and returns an ApiResponse.
+
+        JSON bodies are parsed; anything else is returned as text. Connection
+        errors and timeouts raise requests exceptions.
+        """
+
+        response = self.session().get(url, headers=headers, timeout=self.timeout)
+
+        try:
+            body = response.json()
+        except ValueError:
+            body = response.text
+
+        return ApiResponse(response.status_code, body)
+
+    def close(self):
+        """ Closes pooled connections. The next call opens new ones."""
+
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
@@ -0,0 +1,88 @@
+""" Benchmarks ingredient aggregation for large meal plans.
+
+Compares the original one-ingredient-at-a-time dictionary loop with the
+NumPy group-by in aggregation.py at 10, 100 and 1,000 recipes. Usage:
+
+    python benchmarks/bench_aggregation.py
+"""
+
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+import units
+from aggregation import aggregate_ingredient_columns, aggregate_ingredient_lists
+
+RECIPE_COUNTS = (10, 100, 1000)
+INGREDIENTS_PER_RECIPE = 12
+DISTINCT_INGREDIENTS = 400
+UNITS = ['pounds', 'ounces', 'grams', 'tablespoons', 'teaspoons', 'cups', 'servings', 'cloves', '']
+
+
+def make_recipes(count, seed=0):
+    """ Returns count synthetic ingredient lists."""
+
+    rng = random.Random(seed)
+    recipes = []
+
+    for _ in range(count):
+        ingredient_ids = rng.sample(range(1, DISTINCT_INGREDIENTS + 1), INGREDIENTS_PER_RECIPE)
+        recipes.append([{'id': ingredient_id,
+                         'amount': rng.choice([0.25, 0.5, 1, 1.5, 2, 3]),
+                         # Mostly the same unit per ingredient, like real recipes
+                         'unitLong': UNITS[ingredient_id % len(UNITS)] if rng.random() < 0.9 else rng.choice(UNITS),
+                         'name': 'ingredient %s' % ingredient_id,
+                         'aisle': 'Aisle %s' % (ingredient_id % 20),
+                         }
+                        for ingredient_id in ingredient_ids])
+
+    return recipes
+
+
+def legacy_aggregate(ingredient_lists):
+    """ The original aggregation loop, kept for comparison."""
+
+    aggregated_ingredients = {}
+
+    for ingredients in ingredient_lists:
+        for ingredient in ingredients:
+            (converted_amount, base_unit) = units.convert(ingredient['amount'], ingredient['unitLong'])
+
+            if ingredient['id'] not in aggregated_ingredients:
+                aggregated_ingredients[ingredient['id']] = {'quantity': converted_amount, 'unit': base_unit, 'name': ingredient['name'], 'aisle': ingredient['aisle']}
+            else:
+                aggregated_ingredients[ingredient['id']]['quantity'] += converted_amount
+
+    return aggregated_ingredients
+
+
+if __name__ == "__main__":
+    print('%s ingredients per recipe from %s distinct ingredients' % (INGREDIENTS_PER_RECIPE, DISTINCT_INGREDIENTS))
+
+    for count in RECIPE_COUNTS:
+        recipes = make_recipes(count)
+        number = max(1, 2000 // count)
+
+        # The same ingredients already laid out as columns
+        ingredients = [ingredient for recipe in recipes for ingredient in recipe]
+        ingredient_ids = np.array([ingredient['id'] for ingredient in ingredients], dtype=np.int64)
+        amounts = np.array([ingredient['amount'] for ingredient in ingredients], dtype=np.float64)
+        unit_names = [ingredient['unitLong'] for ingredient in ingredients]
+
+        def _details(index):
+            return (ingredients[index]['name'], ingredients[index]['aisle'])
+
+        def _time(func):
+            return min(timeit.repeat(func, repeat=5, number=number)) / number * 1000
+
+        legacy = _time(lambda: legacy_aggregate(recipes))
+        from_dicts = _time(lambda: aggregate_ingredient_lists(recipes))
+        from_columns = _time(lambda: aggregate_ingredient_columns(ingredient_ids, amounts, unit_names, _details))
+
+        print('%5s recipes   dict loop %8.2f ms   numpy from dicts %8.2f ms   numpy from columns %8.2f ms'
+              % (count, legacy, from_dicts, from_columns))
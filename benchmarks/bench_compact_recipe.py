@@ -0,0 +1,91 @@
+""" Benchmarks memory and serialization of compact recipes against JSON dicts.
+
+Generates recipe info with the load test's fake API, parsed from JSON the way
+the app receives it, then compares held-in-memory size, serialized size and
+encode/decode time of the raw dictionaries and of CompactRecipes, plus
+aggregating ingredients from each. The fake payloads are smaller than real
+Spoonacular responses (no nutrition, instructions steps or wine pairing), so
+savings on real data are larger. Usage:
+
+    python benchmarks/bench_compact_recipe.py [recipe count]
+"""
+
+import json
+import os
+import sys
+import timeit
+import zlib
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'loadtest'))
+
+from aggregation import aggregate_ingredient_lists, aggregate_recipes
+from compact_recipe import CompactRecipe, pack, unpack
+from fake_spoonacular import recipe_information
+
+RECIPE_COUNT = 20000
+AGGREGATE_RECIPES = 100
+
+
+def deep_size(obj, seen=None):
+    """ Returns the bytes held by obj and everything it references, counting shared objects once."""
+
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+
+    if isinstance(obj, dict):
+        size += sum(deep_size(key, seen) + deep_size(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple)):
+        size += sum(deep_size(item, seen) for item in obj)
+    elif hasattr(obj, '__slots__'):
+        size += sum(deep_size(getattr(obj, slot), seen) for slot in obj.__slots__ if hasattr(obj, slot))
+
+    return size
+
+
+def time_ms(func, number):
+    return min(timeit.repeat(func, repeat=3, number=number)) / number * 1000
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else RECIPE_COUNT
+
+    # Parsed from JSON so no strings are shared between recipes, as with API responses
+    payloads = [json.dumps(recipe_information(recipe_id)) for recipe_id in range(1, count + 1)]
+    dicts = [json.loads(payload) for payload in payloads]
+    compact = [CompactRecipe.from_info(recipe_info) for recipe_info in dicts]
+
+    print('%s recipes, %.1f ingredients each on average' % (count, sum(len(recipe.ingredient_ids) for recipe in compact) / float(count)))
+
+    print('In memory')
+    print('  %-24s %10.1f MB' % ('JSON dicts', deep_size(dicts) / 1e6))
+    print('  %-24s %10.1f MB' % ('CompactRecipe', deep_size(compact) / 1e6))
+
+    json_zlib = [zlib.compress(payload.encode('utf-8')) for payload in payloads]
+    packed_raw = [pack(recipe, compress=False) for recipe in compact]
+    packed = [pack(recipe) for recipe in compact]
+
+    print('Serialized, average bytes per recipe')
+    for name, blobs in [('JSON', payloads), ('JSON + zlib', json_zlib), ('packed', packed_raw), ('packed + zlib', packed)]:
+        print('  %-24s %10.0f' % (name, sum(len(blob) for blob in blobs) / float(count)))
+
+    sample = range(min(count, 1000))
+    number = 5
+    print('Per recipe, microseconds (encode / decode)')
+    print('  %-24s %10.1f / %.1f' % ('JSON',
+                                     time_ms(lambda: [json.dumps(dicts[i]) for i in sample], number) * 1000 / len(sample),
+                                     time_ms(lambda: [json.loads(payloads[i]) for i in sample], number) * 1000 / len(sample)))
+    print('  %-24s %10.1f / %.1f' % ('packed + zlib',
+                                     time_ms(lambda: [pack(compact[i]) for i in sample], number) * 1000 / len(sample),
+                                     time_ms(lambda: [unpack(packed[i]) for i in sample], number) * 1000 / len(sample)))
+
+    ingredient_lists = [recipe_info['extendedIngredients'] for recipe_info in dicts[:AGGREGATE_RECIPES]]
+    print('Aggregating %s recipes' % AGGREGATE_RECIPES)
+    print('  %-24s %10.2f ms' % ('from JSON dicts', time_ms(lambda: aggregate_ingredient_lists(ingredient_lists), 50)))
+    print('  %-24s %10.2f ms' % ('from CompactRecipes', time_ms(lambda: aggregate_recipes(compact[:AGGREGATE_RECIPES]), 50)))
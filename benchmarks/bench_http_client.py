@@ -0,0 +1,105 @@
+""" Benchmark of API call latency with and without connection pooling.
+
+Compares a new connection per call (what unirest did) with the pooled
+ApiClient, sequentially and with the recipe fan-out's concurrency. Runs
+against a local stand-in server by default; pass a base url to measure
+against another server, where TLS setup makes the difference larger. Usage:
+
+    python benchmarks/bench_http_client.py [base_url]
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+import requests
+
+from api_client import ApiClient
+from fanout import fan_out
+
+CALLS = 200
+WORKERS = 4
+
+# Roughly the size of a recipe information response
+BODY = json.dumps({'id': 1, 'title': 'Recipe', 'extendedIngredients': [{'id': n, 'name': 'ingredient %s' % n, 'amount': 1.5, 'unitLong': 'cups'} for n in range(40)]}).encode('utf-8')
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Buffer each response into one write so keep-alive isn't held up by Nagle
+    wbufsize = -1
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, *args):
+        pass
+
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def start_stand_in():
+    """ Starts the stand-in server in a thread and returns its base url."""
+
+    server = ThreadingServer(('127.0.0.1', 0), StandInHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    return 'http://127.0.0.1:%s' % server.server_port
+
+
+def unpooled_get(url):
+    # A new session per call opens and closes its own connection
+    session = requests.Session()
+    try:
+        return session.get(url, timeout=(3.05, 10)).json()
+    finally:
+        session.close()
+
+
+def run(label, get, urls, workers):
+    start = time.time()
+    if workers == 1:
+        for url in urls:
+            get(url)
+    else:
+        fan_out(get, urls, max_workers=workers)
+    seconds = time.time() - start
+
+    print('%-36s %8.2f ms per call %8.0f calls/s' % (label, seconds / len(urls) * 1000, len(urls) / seconds))
+
+
+if __name__ == "__main__":
+    base_url = sys.argv[1] if len(sys.argv) > 1 else start_stand_in()
+    urls = ['%s/recipes/%s/information?includeNutrition=false' % (base_url, n) for n in range(CALLS)]
+
+    client = ApiClient(pool_size=WORKERS)
+    pooled_get = lambda url: client.get(url).body
+
+    # Warm up both paths once
+    unpooled_get(urls[0])
+    pooled_get(urls[0])
+
+    print('%s calls to %s' % (CALLS, base_url))
+    run('new connection per call', unpooled_get, urls, 1)
+    run('pooled keep-alive', pooled_get, urls, 1)
+    run('new connection per call, %s workers' % WORKERS, unpooled_get, urls, WORKERS)
+    run('pooled keep-alive, %s workers' % WORKERS, pooled_get, urls, WORKERS)
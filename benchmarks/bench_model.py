@@ -0,0 +1,203 @@
+""" Regression benchmarks for model.py hot functions.
+
+Seeds synthetic users, recipes, inventories and shopping lists at several
+scales (10, 1k and 100k inventory rows), then times each hot function and
+counts the SQL statements it runs. User.get_current_inventory is timed both
+from the cached inventory snapshot and cold, with the snapshot cache
+cleared before each call. Results are compared with a JSON
+baseline; the run fails when a function is slower than its baseline by more
+than the threshold, or runs more statements. Usage:
+
+    createdb benchfood
+    python benchmarks/bench_model.py --update-baseline   # record a baseline
+    python benchmarks/bench_model.py --threshold 0.25    # compare against it
+
+Timings depend on the machine, so record the baseline on the machine that
+runs the comparison.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+from helpers import BENCH_DB_URI, QueryCounter, connect_bench_db
+
+import model
+from model import db, User, ShoppingList
+from model import convert_to_base_unit, aggregate_ingredients
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# Inventory rows in the whole table at each scale
+SCALES = [10, 1000, 100000]
+
+# Each user holds at most this many ingredients; larger scales add users
+MAX_INGREDIENTS_PER_USER = 1000
+
+RECIPES = 20
+INGREDIENTS_PER_RECIPE = 12
+RECIPES_PER_CALL = 5
+
+UNITS = ['tablespoons', 'teaspoons', 'cups', 'ounces', 'pounds', 'grams', 'servings']
+
+REPEAT = 20
+
+
+def seed(scale):
+    """ Seeds scale inventory rows and returns the benchmark user, shopping list and recipe ids."""
+
+    ingredient_count = min(scale, MAX_INGREDIENTS_PER_USER)
+    user_count = max(1, scale // ingredient_count)
+
+    db.engine.execute("""INSERT INTO users (username, password)
+                         SELECT 'user' || n, '' FROM generate_series(1, %(users)s) n""", {'users': user_count})
+    db.engine.execute("""INSERT INTO ingredients (ingredient_id, ingredient_name, base_unit, ingredient_aisle)
+                         SELECT n, 'ingredient ' || n, 'teaspoons', 'Aisle ' || (n %% 20)
+                         FROM generate_series(1, %(ingredients)s) n""", {'ingredients': ingredient_count})
+    db.engine.execute("""INSERT INTO inventory (user_id, ingredient_id, current_quantity)
+                         SELECT u, i, CASE WHEN i %% 3 = 0 THEN 0 ELSE i END
+                         FROM generate_series(1, %(users)s) u, generate_series(1, %(ingredients)s) i""",
+                      {'users': user_count, 'ingredients': ingredient_count})
+    db.engine.execute("""INSERT INTO shopping_lists (user_id, has_shopped)
+                         SELECT u, false FROM generate_series(1, %(users)s) u""", {'users': user_count})
+    db.engine.execute("""INSERT INTO shopping_list_ingredients (shopping_list_id, ingredient_id, aggregate_quantity)
+                         SELECT l, i, 1.5 FROM generate_series(1, %(users)s) l, generate_series(1, %(ingredients)s) i""",
+                      {'users': user_count, 'ingredients': ingredient_count})
+
+    recipe_ids = list(range(1, RECIPES + 1))
+    for recipe_id in recipe_ids:
+        ingredients = [{'id': (recipe_id * 7 + n) % ingredient_count + 1,
+                        'amount': 1.5,
+                        'unit': UNITS[n % len(UNITS)],
+                        'unitLong': UNITS[n % len(UNITS)],
+                        'name': 'ingredient %s' % ((recipe_id * 7 + n) % ingredient_count + 1),
+                        'aisle': 'Aisle %s' % (n % 20),
+                        }
+                       for n in range(INGREDIENTS_PER_RECIPE)]
+        recipe_info = {'id': recipe_id, 'title': 'Recipe %s' % recipe_id, 'image': None, 'servings': 2,
+                       'extendedIngredients': ingredients}
+
+        # Stored summaries and cached info keep the API out of every path
+        recipe = model.Recipe(recipe_id=recipe_id)
+        recipe.set_summary(recipe_info)
+        db.session.add(recipe)
+        model.recipe_cache.store(recipe_id, recipe_info)
+    db.session.commit()
+
+    db.engine.execute("ANALYZE")
+
+    return (User.query.get(user_count), ShoppingList.query.get(user_count), recipe_ids)
+
+
+def time_function(func):
+    """ Returns (median milliseconds, statements per call) over REPEAT calls after one warm-up."""
+
+    func()
+    timings = []
+
+    with QueryCounter() as counter:
+        for _ in range(REPEAT):
+            start = time.time()
+            func()
+            timings.append(time.time() - start)
+
+    timings.sort()
+    return (timings[len(timings) // 2] * 1000, counter.count / float(REPEAT))
+
+
+def run_scale(scale):
+    """ Seeds one scale and returns {function: {'ms': median, 'statements': count}}."""
+
+    db.drop_all()
+    db.create_all()
+    # Snapshots are keyed by user id and version, which repeat at every scale
+    model.inventory_snapshots.clear()
+    (user, shopping_list, recipe_ids) = seed(scale)
+    inventory = user.get_current_inventory()
+
+    def _cold_inventory():
+        model.inventory_snapshots.clear()
+        return user.get_current_inventory()
+
+    def _convert():
+        for (quantity, unit, name) in inventory:
+            convert_to_base_unit(quantity, unit)
+
+    functions = [('convert_to_base_unit', _convert),
+                 ('aggregate_ingredients', lambda: aggregate_ingredients([(recipe_id,) for recipe_id in recipe_ids])),
+                 ('User.get_current_inventory', user.get_current_inventory),
+                 ('User.get_current_inventory (cold)', _cold_inventory),
+                 ('ShoppingList.get_ingredients', shopping_list.get_ingredients),
+                 ('User.get_used_and_missing_ingredients', lambda: user.get_used_and_missing_ingredients(recipe_ids[:RECIPES_PER_CALL])),
+                 ]
+
+    results = {}
+    for name, func in functions:
+        (ms, statements) = time_function(func)
+        results[name] = {'ms': round(ms, 3), 'statements': statements}
+
+    db.session.remove()
+
+    return results
+
+
+def compare(results, baseline, threshold):
+    """ Prints results next to the baseline and returns a list of regressions."""
+
+    regressions = []
+
+    for scale in sorted(results, key=int):
+        print('%s inventory rows' % scale)
+        for name in sorted(results[scale]):
+            result = results[scale][name]
+            previous = baseline.get(scale, {}).get(name)
+
+            if previous is None:
+                print('  %-40s %9.3f ms %6.1f statements (no baseline)' % (name, result['ms'], result['statements']))
+                continue
+
+            change = (result['ms'] - previous['ms']) / previous['ms'] if previous['ms'] else 0.0
+            print('  %-40s %9.3f ms %6.1f statements (%+.0f%% vs %.3f ms, %s statements)' % (
+                name, result['ms'], result['statements'], change * 100, previous['ms'], previous['statements']))
+
+            if change > threshold:
+                regressions.append('%s at %s rows: %.3f ms vs baseline %.3f ms' % (name, scale, result['ms'], previous['ms']))
+            if result['statements'] > previous['statements']:
+                regressions.append('%s at %s rows: %s statements vs baseline %s' % (name, scale, result['statements'], previous['statements']))
+
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark model.py hot functions against a baseline.')
+    parser.add_argument('--scales', type=int, nargs='+', default=SCALES, help='inventory rows to seed')
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed slowdown as a fraction of the baseline')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--update-baseline', action='store_true', help='save these results as the baseline')
+    args = parser.parse_args()
+
+    app = connect_bench_db()
+    print('Benchmarking against %s, median of %s calls' % (BENCH_DB_URI, REPEAT))
+
+    # JSON keys are strings, so scales are keyed as strings throughout
+    results = dict((str(scale), run_scale(scale)) for scale in args.scales)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    regressions = compare(results, baseline, args.threshold)
+
+    if args.update_baseline:
+        baseline.update(results)
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(baseline, baseline_file, indent=2, sort_keys=True)
+        print('Saved baseline to %s' % args.baseline)
+    elif regressions:
+        print('Regressions past %.0f%%:' % (args.threshold * 100))
+        for regression in regressions:
+            print('  ' + regression)
+        sys.exit(1)
@@ -0,0 +1,60 @@
+""" Micro-benchmark of unit conversion.
+
+Compares the original if/elif convert_to_base_unit with the precompiled
+registry in units.py, one ingredient at a time and as a whole recipe. Usage:
+
+    python benchmarks/bench_unit_conversion.py
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import units
+
+REPEAT = 5
+NUMBER = 20000
+
+# A typical recipe's units, including some the original function didn't know
+RECIPE = [{'amount': 1.5, 'unitLong': unit}
+          for unit in ['pounds', 'tablespoons', 'cups', 'Tbsp', 'ounces', 'grams',
+                       'teaspoons', 'servings', 'cloves', 'lb', 'ml', '']]
+
+
+def legacy_convert_to_base_unit(amount, input_unit):
+    """ The original if/elif conversion, kept for comparison."""
+
+    if input_unit.lower() in ['lb', 'pounds', 'pound']:
+        new_amount = amount * 16.00
+        return (new_amount, 'ounces')
+    elif input_unit.lower() in ['tbsp', 'tablespoons', 'tbs', 'tbsps', 'tablespoon']:
+        new_amount = amount * 3.00
+        return (new_amount, 'teaspoons')
+    else:
+        return (amount, input_unit)
+
+
+def legacy_recipe():
+    return [legacy_convert_to_base_unit(ingredient['amount'], ingredient['unitLong']) for ingredient in RECIPE]
+
+
+def registry_recipe():
+    return [units.convert(ingredient['amount'], ingredient['unitLong']) for ingredient in RECIPE]
+
+
+def batch_recipe():
+    return units.convert_ingredients(RECIPE)
+
+
+def report(label, func):
+    best = min(timeit.repeat(func, repeat=REPEAT, number=NUMBER))
+    print('%-28s %8.2f us per recipe' % (label, best / NUMBER * 10 ** 6))
+
+
+if __name__ == "__main__":
+    print('%s ingredients per recipe, best of %s x %s runs' % (len(RECIPE), REPEAT, NUMBER))
+    report('if/elif (before)', legacy_recipe)
+    report('registry, one at a time', registry_recipe)
+    report('registry, batch', batch_recipe)
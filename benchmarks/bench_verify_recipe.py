@@ -0,0 +1,111 @@
+""" Benchmarks the cook path behind /verify_recipe.json.
+
+Compares the original route, which fetched recipe info and then queried and
+updated inventory one ingredient at a time, with cook_recipe's single locked
+read and bulk update. Usage:
+
+    createdb benchfood
+    python benchmarks/bench_verify_recipe.py [number of ingredients]
+"""
+
+import sys
+
+from helpers import connect_bench_db, measure, print_row
+
+import model
+from model import db, User, Recipe, UserRecipe, Ingredient, Inventory
+from model import convert_to_base_unit, cook_recipe, recipe_info_by_id
+
+REPEAT = 50
+
+
+def seed(ingredient_count):
+    """ Adds a user with plenty of every ingredient of one recipe."""
+
+    user = User(username='cook', password='')
+    ingredients = [{'id': ingredient_id,
+                    'amount': 1.5,
+                    'unit': 'tbsp',
+                    'unitLong': 'tablespoons',
+                    'name': 'ingredient %s' % ingredient_id,
+                    'aisle': 'Baking',
+                    }
+                   for ingredient_id in range(1, ingredient_count + 1)]
+    recipe_info = {'id': 1, 'title': 'Benchmark Recipe', 'image': None, 'servings': 1, 'extendedIngredients': ingredients}
+
+    recipe = Recipe(recipe_id=1)
+    recipe.set_summary(recipe_info)
+    db.session.add_all([user, recipe])
+    db.session.add_all([Ingredient(ingredient_id=ingredient['id'], ingredient_name=ingredient['name'], base_unit='teaspoons')
+                        for ingredient in ingredients])
+    db.session.commit()
+
+    db.session.add_all([Inventory(user_id=user.user_id, ingredient_id=ingredient['id'], current_quantity=10 ** 9)
+                        for ingredient in ingredients])
+    db.session.commit()
+
+    return (user.user_id, recipe_info)
+
+
+def legacy_verify_recipe(user_id, recipe_id):
+    """ The original /verify_recipe.json logic, kept for comparison."""
+
+    recipe_details = recipe_info_by_id(int(recipe_id))
+
+    for ingredient in recipe_details['extendedIngredients']:
+        check_ingredient = Inventory.query.filter(Inventory.ingredient_id == int(ingredient['id']), Inventory.user_id == user_id).first()
+
+        if not check_ingredient:
+            return False
+        if ingredient['unitLong'] != check_ingredient.ingredients.base_unit:
+            (converted_amount, converted_unit) = convert_to_base_unit(float(ingredient['amount']), ingredient['unitLong'])
+            if check_ingredient.current_quantity < converted_amount:
+                return False
+        else:
+            if check_ingredient.current_quantity < round(float(ingredient['amount']), 2):
+                return False
+
+    for ingredient in recipe_details['extendedIngredients']:
+        update_ingredient = Inventory.query.filter(Inventory.ingredient_id == int(ingredient['id']), Inventory.user_id == user_id).one()
+
+        if ingredient['unitLong'] != update_ingredient.ingredients.base_unit:
+            (converted_amount, converted_unit) = convert_to_base_unit(float(ingredient['amount']), ingredient['unitLong'])
+            update_ingredient.current_quantity -= converted_amount
+        else:
+            update_ingredient.current_quantity -= round(float(ingredient['amount']), 2)
+
+    db.session.commit()
+
+    return True
+
+
+def reset_recipe_status(user_id):
+    """ Puts the benchmark recipe back in progress so every run marks it cooked."""
+
+    db.session.query(UserRecipe).filter(UserRecipe.user_id == user_id).delete()
+    db.session.add(UserRecipe(user_id=user_id, recipe_id=1, status='in_progress'))
+    db.session.commit()
+
+
+if __name__ == "__main__":
+    ingredient_count = int(sys.argv[1]) if len(sys.argv) > 1 else 12
+
+    app = connect_bench_db()
+    (user_id, recipe_info) = seed(ingredient_count)
+
+    # Warm the recipe info cache so neither path pays for the API
+    model.recipe_cache.memory.set(1, recipe_info)
+
+    print('Cooking a recipe with %s ingredients, %s runs each' % (ingredient_count, REPEAT))
+
+    def _legacy():
+        reset_recipe_status(user_id)
+        legacy_verify_recipe(user_id, 1)
+
+    def _bulk():
+        reset_recipe_status(user_id)
+        cook_recipe(user_id, 1)
+
+    # Each run also pays 3 statements to reset the recipe status
+    print_row('per-ingredient (before)', *measure(_legacy, REPEAT))
+    print_row('locked bulk update (after)', *measure(_bulk, REPEAT))
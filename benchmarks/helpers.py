@@ -0,0 +1,65 @@
+""" Shared setup for benchmark scripts.
+
+Benchmarks import the app's modules from the project root and run against a
+scratch PostgreSQL database (benchfood by default) that they drop and
+recreate, so never point them at real data.
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy import event
+
+from model import connect_to_db, db
+
+BENCH_DB_URI = os.environ.get('BENCH_DATABASE_URL', 'postgresql:///benchfood')
+
+
+def connect_bench_db():
+    """ Connects to the benchmark database, recreates its tables and returns the app."""
+
+    app = Flask(__name__)
+    connect_to_db(app, BENCH_DB_URI)
+    db.drop_all()
+    db.create_all()
+
+    return app
+
+
+class QueryCounter(object):
+    """ Counts SQL statements run on the database while in use."""
+
+    def __enter__(self):
+        self.count = 0
+        event.listen(db.engine, 'before_cursor_execute', self._count)
+        return self
+
+    def __exit__(self, *args):
+        event.remove(db.engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self.count += 1
+
+
+def measure(func, repeat):
+    """ Calls func repeat times and returns (statements per call, mean seconds, max seconds)."""
+
+    timings = []
+
+    with QueryCounter() as counter:
+        for _ in range(repeat):
+            start = time.time()
+            func()
+            timings.append(time.time() - start)
+
+    return (counter.count / float(repeat), sum(timings) / len(timings), max(timings))
+
+
+def print_row(label, statements, mean, slowest):
+    """ Prints one line of benchmark results."""
+
+    print('%-32s %8.1f statements %9.2f ms mean %9.2f ms max' % (label, statements, mean * 1000, slowest * 1000))
@@ -0,0 +1,116 @@
+""" In-process caches for application."""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """ Thread-safe least recently used cache with size and age limits.
+
+    Entries older than max_age seconds are dropped on lookup. When the cache
+    holds max_size entries, adding a new one evicts the least recently used.
+    """
+
+    def __init__(self, max_size, max_age, clock=time.time):
+        self.max_size = max_size
+        self.max_age = max_age
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_entry(self, key):
+        """ Returns (value, stored_at) for key, or None if missing or expired."""
+
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            if self.clock() - entry[1] > self.max_age:
+                return None
+            # Re-insert to mark as most recently used
+            self._entries[key] = entry
+            return entry
+
+    def get(self, key, default=None):
+        """ Returns value for key, or default if missing or expired."""
+
+        entry = self.get_entry(key)
+        if entry is None:
+            return default
+        return entry[0]
+
+    def set(self, key, value, stored_at=None):
+        """ Stores value for key, evicting the oldest entry if full."""
+
+        if stored_at is None:
+            stored_at = self.clock()
+
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, stored_at)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        """ Removes key from cache if present."""
+
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """ Removes all entries."""
+
+        with self._lock:
+            self._entries.clear()
+
+
+class _Call(object):
+    """ One in-flight call shared by SingleFlight callers."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """ Coalesces concurrent calls that share a key into one.
+
+    The first caller for a key runs the function; callers arriving while it
+    runs wait for it and get the same result or exception.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func):
+        """ Returns func(), or the result of the call already running for key."""
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            call.value = func()
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.value
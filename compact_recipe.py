@@ -0,0 +1,259 @@
+""" Compact in-memory and binary forms of recipe info.
+
+API recipe info carries far more than the app reads. CompactRecipe keeps
+only the display fields the templates use and, per ingredient, the id,
+amount, unit, unitLong, name and aisle. Ingredients are held as columns:
+ids and amounts in typed arrays, and the strings shared through an intern
+table, since the same names, units and aisles repeat across thousands of
+recipes. pack() and unpack() convert to and from a struct-packed,
+zlib-compressed binary form for the recipe_cache table.
+"""
+
+import struct
+import zlib
+from array import array
+
+TEXT_FIELDS = ('title', 'image', 'sourceName', 'sourceUrl', 'instructions')
+NUMBER_FIELDS = ('servings', 'readyInMinutes', 'preparationMinutes')
+DISPLAY_FIELDS = TEXT_FIELDS + NUMBER_FIELDS
+
+INGREDIENT_FIELDS = ('id', 'amount', 'unit', 'unitLong', 'name', 'aisle')
+
+FORMAT_VERSION = 1
+
+# Length or index standing in for None
+NONE = 0xffffffff
+
+_strings = {}
+
+
+def _intern(value):
+    """ Returns the one shared copy of an ingredient string."""
+
+    return _strings.setdefault(value, value)
+
+
+class Ingredient(object):
+    """ One ingredient of a CompactRecipe, readable like an API ingredient dictionary."""
+
+    __slots__ = INGREDIENT_FIELDS
+
+    def __init__(self, ingredient_id, amount, unit, unit_long, name, aisle):
+        self.id = ingredient_id
+        self.amount = amount
+        self.unit = unit
+        self.unitLong = unit_long
+        self.name = name
+        self.aisle = aisle
+
+    def __getitem__(self, field):
+        if field not in INGREDIENT_FIELDS:
+            raise KeyError(field)
+        return getattr(self, field)
+
+    def get(self, field, default=None):
+        return getattr(self, field, default) if field in INGREDIENT_FIELDS else default
+
+    def to_dict(self):
+        return dict((field, getattr(self, field)) for field in INGREDIENT_FIELDS)
+
+
+class CompactRecipe(object):
+    """ Recipe info projected to the fields the app uses.
+
+    Reads like the API's recipe info dictionary (recipe['title'],
+    'sourceName' in recipe, recipe['extendedIngredients']) so templates and
+    callers work with either. Fields missing from the API response stay
+    missing.
+    """
+
+    __slots__ = ('id',) + DISPLAY_FIELDS + ('ingredient_ids', 'amounts', 'units', 'unit_longs', 'names', 'aisles')
+
+    def __init__(self, recipe_id, fields, ingredient_ids, amounts, units, unit_longs, names, aisles):
+        self.id = recipe_id
+        for field, value in fields.items():
+            setattr(self, field, value)
+
+        self.ingredient_ids = ingredient_ids
+        self.amounts = amounts
+        self.units = units
+        self.unit_longs = unit_longs
+        self.names = names
+        self.aisles = aisles
+
+    @classmethod
+    def from_info(cls, recipe_info):
+        """ Takes in an API recipe info dictionary and returns a CompactRecipe."""
+
+        ingredients = recipe_info.get('extendedIngredients') or []
+        recipe_id = recipe_info.get('id')
+
+        return cls(int(recipe_id) if recipe_id is not None else None,
+                   dict((field, recipe_info[field]) for field in DISPLAY_FIELDS if field in recipe_info),
+                   array('l', [int(ingredient['id']) for ingredient in ingredients]),
+                   array('d', [float(ingredient.get('amount') or 0) for ingredient in ingredients]),
+                   tuple(_intern(ingredient.get('unit')) for ingredient in ingredients),
+                   tuple(_intern(ingredient.get('unitLong')) for ingredient in ingredients),
+                   tuple(_intern(ingredient.get('name')) for ingredient in ingredients),
+                   tuple(_intern(ingredient.get('aisle')) for ingredient in ingredients),
+                   )
+
+    @property
+    def ingredients(self):
+        """ Returns the ingredients as a list of Ingredient records."""
+
+        return [Ingredient(*columns) for columns in zip(self.ingredient_ids, self.amounts, self.units,
+                                                        self.unit_longs, self.names, self.aisles)]
+
+    def __getitem__(self, field):
+        if field == 'extendedIngredients':
+            return self.ingredients
+        if field == 'id' or field in DISPLAY_FIELDS:
+            try:
+                return getattr(self, field)
+            except AttributeError:
+                pass
+        raise KeyError(field)
+
+    def __contains__(self, field):
+        if field == 'extendedIngredients':
+            return True
+        return (field == 'id' or field in DISPLAY_FIELDS) and hasattr(self, field)
+
+    def get(self, field, default=None):
+        try:
+            return self[field]
+        except KeyError:
+            return default
+
+    def to_info(self):
+        """ Returns the recipe as a recipe info dictionary."""
+
+        recipe_info = dict((field, getattr(self, field)) for field in DISPLAY_FIELDS if hasattr(self, field))
+        recipe_info['id'] = self.id
+        recipe_info['extendedIngredients'] = [ingredient.to_dict() for ingredient in self.ingredients]
+
+        return recipe_info
+
+
+def as_compact(recipe_info):
+    """ Returns recipe_info as a CompactRecipe, converting API dictionaries."""
+
+    if isinstance(recipe_info, CompactRecipe):
+        return recipe_info
+
+    return CompactRecipe.from_info(recipe_info)
+
+
+def _pack_text(parts, value):
+    if value is None:
+        parts.append(struct.pack('<I', NONE))
+    else:
+        data = value.encode('utf-8')
+        parts.append(struct.pack('<I', len(data)))
+        parts.append(data)
+
+
+def _unpack_text(data, offset):
+    (length,) = struct.unpack_from('<I', data, offset)
+    offset += 4
+    if length == NONE:
+        return (None, offset)
+
+    return (data[offset:offset + length].decode('utf-8'), offset + length)
+
+
+def pack(recipe, compress=True):
+    """ Returns a CompactRecipe in binary form.
+
+    Layout, little-endian: version, recipe id, a bitmask of the display
+    fields present, then each present text field (length and UTF-8 bytes)
+    and number (a double, NaN for None); then the ingredient count, ids,
+    amounts, a table of the distinct ingredient strings and, per
+    ingredient, the table index of its unit, unitLong, name and aisle.
+    """
+
+    present = [field for field in DISPLAY_FIELDS if hasattr(recipe, field)]
+    mask = sum(1 << DISPLAY_FIELDS.index(field) for field in present)
+    parts = [struct.pack('<BqH', FORMAT_VERSION, recipe.id, mask)]
+
+    for field in present:
+        value = getattr(recipe, field)
+        if field in TEXT_FIELDS:
+            _pack_text(parts, value)
+        else:
+            parts.append(struct.pack('<d', float('nan') if value is None else value))
+
+    count = len(recipe.ingredient_ids)
+    parts.append(struct.pack('<I', count))
+    parts.append(struct.pack('<%sq' % count, *recipe.ingredient_ids))
+    parts.append(struct.pack('<%sd' % count, *recipe.amounts))
+
+    table = {}
+    strings = []
+    indexes = []
+    for column in (recipe.units, recipe.unit_longs, recipe.names, recipe.aisles):
+        for value in column:
+            if value is None:
+                indexes.append(NONE)
+                continue
+            if value not in table:
+                table[value] = len(strings)
+                strings.append(value)
+            indexes.append(table[value])
+
+    parts.append(struct.pack('<I', len(strings)))
+    for value in strings:
+        _pack_text(parts, value)
+    parts.append(struct.pack('<%sI' % len(indexes), *indexes))
+
+    body = b''.join(parts)
+    if compress:
+        return b'z' + zlib.compress(body)
+
+    return b'r' + body
+
+
+def unpack(data):
+    """ Takes in the output of pack() and returns a CompactRecipe."""
+
+    # Database drivers may hand back a buffer or memoryview
+    data = bytes(data)
+    body = zlib.decompress(data[1:]) if data[:1] == b'z' else data[1:]
+
+    (version, recipe_id, mask) = struct.unpack_from('<BqH', body, 0)
+    if version != FORMAT_VERSION:
+        raise ValueError('Unknown packed recipe version %s' % version)
+    offset = struct.calcsize('<BqH')
+
+    fields = {}
+    for bit, field in enumerate(DISPLAY_FIELDS):
+        if not mask & (1 << bit):
+            continue
+        if field in TEXT_FIELDS:
+            (fields[field], offset) = _unpack_text(body, offset)
+        else:
+            (value,) = struct.unpack_from('<d', body, offset)
+            offset += 8
+            # Whole numbers came from JSON integers
+            fields[field] = None if value != value else (int(value) if value.is_integer() else value)
+
+    (count,) = struct.unpack_from('<I', body, offset)
+    offset += 4
+    ingredient_ids = array('l', struct.unpack_from('<%sq' % count, body, offset))
+    offset += 8 * count
+    amounts = array('d', struct.unpack_from('<%sd' % count, body, offset))
+    offset += 8 * count
+
+    (string_count,) = struct.unpack_from('<I', body, offset)
+    offset += 4
+    strings = []
+    for _ in range(string_count):
+        (value, offset) = _unpack_text(body, offset)
+        strings.append(_intern(value))
+
+    indexes = struct.unpack_from('<%sI' % (4 * count), body, offset)
+    columns = [tuple(None if index == NONE else strings[index] for index in indexes[start:start + count])
+               for start in range(0, 4 * count, count or 1)] if count else [(), (), (), ()]
+
+    return CompactRecipe(recipe_id, fields, ingredient_ids, amounts, *columns)
@@ -0,0 +1,186 @@
+""" Bounded-concurrency fan-out for slow calls such as API requests."""
+
+import logging
+import threading
+import time
+
+try:
+    from Queue import Queue, Empty
+except ImportError:
+    from queue import Queue, Empty
+
+logger = logging.getLogger(__name__)
+
+
+def fan_out(func, items, max_workers=4, timeout=None):
+    """ Calls func once per item on up to max_workers threads.
+
+    Returns a list of results in the same order as items. If a call raises, or
+    has not finished timeout seconds after fan_out was called, its result is
+    None so callers can keep whatever did come back.
+    """
+
+    items = list(items)
+    results = [None] * len(items)
+
+    if not items:
+        return results
+
+    deadline = time.time() + timeout if timeout is not None else None
+
+    def _call(index, item):
+        try:
+            results[index] = func(item)
+        except Exception:
+            logger.exception('Fan-out call failed for %r', item)
+
+    # Without a deadline to enforce, a single call is not worth a thread
+    if deadline is None and (len(items) == 1 or max_workers <= 1):
+        for index, item in enumerate(items):
+            _call(index, item)
+        return results
+
+    pending = Queue()
+    for index, item in enumerate(items):
+        pending.put((index, item))
+
+    def _worker():
+        while deadline is None or time.time() < deadline:
+            try:
+                (index, item) = pending.get_nowait()
+            except Empty:
+                return
+            _call(index, item)
+
+    workers = []
+    for _ in range(min(max_workers, len(items))):
+        worker = threading.Thread(target=_worker)
+        worker.daemon = True
+        worker.start()
+        workers.append(worker)
+
+    for worker in workers:
+        if deadline is None:
+            worker.join()
+        else:
+            worker.join(max(deadline - time.time(), 0))
+
+    if any(worker.is_alive() for worker in workers):
+        logger.warning('Fan-out deadline of %ss passed with calls still running', timeout)
+
+    # Copy so late finishers cannot change what the caller already has
+    return list(results)
+
+
+def fan_out_iter(func, items, max_workers=4, timeout=None):
+    """ Calls func once per item on up to max_workers threads, yielding results in order.
+
+    Like fan_out, but each result is yielded as soon as it and every result
+    before it are ready, so callers can start on the first items while later
+    ones are still running. Failed calls, and calls not finished timeout
+    seconds after the first result was asked for, yield None.
+    """
+
+    items = list(items)
+    if not items:
+        return
+
+    deadline = time.time() + timeout if timeout is not None else None
+
+    results = {}
+    finished = threading.Condition()
+
+    pending = Queue()
+    for index, item in enumerate(items):
+        pending.put((index, item))
+
+    def _worker():
+        while deadline is None or time.time() < deadline:
+            try:
+                (index, item) = pending.get_nowait()
+            except Empty:
+                return
+            try:
+                result = func(item)
+            except Exception:
+                logger.exception('Fan-out call failed for %r', item)
+                result = None
+            with finished:
+                results[index] = result
+                finished.notify_all()
+
+    for _ in range(min(max_workers, len(items))):
+        worker = threading.Thread(target=_worker)
+        worker.daemon = True
+        worker.start()
+
+    for index in range(len(items)):
+        with finished:
+            while index not in results:
+                if deadline is None:
+                    finished.wait()
+                    continue
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                finished.wait(remaining)
+            result = results.get(index)
+
+        if index not in results:
+            logger.warning('Fan-out deadline of %ss passed with calls still running', timeout)
+            # Past the deadline, only what has already finished is used
+            with finished:
+                late_results = [results.get(late_index) for late_index in range(index, len(items))]
+            for late_result in late_results:
+                yield late_result
+            return
+
+        yield result
+
+
+def fan_out_as_completed(func, items, max_workers=4, timeout=None):
+    """ Calls func once per item on up to max_workers threads, yielding
+    (index, result) pairs in the order the calls finish.
+
+    Failed calls yield None as their result. Calls not finished timeout
+    seconds after the first result was asked for are not yielded at all.
+    """
+
+    items = list(items)
+    if not items:
+        return
+
+    deadline = time.time() + timeout if timeout is not None else None
+
+    pending = Queue()
+    for index, item in enumerate(items):
+        pending.put((index, item))
+    completed = Queue()
+
+    def _worker():
+        while deadline is None or time.time() < deadline:
+            try:
+                (index, item) = pending.get_nowait()
+            except Empty:
+                return
+            try:
+                result = func(item)
+            except Exception:
+                logger.exception('Fan-out call failed for %r', item)
+                result = None
+            completed.put((index, result))
+
+    for _ in range(min(max_workers, len(items))):
+        worker = threading.Thread(target=_worker)
+        worker.daemon = True
+        worker.start()
+
+    for _ in range(len(items)):
+        try:
+            if deadline is None:
+                yield completed.get()
+            else:
+                yield completed.get(timeout=max(deadline - time.time(), 0))
+        except Empty:
+            logger.warning('Fan-out deadline of %ss passed with calls still running', timeout)
+            return
@@ -0,0 +1,122 @@
+""" Bulk "can I cook this now" checks.
+
+Recipes are held as a sparse recipes x ingredients matrix of required
+quantities in base units, in compressed sparse row form (row pointers,
+ingredient columns, quantities) built with NumPy. A user's inventory becomes
+a dense vector over the same ingredient columns, so the sufficiency and
+shortfall of every recipe come out of one vectorized pass over the matrix.
+"""
+
+import numpy as np
+
+from recipe_index import required_quantities
+
+
+class RequirementMatrix(object):
+    """ Sparse recipes x ingredients matrix of required quantities."""
+
+    def __init__(self, recipes):
+        """ Takes in a list of (recipe id, ingredients) with API-style ingredients."""
+
+        self.recipe_ids = []
+        self.ingredient_ids = []
+        self._rows = {}
+        self._columns = {}
+
+        indptr = [0]
+        indices = []
+        data = []
+
+        for recipe_id, ingredients in recipes:
+            recipe_id = int(recipe_id)
+            if recipe_id in self._rows:
+                continue
+            self._rows[recipe_id] = len(self.recipe_ids)
+            self.recipe_ids.append(recipe_id)
+
+            for ingredient_id, quantity in sorted(required_quantities(ingredients or []).items()):
+                if ingredient_id not in self._columns:
+                    self._columns[ingredient_id] = len(self.ingredient_ids)
+                    self.ingredient_ids.append(ingredient_id)
+                indices.append(self._columns[ingredient_id])
+                data.append(quantity)
+            indptr.append(len(indices))
+
+        self.indptr = np.array(indptr, dtype=np.int64)
+        self.indices = np.array(indices, dtype=np.int64)
+        self.data = np.array(data, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.recipe_ids)
+
+    def requirements(self, recipe_id):
+        """ Returns a dictionary of ingredient id to required quantity for one recipe."""
+
+        row = self._rows[int(recipe_id)]
+        (start, end) = (self.indptr[row], self.indptr[row + 1])
+
+        return dict((self.ingredient_ids[column], float(quantity))
+                    for column, quantity in zip(self.indices[start:end], self.data[start:end]))
+
+    def inventory_vector(self, inventory_quantities):
+        """ Returns (quantities, present) dense vectors over the matrix's ingredients.
+
+        Takes in a dictionary of ingredient id to current quantity; present is
+        False for ingredients the user has no inventory row for.
+        """
+
+        quantities = np.zeros(len(self.ingredient_ids), dtype=np.float64)
+        present = np.zeros(len(self.ingredient_ids), dtype=bool)
+
+        for ingredient_id, quantity in inventory_quantities.items():
+            column = self._columns.get(ingredient_id)
+            if column is not None:
+                quantities[column] = quantity
+                present[column] = True
+
+        return (quantities, present)
+
+    def check(self, inventory_quantities):
+        """ Checks every recipe against inventory and returns a Feasibility."""
+
+        (quantities, present) = self.inventory_vector(inventory_quantities)
+
+        # Missing ingredients fall short by the whole requirement
+        have = quantities[self.indices]
+        short = ~present[self.indices] | (have < self.data)
+        shortfall = np.where(present[self.indices], np.maximum(self.data - have, 0), self.data)
+        shortfall[~short] = 0
+
+        rows = np.repeat(np.arange(len(self.recipe_ids)), np.diff(self.indptr))
+        short_counts = np.bincount(rows[short], minlength=len(self.recipe_ids))
+
+        return Feasibility(self, short_counts == 0, shortfall)
+
+
+class Feasibility(object):
+    """ Result of checking a RequirementMatrix against one inventory."""
+
+    def __init__(self, matrix, feasible, shortfall):
+        self.matrix = matrix
+        self.feasible = feasible
+        self.shortfall = shortfall
+
+    def is_feasible(self, recipe_id):
+        """ Returns True if inventory covers every ingredient of recipe_id."""
+
+        return bool(self.feasible[self.matrix._rows[int(recipe_id)]])
+
+    def feasible_ids(self):
+        """ Returns ids of recipes inventory fully covers, in matrix order."""
+
+        return [recipe_id for recipe_id, feasible in zip(self.matrix.recipe_ids, self.feasible) if feasible]
+
+    def shortfalls(self, recipe_id):
+        """ Returns a dictionary of ingredient id to how much more recipe_id needs."""
+
+        row = self.matrix._rows[int(recipe_id)]
+        (start, end) = (self.matrix.indptr[row], self.matrix.indptr[row + 1])
+
+        return dict((self.matrix.ingredient_ids[column], float(amount))
+                    for column, amount in zip(self.matrix.indices[start:end], self.shortfall[start:end])
+                    if amount > 0)
@@ -0,0 +1,286 @@
+""" Per-request instrumentation for SQL statements, API calls and cache lookups.
+
+Every request gets a RequestStats object that counts SQL statements (through
+SQLAlchemy engine events), API calls and recipe cache lookups made while
+handling it. When the request finishes, the stats are written as one JSON log
+line and added to process-wide metrics served at /metrics in Prometheus text
+format. Everything is a counter update under a lock, so it's cheap enough to
+leave on.
+
+Stats live in a thread local, so work handed to other threads (like the
+fan-out in model.recipe_infos_by_ids) is only counted if it runs inside
+use_stats(current_stats()).
+"""
+
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Response, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds of the request latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Per-route counters summed from each request's stats
+ROUTE_TOTALS_HELP = {'sql_statements_total': 'SQL statements run by route.',
+                     'sql_duration_seconds_total': 'Time spent in SQL statements by route.',
+                     'api_calls_total': 'API calls made by route.',
+                     'api_duration_seconds_total': 'Time spent in API calls by route.',
+                     'cache_hits_total': 'Recipe cache hits by route.',
+                     'cache_misses_total': 'Recipe cache misses by route.',
+                     }
+
+_local = threading.local()
+
+
+class RequestStats(object):
+    """ Counters for one request, safe to update from several threads."""
+
+    def __init__(self):
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.api_count = 0
+        self.api_seconds = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._lock = threading.Lock()
+
+    def add(self, **counts):
+        """ Adds each keyword's value to the counter of the same name."""
+
+        with self._lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def as_dict(self):
+        """ Returns the counters as a dictionary."""
+
+        with self._lock:
+            return {'sql_count': self.sql_count,
+                    'sql_ms': round(self.sql_seconds * 1000, 2),
+                    'api_count': self.api_count,
+                    'api_ms': round(self.api_seconds * 1000, 2),
+                    'cache_hits': self.cache_hits,
+                    'cache_misses': self.cache_misses,
+                    }
+
+
+def current_stats():
+    """ Returns the stats being recorded on this thread, or None."""
+
+    return getattr(_local, 'stats', None)
+
+
+@contextmanager
+def use_stats(stats):
+    """ Records into stats on this thread while in use."""
+
+    previous = current_stats()
+    _local.stats = stats
+    try:
+        yield stats
+    finally:
+        _local.stats = previous
+
+
+def record_api_call(seconds):
+    """ Records one API call that took seconds."""
+
+    stats = current_stats()
+    if stats is not None:
+        stats.add(api_count=1, api_seconds=seconds)
+
+
+def record_cache_lookup(hit):
+    """ Records one cache lookup."""
+
+    stats = current_stats()
+    if stats is not None:
+        if hit:
+            stats.add(cache_hits=1)
+        else:
+            stats.add(cache_misses=1)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._instrumentation_start = time.time()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = current_stats()
+    if stats is not None:
+        stats.add(sql_count=1, sql_seconds=time.time() - context._instrumentation_start)
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    return ','.join('%s="%s"' % (name, _escape_label(value)) for name, value in labels)
+
+
+class Metrics(object):
+    """ Process-wide request metrics in Prometheus text format."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._latency = {}
+        self._requests = {}
+        self._totals = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def add_collector(self, collector):
+        """ Adds a function returning extra (name, help, type, value) samples."""
+
+        self._collectors.append(collector)
+
+    def observe(self, route, method, status, seconds, stats):
+        """ Records one finished request."""
+
+        key = (route, method)
+
+        with self._lock:
+            latency = self._latency.setdefault(key, {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0})
+            for index, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    latency['buckets'][index] += 1
+            latency['sum'] += seconds
+            latency['count'] += 1
+
+            status_key = (route, method, status)
+            self._requests[status_key] = self._requests.get(status_key, 0) + 1
+
+            totals = self._totals.setdefault(key, dict((name, 0) for name in ROUTE_TOTALS_HELP))
+            totals['sql_statements_total'] += stats.sql_count
+            totals['sql_duration_seconds_total'] += stats.sql_seconds
+            totals['api_calls_total'] += stats.api_count
+            totals['api_duration_seconds_total'] += stats.api_seconds
+            totals['cache_hits_total'] += stats.cache_hits
+            totals['cache_misses_total'] += stats.cache_misses
+
+    def render(self):
+        """ Returns all metrics in Prometheus text exposition format."""
+
+        lines = []
+
+        with self._lock:
+            lines.append('# HELP http_request_duration_seconds Request latency by route.')
+            lines.append('# TYPE http_request_duration_seconds histogram')
+            for (route, method), latency in sorted(self._latency.items()):
+                labels = [('route', route), ('method', method)]
+                for bound, count in zip(self.buckets, latency['buckets']):
+                    lines.append('http_request_duration_seconds_bucket{%s} %d' % (_format_labels(labels + [('le', bound)]), count))
+                lines.append('http_request_duration_seconds_bucket{%s} %d' % (_format_labels(labels + [('le', '+Inf')]), latency['count']))
+                lines.append('http_request_duration_seconds_sum{%s} %f' % (_format_labels(labels), latency['sum']))
+                lines.append('http_request_duration_seconds_count{%s} %d' % (_format_labels(labels), latency['count']))
+
+            lines.append('# HELP http_requests_total Requests by route and status.')
+            lines.append('# TYPE http_requests_total counter')
+            for (route, method, status), count in sorted(self._requests.items()):
+                lines.append('http_requests_total{%s} %d' % (_format_labels([('route', route), ('method', method), ('status', status)]), count))
+
+            for name in sorted(ROUTE_TOTALS_HELP):
+                lines.append('# HELP %s %s' % (name, ROUTE_TOTALS_HELP[name]))
+                lines.append('# TYPE %s counter' % name)
+                for (route, method), totals in sorted(self._totals.items()):
+                    lines.append('%s{%s} %s' % (name, _format_labels([('route', route), ('method', method)]), totals[name]))
+
+        for collector in self._collectors:
+            for (name, help_text, metric_type, value) in collector():
+                lines.append('# HELP %s %s' % (name, help_text))
+                lines.append('# TYPE %s %s' % (name, metric_type))
+                lines.append('%s %s' % (name, value))
+
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+def _start_request():
+    _local.stats = RequestStats()
+    _local.request_start = time.time()
+
+
+def _finish_request(response):
+    stats = current_stats()
+    if stats is None:
+        return response
+
+    observation = (request.url_rule.rule if request.url_rule else 'unmatched',
+                   request.path,
+                   request.method,
+                   response.status_code,
+                   _local.request_start,
+                   stats,
+                   )
+
+    # A streamed body is only generated after this hook, so record once it's sent
+    if response.is_streamed and not response.direct_passthrough:
+        response.response = _record_when_sent(response.response, observation)
+    else:
+        _record_request(*observation)
+
+    return response
+
+
+def _record_when_sent(body, observation):
+    """ Yields a streamed body, then records the request.
+
+    Streamed routes generate their body within stream_with_context, which
+    keeps the request's stats on this thread until the body is done, so work
+    done while generating it is counted too.
+    """
+
+    try:
+        for chunk in body:
+            yield chunk
+    finally:
+        close = getattr(body, 'close', None)
+        if close is not None:
+            close()
+        _record_request(*observation)
+
+
+def _record_request(route, path, method, status, start, stats):
+    seconds = time.time() - start
+
+    metrics.observe(route, method, status, seconds, stats)
+
+    log_line = {'route': route,
+                'path': path,
+                'method': method,
+                'status': status,
+                'duration_ms': round(seconds * 1000, 2),
+                }
+    log_line.update(stats.as_dict())
+    logger.info(json.dumps(log_line, sort_keys=True))
+
+
+def _clear_request(exception):
+    _local.stats = None
+
+
+def show_metrics():
+    """ Serves metrics in Prometheus text format."""
+
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app):
+    """ Turns on instrumentation for every request to app and adds /metrics."""
+
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.teardown_request(_clear_request)
+    app.add_url_rule('/metrics', 'show_metrics', show_metrics)
@@ -0,0 +1,84 @@
+""" In-process background job runner.
+
+Jobs themselves live in the jobs table (see model.Job); the runner only
+holds the ids of jobs submitted in this process and runs each one on a small
+pool of daemon threads, so slow work such as API calls happens off the
+request. Pages follow a job by polling its status at /jobs/<id>.json.
+"""
+
+import logging
+import threading
+import time
+
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+
+logger = logging.getLogger(__name__)
+
+
+class JobRunner(object):
+    """ Runs submitted job ids with run(job_id) on up to workers threads.
+
+    Threads start with the first submitted job.
+    """
+
+    def __init__(self, run, workers=2):
+        self.run = run
+        self.workers = workers
+        self._queue = Queue()
+        self._active = set()
+        self._finished = threading.Condition()
+        self._threads = []
+
+    def submit(self, job_id):
+        """ Queues a job id to be run in the background.
+
+        A job id that's already queued or running isn't queued again.
+        Returns whether it was queued.
+        """
+
+        with self._finished:
+            if job_id in self._active:
+                return False
+            self._active.add(job_id)
+            if not self._threads:
+                for _ in range(self.workers):
+                    thread = threading.Thread(target=self._work)
+                    thread.daemon = True
+                    thread.start()
+                    self._threads.append(thread)
+
+        self._queue.put(job_id)
+
+        return True
+
+    def join(self, timeout=None):
+        """ Waits until every submitted job has finished. Returns False on timeout."""
+
+        deadline = time.time() + timeout if timeout is not None else None
+
+        with self._finished:
+            while self._active:
+                if deadline is None:
+                    self._finished.wait()
+                    continue
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._finished.wait(remaining)
+
+        return True
+
+    def _work(self):
+        while True:
+            job_id = self._queue.get()
+            try:
+                self.run(job_id)
+            except Exception:
+                logger.exception('Job %s failed', job_id)
+            finally:
+                with self._finished:
+                    self._active.discard(job_id)
+                    self._finished.notify_all()
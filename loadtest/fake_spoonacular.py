@@ -0,0 +1,251 @@
+""" Offline stand-in for the Spoonacular API.
+
+Serves /recipes/search, /recipes/searchComplex and /recipes/<id>/information
+from fixtures generated deterministically from the recipe id, so every run
+sees the same recipes. Each response can be delayed and a share of them can
+fail with a 500 to mimic the real API. Point the app at it with
+SPOONACULAR_BASE_URL. Usage:
+
+    python loadtest/fake_spoonacular.py --port 8089 --latency-ms 80 --jitter-ms 40 --error-rate 0.01
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import zlib
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+
+RECIPE_COUNT = 1000
+
+# id, name, aisle, units an ingredient can be listed in
+INGREDIENTS = [
+    (1001, 'butter', 'Milk, Eggs, Other Dairy', ['tablespoons', 'ounces']),
+    (1077, 'milk', 'Milk, Eggs, Other Dairy', ['cups', 'fluid ounces']),
+    (1123, 'egg', 'Milk, Eggs, Other Dairy', ['servings']),
+    (1033, 'parmesan', 'Cheese', ['ounces', 'cups', 'grams']),
+    (2047, 'salt', 'Spices and Seasonings', ['teaspoons']),
+    (1002030, 'black pepper', 'Spices and Seasonings', ['teaspoons', 'pinch']),
+    (2044, 'basil', 'Produce', ['cups', 'leaves']),
+    (11215, 'garlic', 'Produce', ['cloves', 'teaspoons']),
+    (11282, 'onion', 'Produce', ['servings', 'cups']),
+    (11529, 'tomato', 'Produce', ['servings', 'cups', 'ounces']),
+    (9152, 'lemon juice', 'Produce', ['tablespoons', 'teaspoons']),
+    (11291, 'green onions', 'Produce', ['servings', 'tablespoons']),
+    (4053, 'olive oil', 'Oil, Vinegar, Salad Dressing', ['tablespoons', 'teaspoons', 'cups']),
+    (2053, 'vinegar', 'Oil, Vinegar, Salad Dressing', ['tablespoons']),
+    (20081, 'flour', 'Baking', ['cups', 'grams']),
+    (19335, 'sugar', 'Baking', ['cups', 'tablespoons', 'grams']),
+    (18371, 'baking powder', 'Baking', ['teaspoons']),
+    (20420, 'pasta', 'Pasta and Rice', ['ounces', 'pounds']),
+    (20444, 'rice', 'Pasta and Rice', ['cups', 'grams']),
+    (5006, 'chicken breast', 'Meat', ['pounds', 'ounces']),
+    (10023572, 'ground beef', 'Meat', ['pounds']),
+    (15076, 'salmon', 'Seafood', ['ounces', 'pounds']),
+    (6194, 'chicken broth', 'Canned and Jarred', ['cups', 'milliliters']),
+    (16018, 'black beans', 'Canned and Jarred', ['ounces', 'cups']),
+]
+
+TITLE_WORDS = ['Pasta', 'Salad', 'Chicken', 'Soup', 'Vegetarian', 'Rice Bowl', 'Tacos', 'Curry', 'Bake', 'Stew']
+
+AMOUNTS = [0.25, 0.5, 1, 1.5, 2, 3, 4, 8]
+
+
+def _stable_hash(text):
+    return zlib.crc32(text.encode('utf-8')) & 0xffffffff
+
+
+def recipe_ingredients(recipe_id):
+    """ Returns the generated extendedIngredients of recipe_id."""
+
+    rng = random.Random(recipe_id * 2)
+    ingredients = []
+
+    for (ingredient_id, name, aisle, unit_choices) in rng.sample(INGREDIENTS, rng.randint(4, 10)):
+        unit = rng.choice(unit_choices)
+        ingredients.append({'id': ingredient_id,
+                            'name': name,
+                            'aisle': aisle,
+                            'amount': rng.choice(AMOUNTS),
+                            'unit': unit,
+                            'unitLong': unit,
+                            'originalString': '%s %s' % (unit, name),
+                            })
+
+    return ingredients
+
+
+_information = {}
+
+
+def recipe_information(recipe_id):
+    """ Returns the generated recipe information of recipe_id."""
+
+    if recipe_id not in _information:
+        _information[recipe_id] = _generate_information(recipe_id)
+
+    return _information[recipe_id]
+
+
+def _generate_information(recipe_id):
+    rng = random.Random(recipe_id * 2 + 1)
+    title = '%s %s #%s' % (rng.choice(TITLE_WORDS), rng.choice(TITLE_WORDS), recipe_id)
+
+    return {'id': recipe_id,
+            'title': title,
+            'image': 'https://spoonacular.com/recipeImages/%s-556x370.jpg' % recipe_id,
+            'servings': rng.randint(1, 8),
+            'readyInMinutes': rng.choice([15, 20, 30, 45, 60, 90]),
+            'preparationMinutes': rng.choice([5, 10, 15, 20]),
+            'sourceName': 'Fake Kitchen',
+            'sourceUrl': 'http://localhost/recipes/%s' % recipe_id,
+            'instructions': 'Combine the ingredients of %s and cook until done.' % title,
+            'extendedIngredients': recipe_ingredients(recipe_id),
+            }
+
+
+def search(query, number):
+    """ Returns /recipes/search results; the same query always finds the same recipes."""
+
+    rng = random.Random(_stable_hash(query))
+    results = []
+
+    for recipe_id in rng.sample(range(1, RECIPE_COUNT + 1), number):
+        info = recipe_information(recipe_id)
+        results.append({'id': recipe_id,
+                        'title': info['title'],
+                        'image': '%s-556x370.jpg' % recipe_id,
+                        'readyInMinutes': info['readyInMinutes'],
+                        })
+
+    return {'results': results,
+            'baseUri': 'https://spoonacular.com/recipeImages/',
+            'offset': 0,
+            'number': number,
+            'totalResults': RECIPE_COUNT,
+            }
+
+
+def search_complex(include_ingredients, number):
+    """ Returns /recipes/searchComplex results for recipes using the named ingredients."""
+
+    names = set(name.strip().lower() for name in re.split(r',\s*', include_ingredients) if name.strip())
+    results = []
+
+    for recipe_id in range(1, RECIPE_COUNT + 1):
+        info = recipe_information(recipe_id)
+        used = [ingredient for ingredient in info['extendedIngredients'] if ingredient['name'] in names]
+        if not used:
+            continue
+        missed = [ingredient for ingredient in info['extendedIngredients'] if ingredient['name'] not in names]
+
+        result = dict(info)
+        result.update({'usedIngredients': used,
+                       'missedIngredients': missed,
+                       'usedIngredientCount': len(used),
+                       'missedIngredientCount': len(missed),
+                       })
+        results.append(result)
+
+    results.sort(key=lambda result: (-result['usedIngredientCount'], result['missedIngredientCount'], result['id']))
+
+    return {'results': results[:number],
+            'offset': 0,
+            'number': number,
+            'totalResults': len(results),
+            }
+
+
+INFORMATION_PATH = re.compile(r'^/recipes/(\d+)/information$')
+
+
+class FakeSpoonacularHandler(BaseHTTPRequestHandler):
+    """ Serves the three API endpoints the app uses."""
+
+    protocol_version = 'HTTP/1.1'
+    wbufsize = -1
+
+    def do_GET(self):
+        settings = self.server.settings
+
+        delay = settings['latency'] + random.uniform(-settings['jitter'], settings['jitter'])
+        if delay > 0:
+            time.sleep(delay)
+
+        url = urlparse(self.path)
+        params = dict((name, values[0]) for name, values in parse_qs(url.query).items())
+        number = int(params.get('number', 10))
+
+        if random.random() < settings['error_rate']:
+            return self.send_json(500, {'message': 'Simulated upstream error'})
+
+        information = INFORMATION_PATH.match(url.path)
+        if information:
+            recipe_id = int(information.group(1))
+            if not 1 <= recipe_id <= RECIPE_COUNT:
+                return self.send_json(404, {'message': 'Recipe not found'})
+            return self.send_json(200, recipe_information(recipe_id))
+        elif url.path == '/recipes/search':
+            return self.send_json(200, search(params.get('query', ''), number))
+        elif url.path == '/recipes/searchComplex':
+            return self.send_json(200, search_complex(params.get('includeIngredients', ''), number))
+
+        return self.send_json(404, {'message': 'Unknown endpoint'})
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeSpoonacularServer(ThreadingMixIn, HTTPServer):
+    """ Threaded server so slow responses overlap like the real API."""
+
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.0, jitter=0.0, error_rate=0.0):
+        HTTPServer.__init__(self, address, FakeSpoonacularHandler)
+        self.settings = {'latency': latency, 'jitter': jitter, 'error_rate': error_rate}
+
+
+def start_in_thread(port=0, latency=0.0, jitter=0.0, error_rate=0.0):
+    """ Starts a fake server in a daemon thread and returns it; its base url is server.base_url."""
+
+    server = FakeSpoonacularServer(('127.0.0.1', port), latency, jitter, error_rate)
+    server.base_url = 'http://127.0.0.1:%s' % server.server_port
+
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Offline stand-in for the Spoonacular API.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency-ms', type=float, default=0, help='mean delay added to every response')
+    parser.add_argument('--jitter-ms', type=float, default=0, help='delay varies uniformly by up to this much')
+    parser.add_argument('--error-rate', type=float, default=0, help='share of responses that fail with a 500')
+    args = parser.parse_args()
+
+    server = FakeSpoonacularServer((args.host, args.port), args.latency_ms / 1000.0, args.jitter_ms / 1000.0, args.error_rate)
+    print('Fake Spoonacular API on http://%s:%s' % (args.host, args.port))
+    server.serve_forever()
@@ -0,0 +1,191 @@
+""" End-to-end load generator for the app's main routes.
+
+Each simulated user registers, logs in and then repeatedly walks through the
+app the way the pages do: dashboard, recipe search, adding recipes, building
+a shopping list, confirming purchases and cooking a recipe. Latency of every
+request is recorded by route and reported as p50/p95/p99 and requests/sec.
+
+Run the app against the fake API first, for example:
+
+    python loadtest/fake_spoonacular.py --latency-ms 80 --jitter-ms 40 &
+    DATABASE_URL=postgresql:///loadfood SPOONACULAR_BASE_URL=http://127.0.0.1:8089 SPOONACULAR_SECRET_KEY=fake python server.py &
+    python loadtest/run_load.py --users 20 --iterations 5
+
+Every run registers new users, so use a scratch database.
+"""
+
+import argparse
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+
+import requests
+
+QUERIES = ['pasta', 'salad', 'chicken', 'soup', 'vegetarian', 'curry', 'tacos', 'rice']
+DIETS = ['', 'vegetarian', 'vegan']
+INTOLERANCES = [[], ['dairy'], ['gluten'], ['dairy', 'gluten']]
+
+RECIPE_IDS_EVENT = re.compile(r'^event: ids\ndata: (.*)$', re.MULTILINE)
+SHOPPING_LIST_ID = re.compile(r'/shopping_list/(\d+)')
+JOB_URL = re.compile(r'data-job-url="([^"]+)"')
+
+# Pending shopping lists are checked like the page does, for up to a minute
+JOB_POLL_INTERVAL = 2
+JOB_POLLS = 30
+LIST_INGREDIENT = re.compile(r'data-ingredient-id="(\d+)".*?data-default-quantity="([\d.]+)"', re.DOTALL)
+
+
+def percentile(sorted_values, percent):
+    """ Returns the nearest-rank percentile of an already sorted list."""
+
+    if not sorted_values:
+        return 0.0
+
+    rank = int(math.ceil(percent / 100.0 * len(sorted_values))) - 1
+    return sorted_values[min(max(rank, 0), len(sorted_values) - 1)]
+
+
+class Recorder(object):
+    """ Collects (seconds, ok) samples by route from every user thread."""
+
+    def __init__(self):
+        self.samples = {}
+        self._lock = threading.Lock()
+
+    def add(self, route, seconds, ok):
+        with self._lock:
+            self.samples.setdefault(route, []).append((seconds, ok))
+
+    def report(self, wall_seconds):
+        """ Returns report lines with latency percentiles and throughput by route."""
+
+        lines = ['%-26s %7s %7s %9s %9s %9s %9s' % ('route', 'count', 'errors', 'p50 ms', 'p95 ms', 'p99 ms', 'req/s')]
+        total = 0
+
+        for route in sorted(self.samples):
+            samples = self.samples[route]
+            latencies = sorted(seconds for seconds, ok in samples)
+            errors = len([ok for seconds, ok in samples if not ok])
+            total += len(samples)
+
+            lines.append('%-26s %7d %7d %9.1f %9.1f %9.1f %9.1f' % (route, len(samples), errors,
+                                                                   percentile(latencies, 50) * 1000,
+                                                                   percentile(latencies, 95) * 1000,
+                                                                   percentile(latencies, 99) * 1000,
+                                                                   len(samples) / wall_seconds))
+
+        lines.append('%s requests in %.1f s, %.1f req/s overall' % (total, wall_seconds, total / wall_seconds))
+
+        return lines
+
+
+class SimulatedUser(object):
+    """ One user with their own session cookie."""
+
+    def __init__(self, base_url, recorder, rng):
+        self.base_url = base_url
+        self.recorder = recorder
+        self.rng = rng
+        self.session = requests.Session()
+        self.username = 'load-%s' % uuid.uuid4().hex[:12]
+
+    def request(self, route, method, path, **kwargs):
+        start = time.time()
+        try:
+            response = self.session.request(method, self.base_url + path, allow_redirects=False, timeout=60, **kwargs)
+        except requests.RequestException:
+            self.recorder.add(route, time.time() - start, False)
+            return None
+
+        self.recorder.add(route, time.time() - start, response.status_code < 400)
+        return response
+
+    def sign_up(self):
+        self.request('/register', 'POST', '/register', data={'username': self.username, 'password': 'load'})
+        self.request('/login', 'POST', '/login', data={'username': self.username, 'password': 'load'})
+
+    def run_once(self):
+        """ Walks through one search, shop, confirm and cook cycle."""
+
+        self.request('/main', 'GET', '/main')
+
+        params = {'diet': self.rng.choice(DIETS),
+                  'intolerances': self.rng.choice(INTOLERANCES),
+                  'query': self.rng.choice(QUERIES),
+                  }
+        self.request('/recipes', 'GET', '/recipes', params=params)
+
+        # The results page loads its cards from the event stream
+        response = self.request('/recipes/events', 'GET', '/recipes/events', params=params)
+        match = RECIPE_IDS_EVENT.search(response.text) if response is not None else None
+        recipe_ids = [str(recipe_id) for recipe_id in json.loads(match.group(1))] if match else []
+        if not recipe_ids:
+            return
+
+        chosen = self.rng.sample(recipe_ids, min(2, len(recipe_ids)))
+        for recipe_id in chosen:
+            self.request('/user-recipes', 'POST', '/user-recipes', data={'recipe_id': recipe_id})
+
+        # The list is built by a background job; wait for it before confirming
+        response = self.request('/shopping_list', 'POST', '/shopping_list',
+                                data={'idempotency_key': uuid.uuid4().hex})
+        match = SHOPPING_LIST_ID.search(response.headers.get('Location', '')) if response is not None else None
+        if match:
+            list_id = match.group(1)
+            response = self.request('/shopping_list/<shopping_list_id>', 'GET', '/shopping_list/%s' % list_id)
+            match = JOB_URL.search(response.text) if response is not None else None
+            for _ in range(JOB_POLLS if match else 0):
+                response = self.request('/jobs/<job_id>.json', 'GET', match.group(1))
+                if response is None or response.status_code != 200 or response.json()['status'] in ('done', 'failed'):
+                    break
+                time.sleep(JOB_POLL_INTERVAL)
+
+            response = self.request('/confirm_list/<shopping_list_id>', 'GET', '/confirm_list/%s' % list_id)
+            if response is not None:
+                purchases = dict((ingredient_id, {'ingredientQty': quantity})
+                                 for ingredient_id, quantity in LIST_INGREDIENT.findall(response.text))
+                self.request('/inventory.json', 'POST', '/inventory.json',
+                             data={'data': json.dumps(purchases), 'listId': list_id})
+
+        self.request('/verify_recipe.json', 'POST', '/verify_recipe.json', data={'data': chosen[0]})
+
+    def run(self, iterations):
+        self.sign_up()
+        for _ in range(iterations):
+            self.run_once()
+
+
+def run_load(base_url, users, iterations, seed=None):
+    """ Runs users concurrently and returns (recorder, wall seconds)."""
+
+    recorder = Recorder()
+    seeds = random.Random(seed)
+    simulated = [SimulatedUser(base_url, recorder, random.Random(seeds.random())) for _ in range(users)]
+    threads = [threading.Thread(target=user.run, args=(iterations,)) for user in simulated]
+
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return (recorder, time.time() - start)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Drive the app with concurrent simulated users.')
+    parser.add_argument('--base-url', default='http://127.0.0.1:5000')
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--iterations', type=int, default=5, help='cycles per user')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    (recorder, wall_seconds) = run_load(args.base_url, args.users, args.iterations, args.seed)
+
+    print('%s users x %s iterations against %s' % (args.users, args.iterations, args.base_url))
+    for line in recorder.report(wall_seconds):
+        print(line)
@@ -0,0 +1,85 @@
+""" Applies database migrations.
+
+Migrations are the numbered .sql files in migrations/, applied in order, each
+in its own transaction. Applied versions are recorded in the
+schema_migrations table. Usage:
+
+    python migrate.py            apply pending migrations
+    python migrate.py --stamp    record all migrations as applied without
+                                 running them (for tables made by create_all)
+"""
+
+import os
+import sys
+from datetime import datetime
+
+from model import connect_to_db, db
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
+
+def get_migrations():
+    """ Returns a sorted list of (version, path) for every migration file."""
+
+    migrations = []
+
+    for filename in sorted(os.listdir(MIGRATIONS_DIR)):
+        if filename.endswith('.sql'):
+            migrations.append((filename[:-len('.sql')], os.path.join(MIGRATIONS_DIR, filename)))
+
+    return migrations
+
+
+def get_applied_versions(connection):
+    """ Returns the set of migration versions already applied."""
+
+    connection.execute("""CREATE TABLE IF NOT EXISTS schema_migrations (
+                              version VARCHAR(100) PRIMARY KEY,
+                              applied_at TIMESTAMP WITHOUT TIME ZONE NOT NULL
+                          )""")
+
+    return set(row[0] for row in connection.execute("SELECT version FROM schema_migrations"))
+
+
+def record_version(connection, version):
+    """ Records a migration version as applied."""
+
+    connection.execute("INSERT INTO schema_migrations (version, applied_at) VALUES (%(version)s, %(applied_at)s)",
+                       {'version': version, 'applied_at': datetime.utcnow()})
+
+
+def run_migrations(stamp_only=False):
+    """ Applies pending migrations and returns their versions.
+
+    With stamp_only, pending migrations are recorded without being run.
+    """
+
+    with db.engine.begin() as connection:
+        applied_versions = get_applied_versions(connection)
+
+    applied = []
+
+    for version, path in get_migrations():
+        if version in applied_versions:
+            continue
+
+        with db.engine.begin() as connection:
+            if not stamp_only:
+                with open(path) as migration_file:
+                    connection.execute(migration_file.read())
+            record_version(connection, version)
+
+        applied.append(version)
+
+    return applied
+
+
+if __name__ == "__main__":
+    from server import app
+
+    connect_to_db(app)
+
+    stamp_only = '--stamp' in sys.argv[1:]
+
+    for version in run_migrations(stamp_only=stamp_only):
+        print('%s %s' % ('Stamped' if stamp_only else 'Applied', version))
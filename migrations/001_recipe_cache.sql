@@ -0,0 +1,6 @@
+-- Database tier of the recipe info cache
+CREATE TABLE IF NOT EXISTS recipe_cache (
+    recipe_id INTEGER PRIMARY KEY,
+    body TEXT NOT NULL,
+    fetched_at TIMESTAMP WITHOUT TIME ZONE NOT NULL
+);
@@ -0,0 +1,6 @@
+-- Recipe summaries read by the dashboard and shopping lists
+ALTER TABLE recipes ADD COLUMN IF NOT EXISTS title VARCHAR(200);
+ALTER TABLE recipes ADD COLUMN IF NOT EXISTS image VARCHAR(200);
+ALTER TABLE recipes ADD COLUMN IF NOT EXISTS servings INTEGER;
+ALTER TABLE recipes ADD COLUMN IF NOT EXISTS ingredients JSON;
+ALTER TABLE recipes ADD COLUMN IF NOT EXISTS summary_updated_at TIMESTAMP WITHOUT TIME ZONE;
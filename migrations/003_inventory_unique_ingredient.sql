@@ -0,0 +1,16 @@
+-- One inventory row per user and ingredient, merging any duplicates first
+UPDATE inventory
+SET current_quantity = duplicates.total_quantity
+FROM (SELECT min(inventory_id) AS kept_id, sum(current_quantity) AS total_quantity
+      FROM inventory
+      GROUP BY user_id, ingredient_id
+      HAVING count(*) > 1) AS duplicates
+WHERE inventory.inventory_id = duplicates.kept_id;
+
+DELETE FROM inventory
+USING inventory AS kept
+WHERE inventory.user_id = kept.user_id
+  AND inventory.ingredient_id = kept.ingredient_id
+  AND inventory.inventory_id > kept.inventory_id;
+
+ALTER TABLE inventory ADD CONSTRAINT inventory_user_id_ingredient_id_key UNIQUE (user_id, ingredient_id);
@@ -0,0 +1,5 @@
+-- Indexes for the user-scoped queries behind the dashboard, lists and cooking
+CREATE INDEX IF NOT EXISTS ix_user_recipes_user_id_status ON user_recipes (user_id, status);
+CREATE INDEX IF NOT EXISTS ix_shopping_lists_user_id_has_shopped ON shopping_lists (user_id, has_shopped);
+CREATE INDEX IF NOT EXISTS ix_shopping_list_ingredients_shopping_list_id ON shopping_list_ingredients (shopping_list_id);
+CREATE INDEX IF NOT EXISTS ix_inventory_user_id_in_stock ON inventory (user_id) WHERE current_quantity > 0;
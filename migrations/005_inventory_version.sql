@@ -0,0 +1,2 @@
+-- Version counter bumped on every inventory change, used to validate cached inventory
+ALTER TABLE users ADD COLUMN IF NOT EXISTS inventory_version INTEGER NOT NULL DEFAULT 0;
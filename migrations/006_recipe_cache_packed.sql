@@ -0,0 +1,5 @@
+-- Store cached recipe info packed by compact_recipe.pack() instead of as JSON.
+-- The cache refills from the API, so existing rows are dropped rather than converted.
+TRUNCATE recipe_cache;
+ALTER TABLE recipe_cache DROP COLUMN IF EXISTS body;
+ALTER TABLE recipe_cache ADD COLUMN IF NOT EXISTS packed BYTEA NOT NULL;
@@ -0,0 +1,18 @@
+-- Shopping lists are built by background jobs and stay pending until they're done
+ALTER TABLE shopping_lists ADD COLUMN IF NOT EXISTS status VARCHAR(20) NOT NULL DEFAULT 'ready';
+
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id SERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users (user_id),
+    idempotency_key VARCHAR(64) NOT NULL,
+    kind VARCHAR(30) NOT NULL,
+    params JSON NOT NULL,
+    status VARCHAR(20) NOT NULL,
+    shopping_list_id INTEGER REFERENCES shopping_lists (list_id),
+    error TEXT,
+    created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    updated_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    UNIQUE (user_id, idempotency_key)
+);
+
+CREATE INDEX IF NOT EXISTS ix_jobs_status ON jobs (status);
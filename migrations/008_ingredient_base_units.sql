@@ -0,0 +1,103 @@
+-- Base units now follow units.UNIT_DEFINITIONS: mass in ounces, volume in
+-- teaspoons. Inventory and shopping list quantities have no unit column of
+-- their own; they are in their ingredient's base_unit, so they are rescaled
+-- from the old unit before the ingredient's base_unit is rewritten.
+CREATE TEMPORARY TABLE unit_conversions (
+    unit VARCHAR(100) PRIMARY KEY,
+    base_unit VARCHAR(100) NOT NULL,
+    factor DOUBLE PRECISION NOT NULL
+) ON COMMIT DROP;
+
+INSERT INTO unit_conversions (unit, base_unit, factor) VALUES
+    ('cloves', 'cloves', 1.0),
+    ('clove', 'cloves', 1.0),
+    ('milligrams', 'ounces', 3.5273961949580415e-05),
+    ('mg', 'ounces', 3.5273961949580415e-05),
+    ('milligram', 'ounces', 3.5273961949580415e-05),
+    ('grams', 'ounces', 0.035273961949580414),
+    ('g', 'ounces', 0.035273961949580414),
+    ('gs', 'ounces', 0.035273961949580414),
+    ('gr', 'ounces', 0.035273961949580414),
+    ('gram', 'ounces', 0.035273961949580414),
+    ('ounces', 'ounces', 1.0),
+    ('oz', 'ounces', 1.0),
+    ('ozs', 'ounces', 1.0),
+    ('ounce', 'ounces', 1.0),
+    ('pounds', 'ounces', 16.0),
+    ('lb', 'ounces', 16.0),
+    ('lbs', 'ounces', 16.0),
+    ('pound', 'ounces', 16.0),
+    ('kilograms', 'ounces', 35.27396194958041),
+    ('kg', 'ounces', 35.27396194958041),
+    ('kgs', 'ounces', 35.27396194958041),
+    ('kilogram', 'ounces', 35.27396194958041),
+    ('pieces', 'pieces', 1.0),
+    ('piece', 'pieces', 1.0),
+    ('servings', 'servings', 1.0),
+    ('serving', 'servings', 1.0),
+    ('slices', 'slices', 1.0),
+    ('slice', 'slices', 1.0),
+    ('milliliters', 'teaspoons', 0.20288413621105797),
+    ('ml', 'teaspoons', 0.20288413621105797),
+    ('milliliter', 'teaspoons', 0.20288413621105797),
+    ('millilitre', 'teaspoons', 0.20288413621105797),
+    ('millilitres', 'teaspoons', 0.20288413621105797),
+    ('teaspoons', 'teaspoons', 1.0),
+    ('tsp', 'teaspoons', 1.0),
+    ('tsps', 'teaspoons', 1.0),
+    ('teaspoon', 'teaspoons', 1.0),
+    ('tablespoons', 'teaspoons', 3.0),
+    ('tbsp', 'teaspoons', 3.0),
+    ('tbs', 'teaspoons', 3.0),
+    ('tbsps', 'teaspoons', 3.0),
+    ('tablespoon', 'teaspoons', 3.0),
+    ('fluid ounces', 'teaspoons', 6.0),
+    ('fl oz', 'teaspoons', 6.0),
+    ('fluid ounce', 'teaspoons', 6.0),
+    ('cups', 'teaspoons', 48.0),
+    ('c', 'teaspoons', 48.0),
+    ('cup', 'teaspoons', 48.0),
+    ('pints', 'teaspoons', 96.0),
+    ('pt', 'teaspoons', 96.0),
+    ('pint', 'teaspoons', 96.0),
+    ('quarts', 'teaspoons', 192.0),
+    ('qt', 'teaspoons', 192.0),
+    ('quart', 'teaspoons', 192.0),
+    ('liters', 'teaspoons', 202.88413621105798),
+    ('l', 'teaspoons', 202.88413621105798),
+    ('liter', 'teaspoons', 202.88413621105798),
+    ('litre', 'teaspoons', 202.88413621105798),
+    ('litres', 'teaspoons', 202.88413621105798),
+    ('gallons', 'teaspoons', 768.0),
+    ('gal', 'teaspoons', 768.0),
+    ('gallon', 'teaspoons', 768.0);
+
+-- Ingredients whose stored unit converts to a different base unit, matched as units.normalize_unit does
+CREATE TEMPORARY TABLE ingredient_conversions ON COMMIT DROP AS
+SELECT ingredients.ingredient_id, unit_conversions.base_unit, unit_conversions.factor
+FROM ingredients
+JOIN unit_conversions
+  ON unit_conversions.unit = trim(regexp_replace(lower(replace(ingredients.base_unit, '.', ' ')), '\s+', ' ', 'g'))
+WHERE ingredients.base_unit <> unit_conversions.base_unit;
+
+UPDATE inventory
+SET current_quantity = inventory.current_quantity * ingredient_conversions.factor
+FROM ingredient_conversions
+WHERE inventory.ingredient_id = ingredient_conversions.ingredient_id;
+
+UPDATE shopping_list_ingredients
+SET aggregate_quantity = shopping_list_ingredients.aggregate_quantity * ingredient_conversions.factor
+FROM ingredient_conversions
+WHERE shopping_list_ingredients.ingredient_id = ingredient_conversions.ingredient_id;
+
+-- Invalidates cached inventory snapshots of the users affected
+UPDATE users
+SET inventory_version = users.inventory_version + 1
+WHERE users.user_id IN (SELECT inventory.user_id
+                        FROM inventory
+                        JOIN ingredient_conversions ON ingredient_conversions.ingredient_id = inventory.ingredient_id);
+
+UPDATE ingredients
+SET base_unit = ingredient_conversions.base_unit
+FROM ingredient_conversions
+WHERE ingredients.ingredient_id = ingredient_conversions.ingredient_id;
@@ -0,0 +1,3 @@
+-- Inventory snapshots read a user's whole inventory through the
+-- (user_id, ingredient_id) unique index, so the in-stock index is never used
+DROP INDEX IF EXISTS ix_inventory_user_id_in_stock;
@@ -1,9 +1,70 @@
 """ Models and database functions for application."""
 
 from flask_sqlalchemy import SQLAlchemy
-import unirest
+from sqlalchemy import bindparam, case, select
+from sqlalchemy.dialects.postgresql import insert
 import os
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
 from werkzeug.security import generate_password_hash, check_password_hash
+from aggregation import aggregate_recipes
+from api_client import API_BASE_URL, ApiClient, ApiError
+from cache import LRUCache, SingleFlight
+from compact_recipe import as_compact, pack, unpack
+import units
+from fanout import fan_out, fan_out_iter, fan_out_as_completed
+from feasibility import RequirementMatrix
+from recipe_index import RecipeIndex
+from recipe_store import RecipeStore
+from jobs import JobRunner
+from instrumentation import current_stats, use_stats, record_api_call, record_cache_lookup
+
+logger = logging.getLogger(__name__)
+
+# Recipe info rarely changes upstream, so cached copies are served as fresh
+# for a day and as stale (while being refreshed in the background) for a week.
+RECIPE_CACHE_SIZE = 500
+RECIPE_CACHE_TTL = 24 * 60 * 60
+RECIPE_CACHE_STALE_TTL = 7 * 24 * 60 * 60
+
+# Per-request cap on concurrent recipe info calls and how long to wait for them
+RECIPE_FETCH_WORKERS = 4
+RECIPE_FETCH_TIMEOUT = 15
+
+# Recipes are prefetched into recipe_cache on a few threads per process as
+# soon as a user selects them
+RECIPE_PREFETCH_WORKERS = 2
+
+# Recipe summaries stored on the recipes table are refreshed after a week
+RECIPE_SUMMARY_TTL = 7 * 24 * 60 * 60
+
+# Search results are shared between users for an hour
+SEARCH_CACHE_SIZE = 1000
+SEARCH_CACHE_TTL = 60 * 60
+
+# The ingredient index is rebuilt from stored recipes every 10 minutes, so it
+# picks up recipes recorded by other processes
+RECIPE_INDEX_TTL = 10 * 60
+
+# Inventory snapshots are checked against the user's inventory version on
+# every read; the age limit only bounds edits made outside the app
+INVENTORY_SNAPSHOT_CACHE_SIZE = 1000
+INVENTORY_SNAPSHOT_TTL = 60 * 60
+
+# Recipes shown when searching by ingredients in inventory
+COOKABLE_RECIPE_LIMIT = 8
+
+# Background jobs run on a few threads per process. A job still marked
+# running after JOB_STALE_AFTER seconds is assumed lost with its process and is
+# queued again at startup.
+JOB_WORKERS = 2
+JOB_STALE_AFTER = 10 * 60
+
+# Ingredient fields kept in a recipe summary
+SUMMARY_INGREDIENT_FIELDS = ('id', 'amount', 'unit', 'unitLong', 'name', 'aisle')
 
 # This is the connection to the PostgreSQL database; we're getting this through
 # the Flask-SQLAlchemy helper library. On this, we can find the `session`
@@ -19,6 +80,8 @@ class User(db.Model):
     user_id = db.Column(db.Integer, autoincrement=True, primary_key=True)
     username = db.Column(db.String(50), nullable=False, unique=True)
     password = db.Column(db.String(200), nullable=False)
+    # Bumped by every change to the user's inventory
+    inventory_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     def __repr__(self):
         """ Provide helpful representation when printed."""
@@ -37,73 +100,118 @@ class User(db.Model):
 
         return check_password_hash(self.password, password)
 
+    def get_inventory_snapshot(self):
+        """ Returns the user's InventorySnapshot, reading inventory only if it
+        changed since the cached one was taken."""
+
+        snapshot = inventory_snapshots.get(self.user_id)
+        if snapshot is not None and snapshot.version == self.inventory_version:
+            return snapshot
+
+        # One query for the inventory and its ingredients, sorted by name
+        rows = db.session.query(Inventory.ingredient_id,
+                                Inventory.current_quantity,
+                                Ingredient.base_unit,
+                                Ingredient.ingredient_name,
+                                ).join(Ingredient).filter(Inventory.user_id == self.user_id,
+                                                          ).order_by(Ingredient.ingredient_name).all()
+
+        snapshot = InventorySnapshot(self.inventory_version, rows)
+        inventory_snapshots.set(self.user_id, snapshot)
+
+        return snapshot
+
     def get_current_inventory(self):
         """ Returns user's current inventory list."""
 
-        current_inventory = Inventory.query.filter(Inventory.user_id == self.user_id, Inventory.current_quantity > 0).all()
+        return self.get_inventory_snapshot().current_inventory
+
+    def get_inventory_quantities(self, ingredient_ids):
+        """ Takes in ingredient ids and returns a dictionary of ingredient id to
+        current quantity for those the user has in inventory."""
 
-        current_inventory_list = []
+        quantities = self.get_inventory_snapshot().quantities
 
-        for ingredient in current_inventory:
-            current_quantity = ingredient.current_quantity
-            base_unit = ingredient.ingredients.base_unit
-            ingredient_name = ingredient.ingredients.ingredient_name
-            current_inventory_list.append((current_quantity, base_unit, ingredient_name))
+        return dict((ingredient_id, quantities[ingredient_id]) for ingredient_id in set(ingredient_ids) if ingredient_id in quantities)
 
-        return sorted(current_inventory_list, key=lambda x: x[2])
+    def get_in_stock_inventory(self):
+        """ Returns a list of (ingredient id, current quantity, ingredient name)
+        for ingredients the user has in stock."""
+
+        return self.get_inventory_snapshot().in_stock
 
     def get_pending_recipes(self):
         """ Returns user's pending recipes list."""
 
-        pending_recipes = UserRecipe.query.filter(UserRecipe.status == 'in_progress', UserRecipe.user_id == self.user_id).all()
+        pending_recipes = db.session.query(*Recipe.summary_columns()).join(UserRecipe).filter(UserRecipe.status == 'in_progress', UserRecipe.user_id == self.user_id).all()
+
+        summaries = load_recipe_summaries(pending_recipes)
 
-        pending_recipes_list = []
+        return [summaries[row.recipe_id] for row in pending_recipes if row.recipe_id in summaries]
 
-        for user_recipe in pending_recipes:
-            recipe_info = recipe_info_by_id(user_recipe.recipe.recipe_id)
-            pending_recipes_list.append(recipe_info)
+    def get_cookable_recipe_ids(self, recipes):
+        """ Takes in recipe summaries and returns the set of ids of those the
+        user's inventory fully covers."""
 
-        return pending_recipes_list
+        matrix = RequirementMatrix([(recipe['id'], recipe['extendedIngredients']) for recipe in recipes])
+        if not matrix.ingredient_ids:
+            return set()
+
+        inventory_quantities = self.get_inventory_quantities(matrix.ingredient_ids)
+
+        return set(matrix.check(inventory_quantities).feasible_ids())
 
     def get_pending_shopping_lists(self):
-        """ Returns user's pending shopping lists."""
+        """ Returns user's pending shopping lists, leaving out lists that failed to build."""
 
-        return ShoppingList.query.filter(ShoppingList.has_shopped == False, ShoppingList.user_id == self.user_id).all()
+        return db.session.query(ShoppingList.list_id, ShoppingList.status).filter(ShoppingList.has_shopped == False, ShoppingList.user_id == self.user_id, ShoppingList.status != 'failed').order_by(ShoppingList.list_id).all()
 
     def get_used_and_missing_ingredients(self, recipe_id_list):
         """ Takes in a list of recipe ids and returns its ingredients with an id, current
         inventory ingredients, missing ingredients and general recipe info."""
 
-        results_recipes = {}
+        # Kept in the order of recipe_id_list
+        return OrderedDict(self.iter_used_and_missing_ingredients(recipe_id_list))
+
+    def iter_used_and_missing_ingredients(self, recipe_id_list):
+        """ Takes in a list of recipe ids and yields (recipe id, results) in the
+        same order, each as soon as its recipe info is ready.
+
+        Results hold the recipe's ingredients in inventory, missing
+        ingredients and general recipe info.
+        """
 
-        for recipe_id in recipe_id_list:
+        for recipe_id, recipe_info in zip(recipe_id_list, iter_recipe_infos_by_ids(recipe_id_list)):
+            if recipe_info is None:
+                continue
+            recipe = as_compact(recipe_info)
 
-            recipe_info = recipe_info_by_id(recipe_id)
+            # Read from the inventory snapshot, so only the first recipe queries
+            inventory_quantities = self.get_inventory_quantities(recipe.ingredient_ids)
 
-            results_recipes[recipe_id] = {}
-            results_recipes[recipe_id]['inventory_ing'] = []
-            results_recipes[recipe_id]['missing_ing'] = []
-            results_recipes[recipe_id]['info'] = recipe_info
+            results = {'inventory_ing': [],
+                       'missing_ing': [],
+                       'info': recipe,
+                       }
 
-            for ingredient in recipe_info['extendedIngredients']:
-                (converted_amount, base_unit) = convert_to_base_unit(ingredient['amount'], ingredient['unitLong'])
+            converted_ingredients = units.convert_ingredients(recipe.ingredients)
 
-                check_inventory = Inventory.query.filter(Inventory.ingredient_id == int(ingredient['id']), Inventory.user_id == self.user_id).first()
+            for ingredient_id, name, aisle, (converted_amount, base_unit) in zip(recipe.ingredient_ids, recipe.names, recipe.aisles, converted_ingredients):
+                ingredient_tuple = (ingredient_id, converted_amount, base_unit, name, aisle)
 
-                if check_inventory:
-                    if check_inventory.current_quantity <= 0:
-                        results_recipes[recipe_id]['missing_ing'].append((int(ingredient['id']), converted_amount, base_unit, ingredient['name'], ingredient['aisle']))
-                    else:
-                        results_recipes[recipe_id]['inventory_ing'].append((int(ingredient['id']), converted_amount, base_unit, ingredient['name'], ingredient['aisle']))
+                if inventory_quantities.get(ingredient_id, 0) > 0:
+                    results['inventory_ing'].append(ingredient_tuple)
                 else:
-                    results_recipes[recipe_id]['missing_ing'].append((int(ingredient['id']), converted_amount, base_unit, ingredient['name'], ingredient['aisle']))
+                    results['missing_ing'].append(ingredient_tuple)
 
-        return results_recipes
+            yield (recipe_id, results)
 
 class UserRecipe(db.Model):
     """ User recipe data."""
 
     __tablename__ = 'user_recipes'
+    __table_args__ = (db.Index('ix_user_recipes_user_id_status', 'user_id', 'status'),
+                      )
 
     user_recipe_id = db.Column(db.Integer, autoincrement=True, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.user_id'), nullable=False)
@@ -126,11 +234,16 @@ class UserRecipe(db.Model):
 
 
 class Recipe(db.Model):
-    """ Recipe id."""
+    """ Recipe id and a summary of the recipe info used by the dashboard and shopping lists."""
 
     __tablename__ = 'recipes'
 
     recipe_id = db.Column(db.Integer, primary_key=True)
+    title = db.Column(db.String(200), nullable=True)
+    image = db.Column(db.String(200), nullable=True)
+    servings = db.Column(db.Integer, nullable=True)
+    ingredients = db.Column(db.JSON, nullable=True)
+    summary_updated_at = db.Column(db.DateTime, nullable=True)
 
     def __repr__(self):
         """ Provide helpful representation when printed."""
@@ -138,15 +251,37 @@ class Recipe(db.Model):
         return '<Recipe recipe_id=%s>' % (self.recipe_id,
                                           )
 
+    @staticmethod
+    def summary_columns():
+        """ Returns the columns needed to build a recipe summary."""
+
+        return (Recipe.recipe_id,
+                Recipe.title,
+                Recipe.image,
+                Recipe.servings,
+                Recipe.ingredients,
+                Recipe.summary_updated_at,
+                )
+
+    def set_summary(self, recipe_info):
+        """ Copies summary fields from recipe info."""
+
+        for column, value in summary_values(recipe_info).items():
+            setattr(self, column, value)
+
 
 class ShoppingList(db.Model):
     """Shopping list data."""
 
     __tablename__ = 'shopping_lists'
+    __table_args__ = (db.Index('ix_shopping_lists_user_id_has_shopped', 'user_id', 'has_shopped'),
+                      )
 
     list_id = db.Column(db.Integer, autoincrement=True, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.user_id'), nullable=False)
     has_shopped = db.Column(db.Boolean, nullable=False)
+    # 'pending' while a background job builds the list, then 'ready' or 'failed'
+    status = db.Column(db.String(20), nullable=False, default='ready', server_default='ready')
 
     # Define relationship to users table
     user = db.relationship("User", backref=db.backref('shopping_lists'))
@@ -162,17 +297,20 @@ class ShoppingList(db.Model):
     def get_ingredients(self):
         """ Returns ingredients from a shopping list."""
 
-        list_ingredients = ListIngredient.query.filter(ListIngredient.shopping_list_id == self.list_id).all()
-
-        all_ingredients = {}
+        # One query for the list and its ingredients, already grouped by aisle
+        list_ingredients = db.session.query(ListIngredient.ingredient_id,
+                                            ListIngredient.aggregate_quantity,
+                                            Ingredient.base_unit,
+                                            Ingredient.ingredient_name,
+                                            Ingredient.ingredient_aisle,
+                                            ).join(Ingredient).filter(ListIngredient.shopping_list_id == self.list_id,
+                                                                      ).order_by(Ingredient.ingredient_aisle,
+                                                                                 Ingredient.ingredient_name,
+                                                                                 ).all()
 
-        for ingredient in list_ingredients:
-            ingredient_id = ingredient.ingredient_id
-            ingredient_qty = ingredient.aggregate_quantity
-            ingredient_unit = ingredient.ingredient.base_unit
-            ingredient_name = ingredient.ingredient.ingredient_name
-            ingredient_aisle = ingredient.ingredient.ingredient_aisle
+        all_ingredients = OrderedDict()
 
+        for (ingredient_id, ingredient_qty, ingredient_unit, ingredient_name, ingredient_aisle) in list_ingredients:
             if ingredient_aisle not in all_ingredients:
                 all_ingredients[ingredient_aisle] = [(ingredient_id, ingredient_qty, ingredient_unit, ingredient_name)]
             else:
@@ -185,6 +323,8 @@ class ListIngredient(db.Model):
     """Shopping list ingredient data."""
 
     __tablename__ = 'shopping_list_ingredients'
+    __table_args__ = (db.Index('ix_shopping_list_ingredients_shopping_list_id', 'shopping_list_id'),
+                      )
 
     list_ingredient_id = db.Column(db.Integer, autoincrement=True, primary_key=True)
     shopping_list_id = db.Column(db.Integer, db.ForeignKey('shopping_lists.list_id'), nullable=False)
@@ -227,6 +367,9 @@ class Inventory(db.Model):
     """ Inventory data."""
 
     __tablename__ = 'inventory'
+    # The unique constraint's index also serves reads of a user's whole inventory
+    __table_args__ = (db.UniqueConstraint('user_id', 'ingredient_id', name='inventory_user_id_ingredient_id_key'),
+                      )
 
     inventory_id = db.Column(db.Integer, autoincrement=True, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.user_id'), nullable=False)
@@ -240,6 +383,79 @@ class Inventory(db.Model):
     ingredients = db.relationship("Ingredient", backref=db.backref('inventory'))
 
 
+class InventorySnapshot(object):
+    """ A user's inventory as of one inventory version.
+
+    Built from (ingredient id, current quantity, base unit, ingredient name)
+    rows sorted by name. Holds every row's quantity by ingredient id, plus the
+    in stock rows shaped for the dashboard and for ingredient search.
+    """
+
+    def __init__(self, version, rows):
+        self.version = version
+        self.quantities = dict((row[0], row[1]) for row in rows)
+        self.current_inventory = [(row[1], row[2], row[3]) for row in rows if row[1] > 0]
+        self.in_stock = [(row[0], row[1], row[3]) for row in rows if row[1] > 0]
+
+
+inventory_snapshots = LRUCache(INVENTORY_SNAPSHOT_CACHE_SIZE, INVENTORY_SNAPSHOT_TTL)
+
+
+def bump_inventory_version(user_id):
+    """ Marks a user's inventory as changed, in the current transaction."""
+
+    db.session.query(User).filter(User.user_id == user_id).update({User.inventory_version: User.inventory_version + 1},
+                                                                  synchronize_session=False)
+
+
+class Job(db.Model):
+    """ Background job, run by job_runner."""
+
+    __tablename__ = 'jobs'
+    __table_args__ = (db.UniqueConstraint('user_id', 'idempotency_key'),
+                      db.Index('ix_jobs_status', 'status'),
+                      )
+
+    job_id = db.Column(db.Integer, autoincrement=True, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.user_id'), nullable=False)
+    # Sent with the request that queued the job, so repeating it finds this job
+    idempotency_key = db.Column(db.String(64), nullable=False)
+    kind = db.Column(db.String(30), nullable=False)
+    params = db.Column(db.JSON, nullable=False)
+    # 'queued', 'running', 'done' or 'failed'
+    status = db.Column(db.String(20), nullable=False)
+    shopping_list_id = db.Column(db.Integer, db.ForeignKey('shopping_lists.list_id'), nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        """ Provide helpful representation when printed."""
+
+        return '<Job job_id=%s kind=%s status=%s>' % (self.job_id,
+                                                      self.kind,
+                                                      self.status,
+                                                      )
+
+
+class RecipeCache(db.Model):
+    """ Cached recipe information from the API."""
+
+    __tablename__ = 'recipe_cache'
+
+    recipe_id = db.Column(db.Integer, primary_key=True)
+    # compact_recipe.pack() of the recipe info
+    packed = db.Column(db.LargeBinary, nullable=False)
+    fetched_at = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        """ Provide helpful representation when printed."""
+
+        return '<RecipeCache recipe_id=%s fetched_at=%s>' % (self.recipe_id,
+                                                             self.fetched_at,
+                                                             )
+
+
 """ Helper functions for applications. """
 
 
@@ -291,29 +507,72 @@ def example_data():
     db.session.commit()
 
 
+# Shared by every request so API connections are reused
+api_client = ApiClient()
+
+
 def call_api(url):
-    """ Takes in a url and requests data from API."""
+    """ Takes in a url and requests data from API.
 
-    # These code snippets use an open-source library. http://unirest.io/python
-    response = unirest.get(url,
-        headers={
-        "X-Mashape-Key": os.environ["SPOONACULAR_SECRET_KEY"],
-        "Accept": "application/json"
-                }
-    )
+    Returns a response with the status code and parsed body.
+    """
+
+    start = time.time()
+
+    try:
+        response = api_client.get(url, headers={"X-Mashape-Key": os.environ["SPOONACULAR_SECRET_KEY"]})
+    finally:
+        record_api_call(time.time() - start)
 
     return response
 
 
+search_cache = LRUCache(SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL)
+search_flights = SingleFlight()
+
+
+def split_search_terms(search_string):
+    """ Takes in a string of terms joined by "%2C+" and returns them normalized and sorted."""
+
+    terms = set()
+
+    for term in (search_string or '').split('%2C+'):
+        term = ' '.join(term.lower().split())
+        if term:
+            terms.add(term)
+
+    return sorted(terms)
+
+
+def cached_search(key, url):
+    """ Returns the API response body for url, cached under key.
+
+    Concurrent identical searches wait for one shared API call. Only
+    successful responses are cached.
+    """
+
+    body = search_cache.get(key)
+    if body is not None:
+        return body
+
+    def _search():
+        response = call_api(url)
+        if response.code == 200:
+            search_cache.set(key, response.body)
+        return response.body
+
+    return search_flights.do(key, _search)
+
+
 def search_api_by_ingredient(search_string):
     """ Takes in a search string and returns a list of recipes as dictionaries."""
 
-    url = "https://spoonacular-recipe-food-nutrition-v1.p.mashape.com/recipes/searchComplex?addRecipeInformation=true&fillIngredients=true&includeIngredients=" + str(search_string) + "&intolerances=&limitLicense=false&number=5&ranking=1"
+    ingredients = split_search_terms(search_string)
 
-    response = call_api(url)
+    url = API_BASE_URL + "/recipes/searchComplex?addRecipeInformation=true&fillIngredients=true&includeIngredients=" + "%2C+".join(ingredients) + "&intolerances=&limitLicense=false&number=5&ranking=1"
 
-    # response.body is the parsed response (list)
-    return response.body
+    # response body is the parsed response (list)
+    return cached_search(('by_ingredient', tuple(ingredients)), url)
 
 
 def search_recipes(diet, intolerances, query):
@@ -322,61 +581,781 @@ def search_recipes(diet, intolerances, query):
     Takes in strings for diet, intolerances and query, and an integer for numresults.
     """
 
+    return list(iter_search_recipes(diet, intolerances, query))
+
+
+def iter_search_recipes(diet, intolerances, query):
+    """ Searches for recipes and yields recipe information for each result as soon as it's ready.
+
+    Takes in strings for diet, intolerances and query. Nothing is requested
+    until the first result is asked for.
+    """
+
+    result_ids = search_recipe_ids(diet, intolerances, query)
+
+    # second request to get info by recipe id, skipping any that failed
+    for recipe_info in iter_recipe_infos_by_ids(result_ids):
+        if recipe_info is not None:
+            yield recipe_info
+
+
+def search_recipe_ids(diet, intolerances, query):
+    """ Searches for recipes and returns the ids of the results.
+
+    Takes in strings for diet, intolerances and query.
+    """
+
     # ids of recipes that meet user criteria
     result_ids = []
-    result_recipe_info = []
 
-    search_url = "https://spoonacular-recipe-food-nutrition-v1.p.mashape.com/recipes/search?diet=" + diet + "&intolerances=" + intolerances + "&number=4&query=" + query
+    # Searches differing only in case, spacing or intolerance order share a cache entry
+    diet = ' '.join((diet or '').lower().split())
+    intolerances = split_search_terms(intolerances)
+    query = ' '.join((query or '').lower().split())
+
+    search_url = API_BASE_URL + "/recipes/search?diet=" + diet + "&intolerances=" + "%2C+".join(intolerances) + "&number=4&query=" + query
 
-    response = call_api(search_url)
+    search_results = cached_search(('search', diet, tuple(intolerances), query), search_url)
 
-    # response.body is the parsed response (dict)
-    for result in response.body['results']:
+    # search_results is the parsed response (dict)
+    for result in search_results['results']:
         result_ids.append(result['id'])
 
-    # second request to get info by recipe id
-    for recipe_id in result_ids:
-        result_recipe_info.append(recipe_info_by_id(recipe_id))
+    return result_ids
 
-    return result_recipe_info
 
-def recipe_info_by_id(recipe_id):
-    """Takes in a recipe id and returns recipe info for that recipe."""
+def fetch_recipe_info(recipe_id):
+    """ Takes in a recipe id and requests recipe info for that recipe from API.
 
-    get_recipe_url = "https://spoonacular-recipe-food-nutrition-v1.p.mashape.com/recipes/" + str(recipe_id) + "/information?includeNutrition=false"
+    Raises ApiError for any response other than 200, so errors are never cached.
+    """
+
+    get_recipe_url = API_BASE_URL + "/recipes/" + str(recipe_id) + "/information?includeNutrition=false"
     recipe_response = call_api(get_recipe_url)
 
+    if recipe_response.code != 200:
+        raise ApiError(recipe_response)
+
     return recipe_response.body
 
+
+class RecipeInfoCache(object):
+    """ Tiered cache for recipe info.
+
+    Lookups check an in-process LRU first, then the shared recipe store if
+    one is attached, then the recipe_cache table, and only call the API on a
+    miss in all of them. Recipes are held as CompactRecipes, in memory as is
+    and in the store and table packed. Entries older than ttl are still
+    served for up to stale_ttl more seconds while a background thread
+    refreshes them.
+    """
+
+    def __init__(self, max_size, ttl, stale_ttl):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.memory = LRUCache(max_size, ttl + stale_ttl)
+        # RecipeStore shared with the other worker processes, see open_recipe_store()
+        self.shared = None
+        self.stats = {'memory_hits': 0,
+                      'shared_hits': 0,
+                      'db_hits': 0,
+                      'stale_hits': 0,
+                      'misses': 0,
+                      'revalidations': 0,
+                      'revalidation_errors': 0,
+                      }
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def _count(self, stat):
+        with self._lock:
+            self.stats[stat] += 1
+
+        if stat in ('memory_hits', 'shared_hits', 'db_hits'):
+            record_cache_lookup(hit=True)
+        elif stat == 'misses':
+            record_cache_lookup(hit=False)
+
+    def get_stats(self):
+        """ Returns a copy of hit/miss counters and the overall hit ratio."""
+
+        with self._lock:
+            stats = dict(self.stats)
+
+        hits = stats['memory_hits'] + stats['shared_hits'] + stats['db_hits']
+        lookups = hits + stats['misses']
+        stats['hit_ratio'] = float(hits) / lookups if lookups else 0.0
+        stats['memory_size'] = len(self.memory)
+
+        return stats
+
+    def get(self, recipe_id):
+        """ Returns recipe info for recipe id, fetching from API on a miss."""
+
+        recipe_id = int(recipe_id)
+
+        entry = self.memory.get_entry(recipe_id)
+        if entry:
+            self._count('memory_hits')
+            (recipe_info, stored_at) = entry
+            self._check_freshness(recipe_id, time.time() - stored_at)
+            return recipe_info
+
+        shared_stored_at = None
+        if self.shared is not None:
+            entry = self.shared.get(recipe_id)
+            if entry:
+                (recipe_info, shared_stored_at) = entry
+                age = time.time() - shared_stored_at
+                if age <= self.ttl + self.stale_ttl:
+                    self._count('shared_hits')
+                    self.memory.set(recipe_id, recipe_info, stored_at=shared_stored_at)
+                    self._check_freshness(recipe_id, age)
+                    return recipe_info
+
+        row = db.engine.execute(RecipeCache.__table__.select().where(RecipeCache.recipe_id == recipe_id)).first()
+        if row:
+            age = (datetime.utcnow() - row.fetched_at).total_seconds()
+            if age <= self.ttl + self.stale_ttl:
+                self._count('db_hits')
+                recipe_info = unpack(row.packed)
+                stored_at = time.time() - age
+                self.memory.set(recipe_id, recipe_info, stored_at=stored_at)
+                # Copied to the shared store only if its copy is missing or older
+                if self.shared is not None and (shared_stored_at is None or shared_stored_at < stored_at):
+                    self.shared.put(recipe_id, row.packed, stored_at=stored_at)
+                self._check_freshness(recipe_id, age)
+                return recipe_info
+
+        self._count('misses')
+        recipe_info = fetch_recipe_info(recipe_id)
+        self.store(recipe_id, recipe_info)
+
+        return recipe_info
+
+    def store(self, recipe_id, recipe_info):
+        """ Writes recipe info to every tier as a CompactRecipe."""
+
+        recipe_id = int(recipe_id)
+        recipe_info = as_compact(recipe_info)
+        packed = pack(recipe_info)
+        self.memory.set(recipe_id, recipe_info)
+
+        if self.shared is not None:
+            self.shared.put(recipe_id, packed)
+
+        # Written through the engine rather than db.session so that caching
+        # never commits whatever the calling route has pending.
+        upsert = insert(RecipeCache.__table__).values(recipe_id=recipe_id,
+                                                      packed=packed,
+                                                      fetched_at=datetime.utcnow(),
+                                                      )
+        upsert = upsert.on_conflict_do_update(index_elements=['recipe_id'],
+                                              set_={'packed': upsert.excluded.packed,
+                                                    'fetched_at': upsert.excluded.fetched_at,
+                                                    })
+        db.engine.execute(upsert)
+
+    def _check_freshness(self, recipe_id, age):
+        if age > self.ttl:
+            self._count('stale_hits')
+            self.revalidate_async(recipe_id)
+
+    def revalidate_async(self, recipe_id):
+        """ Refreshes recipe info in a background thread unless already refreshing."""
+
+        with self._lock:
+            if recipe_id in self._refreshing:
+                return
+            self._refreshing.add(recipe_id)
+
+        thread = threading.Thread(target=self.revalidate, args=(recipe_id,))
+        thread.daemon = True
+        thread.start()
+
+    def revalidate(self, recipe_id):
+        """ Fetches recipe info from API and replaces the cached copy."""
+
+        try:
+            self.store(recipe_id, fetch_recipe_info(recipe_id))
+            self._count('revalidations')
+        except Exception:
+            # Keep serving the stale copy; the next stale hit retries.
+            self._count('revalidation_errors')
+            logger.exception('Could not revalidate recipe %s', recipe_id)
+        finally:
+            with self._lock:
+                self._refreshing.discard(recipe_id)
+
+
+recipe_cache = RecipeInfoCache(RECIPE_CACHE_SIZE, RECIPE_CACHE_TTL, RECIPE_CACHE_STALE_TTL)
+
+
+def open_recipe_store(path):
+    """ Attaches the shared recipe store at path to recipe_cache and returns it.
+
+    An empty store is first filled from the recipe_cache table, and its
+    pages are read in, so a newly started worker serves recipes warm.
+    """
+
+    store = RecipeStore(path)
+
+    if not len(store):
+        oldest = datetime.utcnow() - timedelta(seconds=recipe_cache.ttl + recipe_cache.stale_ttl)
+        rows = db.engine.execute(RecipeCache.__table__.select().where(RecipeCache.fetched_at >= oldest))
+        epoch = datetime(1970, 1, 1)
+        store.put_many(((row.recipe_id, row.packed, (row.fetched_at - epoch).total_seconds()) for row in rows),
+                       if_empty=True)
+
+    store.warm()
+    recipe_cache.shared = store
+
+    return store
+
+
+def recipe_info_by_id(recipe_id):
+    """Takes in a recipe id and returns recipe info for that recipe."""
+
+    return recipe_cache.get(recipe_id)
+
+
+def recipe_infos_by_ids(recipe_ids):
+    """ Takes in a list of recipe ids and returns their recipe info in the same order.
+
+    Lookups run concurrently. Recipes that fail or time out come back as None.
+    """
+
+    return list(iter_recipe_infos_by_ids(recipe_ids))
+
+
+def iter_recipe_infos_by_ids(recipe_ids):
+    """ Takes in a list of recipe ids and yields their recipe info in the same
+    order, each as soon as it's ready.
+
+    Lookups run concurrently. Recipes that fail or time out come back as None.
+    """
+
+    stats = current_stats()
+
+    def _recipe_info_by_id(recipe_id):
+        # Count the lookup towards the request that asked for it
+        with use_stats(stats):
+            return recipe_info_by_id(recipe_id)
+
+    return fan_out_iter(_recipe_info_by_id, recipe_ids,
+                        max_workers=RECIPE_FETCH_WORKERS,
+                        timeout=RECIPE_FETCH_TIMEOUT,
+                        )
+
+
+def iter_recipe_infos_as_completed(recipe_ids):
+    """ Takes in a list of recipe ids and yields (recipe id, recipe info) pairs
+    in the order the lookups finish.
+
+    Every id is yielded once. Recipes that fail or time out come last, with
+    None as their info.
+    """
+
+    stats = current_stats()
+    recipe_ids = list(recipe_ids)
+
+    def _recipe_info_by_id(recipe_id):
+        # Count the lookup towards the request that asked for it
+        with use_stats(stats):
+            return recipe_info_by_id(recipe_id)
+
+    finished = set()
+    for index, recipe_info in fan_out_as_completed(_recipe_info_by_id, recipe_ids,
+                                                   max_workers=RECIPE_FETCH_WORKERS,
+                                                   timeout=RECIPE_FETCH_TIMEOUT,
+                                                   ):
+        finished.add(index)
+        yield (recipe_ids[index], recipe_info)
+
+    for index, recipe_id in enumerate(recipe_ids):
+        if index not in finished:
+            yield (recipe_id, None)
+
+
+def summary_values(recipe_info):
+    """ Takes in recipe info and returns the summary column values for the recipes table."""
+
+    recipe = as_compact(recipe_info)
+
+    ingredients = []
+    for ingredient in recipe.ingredients:
+        ingredients.append(dict((field, ingredient.get(field)) for field in SUMMARY_INGREDIENT_FIELDS))
+
+    return {'title': recipe.get('title'),
+            'image': recipe.get('image'),
+            'servings': recipe.get('servings'),
+            'ingredients': ingredients,
+            'summary_updated_at': datetime.utcnow(),
+            }
+
+
+def summary_to_recipe_info(recipe_id, values):
+    """ Takes in summary column values and returns them as a CompactRecipe."""
+
+    return as_compact({'id': recipe_id,
+                       'title': values['title'],
+                       'image': values['image'],
+                       'servings': values['servings'],
+                       'extendedIngredients': values['ingredients'] or [],
+                       })
+
+
+def refresh_recipe_summaries(recipe_ids):
+    """ Takes in a list of recipe ids, stores fresh summaries for them and
+    returns a dictionary of recipe id to summary.
+
+    Recipes whose info can't be fetched are left out.
+    """
+
+    summaries = {}
+    updates = []
+
+    for recipe_id, recipe_info in zip(recipe_ids, recipe_infos_by_ids(recipe_ids)):
+        if recipe_info is None:
+            continue
+        values = summary_values(recipe_info)
+        summaries[recipe_id] = summary_to_recipe_info(recipe_id, values)
+        recipe_index.add_recipe(recipe_id, values['ingredients'])
+        values['summary_recipe_id'] = recipe_id
+        updates.append(values)
+
+    if updates:
+        # Written through the engine so the calling route's session is left alone
+        recipes = Recipe.__table__
+        db.engine.execute(recipes.update().where(recipes.c.recipe_id == bindparam('summary_recipe_id')), updates)
+
+    return summaries
+
+
+def load_recipe_summaries(rows):
+    """ Takes in rows of Recipe.summary_columns() and returns a dictionary of
+    recipe id to summary, refreshing summaries that are missing or out of date."""
+
+    summaries = {}
+    to_refresh = []
+    oldest_fresh = datetime.utcnow() - timedelta(seconds=RECIPE_SUMMARY_TTL)
+
+    for row in rows:
+        if row.recipe_id in summaries or row.recipe_id in to_refresh:
+            continue
+        if row.summary_updated_at is None:
+            to_refresh.append(row.recipe_id)
+            continue
+        if row.summary_updated_at < oldest_fresh:
+            to_refresh.append(row.recipe_id)
+        summaries[row.recipe_id] = summary_to_recipe_info(row.recipe_id, row._asdict())
+
+    if to_refresh:
+        # Out of date summaries are still used if the refresh fails
+        summaries.update(refresh_recipe_summaries(to_refresh))
+
+    return summaries
+
+
+def get_recipe_summaries(recipe_ids):
+    """ Takes in a list of recipe ids and returns a dictionary of recipe id to
+    summary, read from the recipes table in one query.
+
+    Summaries are CompactRecipes with id, title, image, servings and
+    ingredients.
+    """
+
+    recipe_ids = set(int(recipe_id) for recipe_id in recipe_ids)
+    if not recipe_ids:
+        return {}
+
+    rows = db.session.query(*Recipe.summary_columns()).filter(Recipe.recipe_id.in_(recipe_ids)).all()
+    summaries = load_recipe_summaries(rows)
+
+    # Recipes not recorded yet are summarized straight from recipe info
+    missing_ids = list(recipe_ids - set(summaries))
+    for recipe_id, recipe_info in zip(missing_ids, recipe_infos_by_ids(missing_ids)):
+        if recipe_info is not None:
+            summaries[recipe_id] = summary_to_recipe_info(recipe_id, summary_values(recipe_info))
+
+    return summaries
+
+
+def record_recipe(recipe_id):
+    """ Adds a recipe to the recipes table if it isn't there yet.
+
+    Its recipe info is prefetched in the background, so it's cached, and the
+    summary filled in, by the time a shopping list or the dashboard needs it.
+    """
+
+    recipe = Recipe.query.get(int(recipe_id))
+
+    if not recipe:
+        recipe = Recipe(recipe_id=int(recipe_id))
+        db.session.add(recipe)
+        db.session.commit()
+
+    prefetch_runner.submit(recipe.recipe_id)
+
+    return recipe
+
+
+def prefetch_recipe(recipe_id):
+    """ Loads a recipe's info into recipe_cache and fills in its summary if it
+    has none yet. Runs on prefetch_runner's threads."""
+
+    recipe_info = recipe_info_by_id(recipe_id)
+
+    recipes = Recipe.__table__
+    row = db.engine.execute(select([recipes.c.summary_updated_at]).where(recipes.c.recipe_id == recipe_id)).first()
+    if row is None or row.summary_updated_at is not None:
+        return
+
+    values = summary_values(recipe_info)
+    db.engine.execute(recipes.update().where((recipes.c.recipe_id == recipe_id) &
+                                             recipes.c.summary_updated_at.is_(None)).values(**values))
+    recipe_index.add_recipe(recipe_id, values['ingredients'])
+
+
+# Shared by every user, so a recipe selected by many is fetched once at a time
+prefetch_runner = JobRunner(prefetch_recipe, RECIPE_PREFETCH_WORKERS)
+
+
+recipe_index = RecipeIndex()
+recipe_index_flights = SingleFlight()
+
+
+def get_recipe_index():
+    """ Returns the ingredient index, rebuilding it from stored recipes if it's out of date."""
+
+    def _rebuild():
+        rows = db.session.query(Recipe.recipe_id, Recipe.ingredients).filter(Recipe.ingredients.isnot(None)).all()
+        recipe_index.rebuild(rows)
+
+    if recipe_index.built_at is None or time.time() - recipe_index.built_at > RECIPE_INDEX_TTL:
+        recipe_index_flights.do('rebuild', _rebuild)
+
+    return recipe_index
+
+
+def find_cookable_recipes(user, ingredient_names, limit=COOKABLE_RECIPE_LIMIT):
+    """ Takes in a user and the names of selected inventory ingredients and
+    returns ids of stored recipes, best first.
+
+    Recipes must use at least one selected ingredient and have enough of each
+    selected ingredient they use; they are ranked by the fraction of all
+    their ingredients the user has enough of.
+    """
+
+    inventory = user.get_in_stock_inventory()
+    ingredient_names = set(ingredient_names)
+
+    inventory_quantities = {}
+    selected_ids = set()
+    for ingredient_id, current_quantity, ingredient_name in inventory:
+        inventory_quantities[ingredient_id] = current_quantity
+        if ingredient_name in ingredient_names:
+            selected_ids.add(ingredient_id)
+
+    if not selected_ids:
+        return []
+
+    ranked = get_recipe_index().rank(inventory_quantities, ingredient_ids=selected_ids, limit=limit)
+
+    return [recipe_id for (recipe_id, fraction, on_hand, ingredient_count) in ranked]
+
+
+def cook_recipe(user_id, recipe_id):
+    """ Subtracts a recipe's ingredients from a user's inventory and marks the recipe cooked.
+
+    One of the user's in progress copies of the recipe and then their
+    inventory rows for it are locked with SELECT ... FOR UPDATE, checked in
+    memory and updated with a single statement, so two concurrent cooks can't
+    both spend the same inventory. Returns False without changing anything if
+    the recipe isn't in progress or any ingredient is missing or short.
+    """
+
+    recipe_id = int(recipe_id)
+    summaries = get_recipe_summaries([recipe_id])
+    if recipe_id not in summaries:
+        return False
+
+    # A second cook of the same copy waits here, then finds it already cooked
+    user_recipe = db.session.query(UserRecipe.user_recipe_id).filter(UserRecipe.recipe_id == recipe_id,
+                                                                     UserRecipe.user_id == user_id,
+                                                                     UserRecipe.status == 'in_progress',
+                                                                     ).order_by(UserRecipe.user_recipe_id).limit(1).with_for_update().first()
+    if user_recipe is None:
+        db.session.rollback()
+        return False
+
+    matrix = RequirementMatrix([(recipe_id, summaries[recipe_id]['extendedIngredients'])])
+    requirements = matrix.requirements(recipe_id)
+
+    # Locked in ingredient order, like add_purchases, so concurrent cooks and purchases can't deadlock
+    inventory = db.session.query(Inventory.inventory_id,
+                                 Inventory.ingredient_id,
+                                 Inventory.current_quantity,
+                                 ).filter(Inventory.user_id == user_id,
+                                          Inventory.ingredient_id.in_(list(requirements)),
+                                          ).order_by(Inventory.ingredient_id).with_for_update().all()
+
+    # Every ingredient must be in inventory with at least the amount needed in base units
+    feasibility = matrix.check(dict((row.ingredient_id, row.current_quantity) for row in inventory))
+    if not feasibility.is_feasible(recipe_id):
+        db.session.rollback()
+        return False
+
+    inventory_ids = dict((row.ingredient_id, row.inventory_id) for row in inventory)
+    amounts_needed = dict((inventory_ids[ingredient_id], amount) for ingredient_id, amount in requirements.items())
+
+    if amounts_needed:
+        db.session.query(Inventory).filter(Inventory.inventory_id.in_(amounts_needed)).update(
+            {Inventory.current_quantity: Inventory.current_quantity - case(amounts_needed, value=Inventory.inventory_id)},
+            synchronize_session=False)
+        bump_inventory_version(user_id)
+
+    db.session.query(UserRecipe).filter(UserRecipe.user_recipe_id == user_recipe.user_recipe_id).update(
+        {UserRecipe.status: 'cooked'},
+        synchronize_session=False)
+
+    db.session.commit()
+
+    return True
+
+
 def convert_to_base_unit(amount, input_unit):
     """Takes in an amount and unit and returns the converted quantity and base unit."""
 
-    if input_unit.lower() in ['lb', 'pounds', 'pound']:
-        new_amount = amount * 16.00
-        return (new_amount, 'ounces')
-    elif input_unit.lower() in ['tbsp', 'tablespoons', 'tbs', 'tbsps', 'tablespoon']:
-        new_amount = amount * 3.00
-        return (new_amount, 'teaspoons')
-    else:
-        return (amount, input_unit)
+    return units.convert(amount, input_unit)
 
 def aggregate_ingredients(all_user_recipes):
     """ Takes a list of recipe ids and aggregates ingredients."""
 
-    aggregated_ingredients = {}
+    recipe_ids = [int(recipe_id[0]) for recipe_id in all_user_recipes]
+    summaries = get_recipe_summaries(recipe_ids)
 
-    for recipe_id in all_user_recipes:
-        recipe_info = recipe_info_by_id(recipe_id[0])
+    return aggregate_recipes([summaries[recipe_id] for recipe_id in recipe_ids if recipe_id in summaries])
 
-        for ingredient in recipe_info['extendedIngredients']:
-            (converted_amount, base_unit) = convert_to_base_unit(ingredient['amount'], ingredient['unitLong'])
 
-            if ingredient['id'] not in aggregated_ingredients:
-                aggregated_ingredients[ingredient['id']] = {'quantity': converted_amount, 'unit': base_unit, 'name': ingredient['name'], 'aisle': ingredient['aisle']}
-            else:
-                aggregated_ingredients[ingredient['id']]['quantity'] += converted_amount
+class RecipesUnavailable(Exception):
+    """ Raised when none of the recipes for a shopping list could be loaded."""
+
+
+def build_shopping_list(user_id, recipe_status, shopping_list_id=None):
+    """ Creates a shopping list for a user's recipes with recipe_status and
+    moves those recipes to 'in_progress'. Returns the new shopping list.
+
+    With shopping_list_id, fills in that pending list instead of creating one.
+
+    Recipes marked 'needs_ingredients' get all of their ingredients,
+    aggregated. Recipes marked 'needs_missing_ingredients' only get the
+    ingredients missing from the user's inventory.
+
+    Recipes whose info can't be loaded are left with recipe_status for a
+    later list; if none can be, raises RecipesUnavailable.
+
+    Runs a fixed number of statements however many recipes there are, and
+    commits once.
+    """
+
+    user_recipes = db.session.query(UserRecipe.user_recipe_id, UserRecipe.recipe_id).filter(UserRecipe.user_id == user_id, UserRecipe.status == recipe_status).all()
+    recipe_ids = [user_recipe.recipe_id for user_recipe in user_recipes]
+
+    # (ingredient_id, quantity, base_unit, name, aisle) per shopping list row
+    list_rows = []
+
+    if recipe_status == 'needs_missing_ingredients':
+        current_user = User.query.get(user_id)
+        results_recipes = current_user.get_used_and_missing_ingredients(recipe_ids)
+        loaded_ids = set(results_recipes)
+        for recipe_id in results_recipes:
+            list_rows.extend(results_recipes[recipe_id]['missing_ing'])
+    else:
+        summaries = get_recipe_summaries(recipe_ids)
+        loaded_ids = set(summaries)
+        aggregated_ingredients = aggregate_recipes([summaries[recipe_id] for recipe_id in recipe_ids if recipe_id in summaries])
+        for ingredient_id in aggregated_ingredients:
+            ingredient = aggregated_ingredients[ingredient_id]
+            list_rows.append((ingredient_id, ingredient['quantity'], ingredient['unit'], ingredient['name'], ingredient['aisle']))
+            if 'other_units' in ingredient:
+                # A list row holds one quantity, in the ingredient's base unit
+                logger.warning('Shopping list for user %s leaves out %s of ingredient %s', user_id, ingredient['other_units'], ingredient_id)
+
+    if recipe_ids and not loaded_ids:
+        db.session.rollback()
+        raise RecipesUnavailable('None of recipes %s could be loaded' % ', '.join(str(recipe_id) for recipe_id in sorted(set(recipe_ids))))
+
+    if shopping_list_id is None:
+        new_shopping_list = ShoppingList(user_id=user_id,
+                                         has_shopped=False,
+                                         )
+        db.session.add(new_shopping_list)
+        db.session.flush()
+    else:
+        new_shopping_list = ShoppingList.query.get(shopping_list_id)
+        new_shopping_list.status = 'ready'
+
+    if list_rows:
+        new_ingredients = {}
+        for (ingredient_id, quantity, base_unit, name, aisle) in list_rows:
+            new_ingredients.setdefault(int(ingredient_id), {'ingredient_id': int(ingredient_id),
+                                                            'ingredient_name': name,
+                                                            'base_unit': base_unit,
+                                                            'ingredient_aisle': aisle,
+                                                            })
+
+        db.session.execute(insert(Ingredient.__table__).values(list(new_ingredients.values())).on_conflict_do_nothing(index_elements=['ingredient_id']))
+
+        db.session.execute(ListIngredient.__table__.insert(),
+                           [{'shopping_list_id': new_shopping_list.list_id,
+                             'ingredient_id': int(row[0]),
+                             'aggregate_quantity': row[1],
+                             }
+                            for row in list_rows])
+
+    # Update status of recipes added to shopping list to 'in progress'
+    user_recipe_ids = [user_recipe.user_recipe_id for user_recipe in user_recipes if user_recipe.recipe_id in loaded_ids]
+    if user_recipe_ids:
+        db.session.query(UserRecipe).filter(UserRecipe.user_recipe_id.in_(user_recipe_ids)).update({UserRecipe.status: 'in_progress'},
+                                                                                                  synchronize_session=False)
+
+    db.session.commit()
+
+    return new_shopping_list
+
+
+def enqueue_shopping_list(user_id, recipe_status, idempotency_key):
+    """ Queues building a shopping list for a user's recipes with recipe_status
+    and returns the Job.
+
+    A pending shopping list is created straight away for the job to fill in.
+    Queueing again with the same idempotency key returns the job the key
+    first created instead of queueing another.
+    """
+
+    jobs = Job.__table__
+    now = datetime.utcnow()
+
+    # A concurrent request with the same key waits here until the first commits
+    new_job = insert(jobs).values(user_id=user_id,
+                                  idempotency_key=idempotency_key,
+                                  kind='build_shopping_list',
+                                  params={'recipe_status': recipe_status},
+                                  status='queued',
+                                  created_at=now,
+                                  updated_at=now,
+                                  )
+    new_job = new_job.on_conflict_do_nothing(index_elements=['user_id', 'idempotency_key']).returning(jobs.c.job_id)
+    inserted = db.session.execute(new_job).first()
+
+    if inserted is None:
+        db.session.rollback()
+        return Job.query.filter(Job.user_id == user_id, Job.idempotency_key == idempotency_key).one()
+
+    shopping_list = ShoppingList(user_id=user_id,
+                                 has_shopped=False,
+                                 status='pending',
+                                 )
+    db.session.add(shopping_list)
+    db.session.flush()
+
+    db.session.query(Job).filter(Job.job_id == inserted.job_id).update({Job.shopping_list_id: shopping_list.list_id},
+                                                                     synchronize_session=False)
+    db.session.commit()
 
-    return aggregated_ingredients
+    job_runner.submit(inserted.job_id)
+
+    return Job.query.get(inserted.job_id)
+
+
+def run_build_shopping_list(job):
+    """ Builds the pending shopping list of a build_shopping_list job."""
+
+    build_shopping_list(job.user_id, job.params['recipe_status'], job.shopping_list_id)
+
+
+JOB_HANDLERS = {'build_shopping_list': run_build_shopping_list,
+                }
+
+
+def run_job(job_id):
+    """ Runs a queued job, unless another process has already claimed it.
+
+    Runs on job_runner's threads. A failed job keeps its error, and its
+    shopping list is marked failed.
+    """
+
+    jobs = Job.__table__
+
+    # Claiming the job in one statement keeps it from running twice
+    claim = jobs.update().where((jobs.c.job_id == job_id) & (jobs.c.status == 'queued'))
+    claim = claim.values(status='running', updated_at=datetime.utcnow()).returning(*jobs.c)
+    job = db.engine.execute(claim).first()
+    if job is None:
+        return
+
+    (status, error) = ('done', None)
+    try:
+        JOB_HANDLERS[job.kind](job)
+    except Exception as exception:
+        db.session.rollback()
+        logger.exception('Job %s failed', job_id)
+        (status, error) = ('failed', '%s' % exception)
+        if job.shopping_list_id is not None:
+            lists = ShoppingList.__table__
+            db.engine.execute(lists.update().where(lists.c.list_id == job.shopping_list_id).values(status='failed'))
+    finally:
+        db.session.remove()
+
+    db.engine.execute(jobs.update().where(jobs.c.job_id == job_id).values(status=status, error=error, updated_at=datetime.utcnow()))
+
+
+job_runner = JobRunner(run_job, JOB_WORKERS)
+
+
+def recover_jobs():
+    """ Queues jobs left behind by a stopped process: those still queued, and
+    those marked running for longer than JOB_STALE_AFTER. Called at startup."""
+
+    jobs = Job.__table__
+    stale = datetime.utcnow() - timedelta(seconds=JOB_STALE_AFTER)
+
+    db.engine.execute(jobs.update().where((jobs.c.status == 'running') & (jobs.c.updated_at < stale)).values(status='queued',
+                                                                                                           updated_at=datetime.utcnow()))
+
+    for row in db.engine.execute(select([jobs.c.job_id]).where(jobs.c.status == 'queued').order_by(jobs.c.job_id)):
+        job_runner.submit(row.job_id)
+
+
+def add_purchases(user_id, shopping_list_id, purchased_quantities):
+    """ Adds purchased quantities to a user's inventory and marks the shopping list as shopped.
+
+    Takes in a dictionary of ingredient id to purchased quantity. New
+    ingredients are inserted and existing ones incremented with a single
+    INSERT ... ON CONFLICT DO UPDATE, committed together with the shopping
+    list update. Rows are written, and so locked, in ingredient order, the
+    same order cook_recipe locks them in, so concurrent updates can't deadlock.
+    """
+
+    if purchased_quantities:
+        inventory = Inventory.__table__
+        upsert = insert(inventory).values([{'user_id': user_id,
+                                            'ingredient_id': ingredient_id,
+                                            'current_quantity': quantity,
+                                            }
+                                           for ingredient_id, quantity in sorted(purchased_quantities.items(),
+                                                                                 key=lambda item: int(item[0]))])
+        upsert = upsert.on_conflict_do_update(index_elements=['user_id', 'ingredient_id'],
+                                              set_={'current_quantity': inventory.c.current_quantity + upsert.excluded.current_quantity})
+        db.session.execute(upsert)
+        bump_inventory_version(user_id)
+
+    # Change status of shopping list since list has been used by user
+    db.session.query(ShoppingList).filter(ShoppingList.list_id == shopping_list_id, ShoppingList.user_id == user_id).update({ShoppingList.has_shopped: True},
+                                                                                                                          synchronize_session=False)
+
+    db.session.commit()
 
 
 # if __name__ == "__main__":
@@ -0,0 +1,161 @@
+""" In-process inverted index of stored recipes by ingredient.
+
+Maps each ingredient id to the recipes that use it and the quantity each
+recipe needs in base units. Ranking a user's inventory against it only
+touches the posting lists of ingredients the user has, with each list held
+as NumPy arrays so sufficiency is one comparison per ingredient and the
+per-recipe counts one bincount.
+"""
+
+import threading
+import time
+
+import numpy as np
+
+import units
+
+
+def required_quantities(ingredients):
+    """ Takes in recipe ingredients and returns a dictionary of ingredient id
+    to the total quantity needed in base units."""
+
+    required = {}
+
+    for ingredient, (converted_amount, base_unit) in zip(ingredients, units.convert_ingredients(ingredients)):
+        ingredient_id = int(ingredient['id'])
+        required[ingredient_id] = required.get(ingredient_id, 0) + float(converted_amount or 0)
+
+    return required
+
+
+class RecipeIndex(object):
+    """ Inverted index from ingredient id to recipes, with required quantities.
+
+    Recipes are numbered by position as they are added. Re-adding a recipe
+    retires its old position rather than editing posting lists in place;
+    rebuild() compacts everything.
+    """
+
+    def __init__(self):
+        self.built_at = None
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._positions = {}
+        self._recipe_ids = []
+        self._sizes = []
+        # ingredient id: ([positions], [required quantities])
+        self._postings = {}
+        # ingredient id: (positions array, required array), rebuilt when a posting list changes
+        self._arrays = {}
+        self._recipe_id_array = None
+        self._size_array = None
+
+    def __len__(self):
+        return len(self._positions)
+
+    def rebuild(self, recipes):
+        """ Replaces the index with recipes, a list of (recipe id, ingredients)."""
+
+        index = RecipeIndex()
+        for recipe_id, ingredients in recipes:
+            index._add(recipe_id, ingredients)
+
+        with self._lock:
+            (self._positions, self._recipe_ids, self._sizes, self._postings) = (index._positions, index._recipe_ids, index._sizes, index._postings)
+            self._arrays = {}
+            self._recipe_id_array = None
+            self._size_array = None
+            self.built_at = time.time()
+
+    def add_recipe(self, recipe_id, ingredients):
+        """ Adds or replaces one recipe."""
+
+        with self._lock:
+            self._add(recipe_id, ingredients)
+
+    def _add(self, recipe_id, ingredients):
+        recipe_id = int(recipe_id)
+        required = required_quantities(ingredients or [])
+
+        old_position = self._positions.get(recipe_id)
+        if old_position is not None:
+            self._sizes[old_position] = 0
+
+        position = len(self._recipe_ids)
+        self._positions[recipe_id] = position
+        self._recipe_ids.append(recipe_id)
+        self._sizes.append(len(required))
+
+        for ingredient_id, quantity in required.items():
+            (positions, quantities) = self._postings.setdefault(ingredient_id, ([], []))
+            positions.append(position)
+            quantities.append(quantity)
+            self._arrays.pop(ingredient_id, None)
+
+        self._recipe_id_array = None
+        self._size_array = None
+
+    def _posting_arrays(self, ingredient_id):
+        arrays = self._arrays.get(ingredient_id)
+        if arrays is None and ingredient_id in self._postings:
+            (positions, quantities) = self._postings[ingredient_id]
+            arrays = self._arrays[ingredient_id] = (np.array(positions, dtype=np.int64), np.array(quantities, dtype=np.float64))
+        return arrays
+
+    def _count(self, ingredient_quantities, count):
+        """ Returns per-position counts of postings with required <= quantity."""
+
+        matched = []
+        for ingredient_id, quantity in ingredient_quantities:
+            arrays = self._posting_arrays(ingredient_id)
+            if arrays is not None:
+                (positions, required) = arrays
+                matched.append(positions if quantity is None else positions[required <= quantity])
+
+        if not matched:
+            return np.zeros(count, dtype=np.int64)
+
+        return np.bincount(np.concatenate(matched), minlength=count)
+
+    def rank(self, inventory_quantities, ingredient_ids=None, limit=None):
+        """ Ranks recipes by the fraction of their ingredients on hand.
+
+        Takes in a dictionary of ingredient id to current quantity. An
+        ingredient is on hand when the quantity covers what the recipe needs.
+        With ingredient_ids, only recipes that use at least one of them, and
+        have enough of every one they use, are ranked. Returns up to limit
+        (recipe id, fraction on hand, ingredients on hand, ingredient count)
+        tuples, best first.
+        """
+
+        with self._lock:
+            count = len(self._recipe_ids)
+            if not count:
+                return []
+
+            if self._recipe_id_array is None:
+                self._recipe_id_array = np.array(self._recipe_ids, dtype=np.int64)
+                self._size_array = np.array(self._sizes, dtype=np.int64)
+            (recipe_ids, sizes) = (self._recipe_id_array, self._size_array)
+
+            on_hand = self._count(inventory_quantities.items(), count)
+            candidates = (sizes > 0) & (on_hand > 0)
+
+            if ingredient_ids is not None:
+                ingredient_ids = set(ingredient_ids)
+                uses = self._count([(ingredient_id, None) for ingredient_id in ingredient_ids], count)
+                enough = self._count([(ingredient_id, inventory_quantities.get(ingredient_id, 0)) for ingredient_id in ingredient_ids], count)
+                candidates &= (uses > 0) & (enough == uses)
+
+        positions = np.flatnonzero(candidates)
+        fractions = on_hand[positions] / sizes[positions].astype(np.float64)
+
+        # Highest fraction first, then most ingredients on hand, then recipe id
+        order = np.lexsort((recipe_ids[positions], -on_hand[positions], -fractions))
+        if limit is not None:
+            order = order[:limit]
+
+        return [(int(recipe_ids[positions[i]]), float(fractions[i]), int(on_hand[positions[i]]), int(sizes[positions[i]]))
+                for i in order]
@@ -0,0 +1,295 @@
+""" Recipe store shared by every worker process through memory-mapped files.
+
+Recipes are kept in compact_recipe's packed form in two files next to path:
+
+- path.data is append-only. Each record is a fixed header (recipe id,
+  stored-at time, payload length) followed by the packed recipe.
+- path.index is a sorted array of fixed-size entries (recipe id, payload
+  offset and length, stored-at time) after a short header.
+
+Readers map both files and look recipes up with a binary search over the
+index, read in place from the shared pages. Writes are serialized with an
+exclusive lock on path.lock, so there is one writer at a time: it appends
+the records, then writes a new index to a temporary file and renames it
+over path.index. A reader therefore sees either the old index or the new
+one, and every offset in either is already in the data file. Readers pick
+up a newly published index within refresh_interval seconds.
+
+Publishing rewrites the whole index, so put() doesn't publish itself: it
+queues the recipe for a background thread, which publishes everything queued
+in the last write_delay seconds as one batch.
+"""
+
+import fcntl
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+
+import numpy as np
+
+from compact_recipe import unpack
+
+INDEX_MAGIC = b'RIDX'
+INDEX_VERSION = 1
+INDEX_HEADER = struct.Struct('<4sI')
+INDEX_ENTRY = np.dtype([('recipe_id', '<i8'),
+                        ('offset', '<i8'),
+                        ('length', '<u4'),
+                        ('unused', '<u4'),
+                        ('stored_at', '<f8'),
+                        ])
+
+# recipe id, stored at, payload length
+RECORD_HEADER = struct.Struct('<qdI')
+
+logger = logging.getLogger(__name__)
+
+
+class RecipeStore(object):
+    """ Memory-mapped recipe store, read by many processes and written by one at a time."""
+
+    def __init__(self, path, refresh_interval=1.0, write_delay=0.5):
+        self.path = path
+        self.data_path = path + '.data'
+        self.index_path = path + '.index'
+        self.lock_path = path + '.lock'
+        self.refresh_interval = refresh_interval
+        self.write_delay = write_delay
+
+        self._lock = threading.Lock()
+        # Recipes queued by put(), as recipe id: (packed, stored at), and
+        # whether the writer thread is publishing a batch
+        self._queued = {}
+        self._writing = False
+        self._writes = threading.Condition()
+        self._writer_pid = None
+        # (index entries, data map, index file identity, checked at), swapped as a whole
+        self._state = (np.zeros(0, dtype=INDEX_ENTRY), None, None, 0)
+
+        with self._exclusive():
+            if not os.path.exists(self.data_path):
+                open(self.data_path, 'ab').close()
+            if not os.path.exists(self.index_path):
+                self._publish(np.zeros(0, dtype=INDEX_ENTRY))
+
+        self.refresh(force=True)
+
+    def __len__(self):
+        return len(self._current()[0])
+
+    def _exclusive(self):
+        return _FileLock(self.lock_path)
+
+    def _current(self):
+        state = self._state
+        if time.time() - state[3] >= self.refresh_interval:
+            state = self.refresh()
+        return state
+
+    def refresh(self, force=False):
+        """ Maps the latest published index and data, if they changed, and returns the state."""
+
+        with self._lock:
+            state = self._state
+            try:
+                stat = os.stat(self.index_path)
+            except OSError:
+                return state
+            identity = (stat.st_ino, stat.st_size, stat.st_mtime)
+
+            if not force and identity == state[2]:
+                self._state = state[:3] + (time.time(),)
+                return self._state
+
+            # Index first, then data, so every offset in the index is mapped
+            entries = _map_entries(self.index_path)
+            data = _map_file(self.data_path)
+
+            # Old maps are left to be freed once no reader holds them
+            self._state = (entries, data, identity, time.time())
+            return self._state
+
+    def get_packed(self, recipe_id):
+        """ Returns (packed recipe, stored at) for recipe_id, or None if it isn't stored."""
+
+        (entries, data) = self._current()[:2]
+        if not len(entries):
+            return None
+
+        position = np.searchsorted(entries['recipe_id'], int(recipe_id))
+        if position == len(entries) or entries['recipe_id'][position] != int(recipe_id):
+            return None
+
+        entry = entries[position]
+        (offset, length) = (int(entry['offset']), int(entry['length']))
+
+        return (data[offset:offset + length], float(entry['stored_at']))
+
+    def get(self, recipe_id):
+        """ Returns (CompactRecipe, stored at) for recipe_id, or None if it isn't stored."""
+
+        entry = self.get_packed(recipe_id)
+        if entry is None:
+            return None
+
+        return (unpack(entry[0]), entry[1])
+
+    def put(self, recipe_id, packed, stored_at=None):
+        """ Queues one packed recipe to be stored, replacing any earlier copy.
+
+        Returns at once; the recipe is published with the next batch.
+        """
+
+        with self._writes:
+            self._queued[int(recipe_id)] = (bytes(packed), stored_at if stored_at is not None else time.time())
+
+            # Threads don't survive a fork, so each process starts its own writer
+            if self._writer_pid != os.getpid():
+                self._writer_pid = os.getpid()
+                writer = threading.Thread(target=self._write_queued)
+                writer.daemon = True
+                writer.start()
+
+            self._writes.notify_all()
+
+    def flush(self, timeout=None):
+        """ Waits until every queued recipe is published. Returns False on timeout."""
+
+        deadline = time.time() + timeout if timeout is not None else None
+
+        with self._writes:
+            while self._queued or self._writing:
+                if deadline is None:
+                    self._writes.wait()
+                    continue
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._writes.wait(remaining)
+
+        return True
+
+    def _write_queued(self):
+        while True:
+            with self._writes:
+                while not self._queued:
+                    self._writes.wait()
+
+            # Let recipes queued close together go out in one batch
+            time.sleep(self.write_delay)
+
+            with self._writes:
+                records = [(recipe_id, packed, stored_at) for recipe_id, (packed, stored_at) in self._queued.items()]
+                self._queued = {}
+                self._writing = True
+
+            try:
+                self.put_many(records)
+            except Exception:
+                logger.exception('Could not store %s recipes in %s', len(records), self.path)
+            finally:
+                with self._writes:
+                    self._writing = False
+                    self._writes.notify_all()
+
+    def put_many(self, records, if_empty=False):
+        """ Stores (recipe id, packed recipe, stored at) records and publishes them in one index.
+
+        With if_empty, nothing is written if the store already has recipes,
+        so several workers starting at once fill it only once. Returns the
+        number of records written.
+        """
+
+        with self._exclusive():
+            entries = _map_entries(self.index_path)
+            if if_empty and len(entries):
+                return 0
+
+            latest = {}
+            with open(self.data_path, 'ab') as data_file:
+                data_file.seek(0, os.SEEK_END)
+                for recipe_id, packed, stored_at in records:
+                    packed = bytes(packed)
+                    data_file.write(RECORD_HEADER.pack(int(recipe_id), stored_at, len(packed)))
+                    latest[int(recipe_id)] = (data_file.tell(), len(packed), stored_at)
+                    data_file.write(packed)
+                data_file.flush()
+                os.fsync(data_file.fileno())
+
+            if not latest:
+                return 0
+
+            added = np.zeros(len(latest), dtype=INDEX_ENTRY)
+            for row, (recipe_id, (offset, length, stored_at)) in enumerate(latest.items()):
+                added[row] = (recipe_id, offset, length, 0, stored_at)
+
+            kept = entries[~np.isin(entries['recipe_id'], added['recipe_id'])]
+            merged = np.concatenate([kept, added])
+            self._publish(merged[np.argsort(merged['recipe_id'], kind='mergesort')])
+
+        self.refresh(force=True)
+
+        return len(latest)
+
+    def _publish(self, entries):
+        """ Atomically replaces the index file. Called with the write lock held."""
+
+        temporary_path = '%s.%s.tmp' % (self.index_path, os.getpid())
+        with open(temporary_path, 'wb') as index_file:
+            index_file.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION))
+            index_file.write(entries.tobytes())
+            index_file.flush()
+            os.fsync(index_file.fileno())
+
+        os.rename(temporary_path, self.index_path)
+
+    def warm(self):
+        """ Reads through the mapped data so its pages are in memory before the first request."""
+
+        data = self._current()[1]
+        if data is not None:
+            for offset in range(0, len(data), mmap.PAGESIZE):
+                data[offset]
+
+
+class _FileLock(object):
+    """ Exclusive lock on a file shared by every process, used as a context manager."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self.path, 'a')
+        fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._file.close()
+
+
+def _map_file(path):
+    """ Returns a read-only map of the whole file, or None if it's empty."""
+
+    with open(path, 'rb') as mapped_file:
+        if not os.fstat(mapped_file.fileno()).st_size:
+            return None
+        return mmap.mmap(mapped_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _map_entries(path):
+    """ Returns the index file's entries as an array backed by a read-only map."""
+
+    index = _map_file(path)
+    if index is None or len(index) <= INDEX_HEADER.size:
+        return np.zeros(0, dtype=INDEX_ENTRY)
+
+    (magic, version) = INDEX_HEADER.unpack(index[:INDEX_HEADER.size])
+    if magic != INDEX_MAGIC or version != INDEX_VERSION:
+        raise ValueError('%s is not a version %s recipe index' % (path, INDEX_VERSION))
+
+    return np.frombuffer(index, dtype=INDEX_ENTRY, offset=INDEX_HEADER.size)
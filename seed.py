@@ -3,10 +3,17 @@
 from model import User, UserRecipe, Recipe, ShoppingList, ListIngredient, Ingredient, Inventory
 from model import connect_to_db, db
 from server import app
+from migrate import run_migrations
 
 
 if __name__ == "__main__":
     connect_to_db(app)
 
+    is_new_database = not db.engine.has_table('users')
+
     # Create tables if they haven't been created already
     db.create_all()
+
+    # New tables already match the models, so migrations are only recorded;
+    # an existing database is brought up to date by running them
+    run_migrations(stamp_only=is_new_database)
@@ -1,19 +1,22 @@
 """ Flask site for project app."""
 
-from flask import Flask, render_template, request, session, jsonify, flash, redirect
+from flask import Flask, Response, abort, render_template, request, session, jsonify, flash, redirect, stream_with_context, url_for
 from flask_debugtoolbar import DebugToolbarExtension
-from model import search_recipes, recipe_info_by_id, convert_to_base_unit, search_api_by_ingredient, aggregate_ingredients
+from model import search_recipe_ids, iter_recipe_infos_as_completed, recipe_info_by_id, search_api_by_ingredient, record_recipe, cook_recipe, enqueue_shopping_list, add_purchases, find_cookable_recipes
 from model import User
 from model import UserRecipe
-from model import Recipe
 from model import ShoppingList
-from model import ListIngredient
-from model import Ingredient
-from model import Inventory
 from model import connect_to_db, db
+from model import recipe_cache, open_recipe_store
+from model import Job, recover_jobs
+from api_client import ApiError
+from feasibility import RequirementMatrix
 from jinja2 import StrictUndefined
+import instrumentation
 import json
+import logging
 import os
+import uuid
 
 app = Flask(__name__)
 
@@ -22,6 +25,54 @@ app.secret_key = os.environ["FLASK_SECRET_KEY"]
 # Raises an error if an undefined variable is used in Jinja2
 app.jinja_env.undefined = StrictUndefined
 
+# Records SQL, API and cache usage for every request and serves /metrics
+instrumentation.init_app(app)
+
+
+def recipe_cache_metrics():
+    """ Returns recipe cache counters as metrics samples."""
+
+    stats = recipe_cache.get_stats()
+
+    return [('recipe_cache_memory_hits_total', 'Recipe info found in memory.', 'counter', stats['memory_hits']),
+            ('recipe_cache_shared_hits_total', 'Recipe info found in the shared recipe store.', 'counter', stats['shared_hits']),
+            ('recipe_cache_db_hits_total', 'Recipe info found in the recipe_cache table.', 'counter', stats['db_hits']),
+            ('recipe_cache_stale_hits_total', 'Recipe info served stale while refreshing.', 'counter', stats['stale_hits']),
+            ('recipe_cache_misses_total', 'Recipe info fetched from the API.', 'counter', stats['misses']),
+            ('recipe_cache_memory_size', 'Recipes held in memory.', 'gauge', stats['memory_size']),
+            ]
+
+instrumentation.metrics.add_collector(recipe_cache_metrics)
+
+
+@app.context_processor
+def inject_idempotency_key():
+    """ Gives each rendered page a fresh key for its forms to send, so that
+    submitting the same form twice can be recognized."""
+
+    return {'idempotency_key': uuid.uuid4().hex}
+
+
+def stream_template(template_name, **context):
+    """ Renders a template as a streamed response.
+
+    Output is sent as the template produces it, so the page shell goes out
+    before any slow data the template loops over (passed as generators) is
+    ready. The final HTML is the same as render_template's.
+    """
+
+    app.update_template_context(context)
+    template = app.jinja_env.get_template(template_name)
+
+    return Response(stream_with_context(template.generate(context)))
+
+
+def sse_event(event, data):
+    """ Formats data as one server-sent event, with the data as JSON."""
+
+    return 'event: %s\ndata: %s\n\n' % (event, json.dumps(data))
+
+
 @app.route("/")
 def homepage():
     """ Display homepage."""
@@ -88,10 +139,12 @@ def display_main_page():
         current_ingredients_list = current_user.get_current_inventory()
         pending_shopping_lists = current_user.get_pending_shopping_lists()
         pending_recipes_list = current_user.get_pending_recipes()
+        cookable_recipe_ids = current_user.get_cookable_recipe_ids(pending_recipes_list)
 
         return render_template("main.html", current_ingredients=current_ingredients_list,
                                             pending_shopping_lists=pending_shopping_lists,
                                             pending_recipes_list=pending_recipes_list,
+                                            cookable_recipe_ids=cookable_recipe_ids,
                                             current_user=current_user.username,
                                             )
     else:
@@ -111,11 +164,47 @@ def show_matching_recipes():
     intolerances = request.args.getlist("intolerances")
     query = request.args.get("query")
 
+    # The page loads its cards from the event stream with the same search
+    events_url = url_for('stream_matching_recipes', diet=diet, intolerances=intolerances, query=query)
+
+    return render_template("recipes.html", events_url=events_url)
+
+
+@app.route("/recipes/events")
+def stream_matching_recipes():
+    """ Stream recipe search results as server-sent events.
+
+    Sends an ids event with the matching recipe ids once the search returns,
+    then a recipe event with the rendered card of each recipe as its info
+    arrives (or a failed event), then a done event.
+    """
+
+    diet = request.args.get("diet")
+    intolerances = request.args.getlist("intolerances")
+    query = request.args.get("query")
+
     intolerances = "%2C+".join(intolerances)
 
-    recipe_info = search_recipes(diet, intolerances, query)
+    def _events():
+        recipe_ids = search_recipe_ids(diet, intolerances, query)
+        yield sse_event('ids', recipe_ids)
+
+        for recipe_id, recipe_info in iter_recipe_infos_as_completed(recipe_ids):
+            if recipe_info is None:
+                yield sse_event('failed', {'id': recipe_id})
+            else:
+                yield sse_event('recipe', {'id': recipe_id,
+                                           'html': render_template("recipe-card.html", recipe=recipe_info),
+                                           })
+
+        yield sse_event('done', {})
+
+    response = Response(stream_with_context(_events()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Keep proxies such as nginx from buffering the stream
+    response.headers['X-Accel-Buffering'] = 'no'
 
-    return render_template("recipes.html", recipe_info=recipe_info)
+    return response
 
 
 @app.route("/user-recipes", methods=["POST"])
@@ -124,12 +213,7 @@ def update_user_recipes():
 
     recipe_id = request.form.get("recipe_id")
 
-    recipe = Recipe.query.get(int(recipe_id))
-    if not recipe:
-        new_recipe = Recipe(recipe_id=recipe_id,
-                            )
-        db.session.add(new_recipe)
-        db.session.commit()
+    record_recipe(recipe_id)
 
     new_user_recipe = UserRecipe(user_id=session['user_id'],
                                  recipe_id=recipe_id,
@@ -145,7 +229,10 @@ def update_user_recipes():
 def show_recipe_details(recipe_id):
     """ Displays recipe details."""
 
-    recipe_details = recipe_info_by_id(recipe_id)
+    try:
+        recipe_details = recipe_info_by_id(recipe_id)
+    except ApiError:
+        abort(502)
 
     return render_template("recipe_info.html", recipe_details=recipe_details)
 
@@ -156,85 +243,59 @@ def verify_recipe():
 
     recipe_id = request.form.get("data")
 
-    recipe_details = recipe_info_by_id(int(recipe_id))
+    # Checks ALL ingredients are sufficient before subtracting any of them
+    result = cook_recipe(session['user_id'], recipe_id)
 
-    # First check if ALL ingredients are sufficient to make recipe
-    for ingredient in recipe_details['extendedIngredients']:
-        # Look up ingredient in inventory table
-        check_ingredient = Inventory.query.filter(Inventory.ingredient_id == int(ingredient['id']), Inventory.user_id == session['user_id']).first()
+    return jsonify({'result': result})
 
-        if not check_ingredient:
-            return jsonify({'result': False})
-        # If unit is not the same as the base unit in inventory table, convert the unit to base unit
-        if ingredient['unitLong'] != check_ingredient.ingredients.base_unit:
-            (converted_amount, converted_unit) = convert_to_base_unit(float(ingredient['amount']), ingredient['unitLong'])
 
-            # Check if current inventory has enough for the recipe
-            if check_ingredient.current_quantity < converted_amount:
-                return jsonify({'result': False})
-        else:
-            if check_ingredient.current_quantity < round(float(ingredient['amount']),2):
-                return jsonify({'result': False})
+@app.route("/shopping_list", methods=["POST"])
+def show_shopping_list():
+    """ Creates shopping list of missing ingredients with aggregated quantities and base units."""
 
-    # If ALL ingredients are sufficient, subtract quantities
-    for ingredient in recipe_details['extendedIngredients']:
-        update_ingredient = Inventory.query.filter(Inventory.ingredient_id == int(ingredient['id']), Inventory.user_id == session['user_id']).one()
+    return queue_shopping_list('needs_ingredients')
 
-        if ingredient['unitLong'] != update_ingredient.ingredients.base_unit:
-            (converted_amount, converted_unit) = convert_to_base_unit(float(ingredient['amount']), ingredient['unitLong'])
-            # Subtract recipe amount from inventory amount
-            update_ingredient.current_quantity -= converted_amount
-        else:
-            update_ingredient.current_quantity -= round(float(ingredient['amount']),2)
 
-    # Update user_recipe status to 'cooked'
-    cooked_recipe = UserRecipe.query.filter(UserRecipe.recipe_id == int(recipe_id), UserRecipe.user_id == session['user_id'], UserRecipe.status == 'in_progress').first()
-    cooked_recipe.status = 'cooked'
+def queue_shopping_list(recipe_status):
+    """ Queues building a shopping list in the background and redirects to its page."""
 
-    db.session.commit()
+    # Forms carry a key per page load, so a double submit finds the first list
+    idempotency_key = request.form.get("idempotency_key") or uuid.uuid4().hex
 
-    return jsonify({'result': True})
+    job = enqueue_shopping_list(session['user_id'], recipe_status, idempotency_key)
 
+    return redirect("/shopping_list/%s" % job.shopping_list_id, code=303)
 
-@app.route("/shopping_list", methods=["POST"])
-def show_shopping_list():
-    """ Creates shopping list of missing ingredients with aggregated quantities and base units."""
 
-    all_user_recipes = db.session.query(UserRecipe.recipe_id).filter(UserRecipe.user_id == session['user_id'], UserRecipe.status == 'needs_ingredients').all()
-    new_shopping_list = ShoppingList(user_id=session['user_id'],
-                                     has_shopped=False,
-                                    )
-    db.session.add(new_shopping_list)
+@app.route("/shopping_list/<int:shopping_list_id>")
+def display_shopping_list(shopping_list_id):
+    """ Displays a shopping list, or that it's still being built."""
 
-    aggregated_ingredients = aggregate_ingredients(all_user_recipes)
+    shopping_list = ShoppingList.query.filter(ShoppingList.list_id == shopping_list_id, ShoppingList.user_id == session['user_id']).first_or_404()
 
-    for ingredient_id in aggregated_ingredients:
-        ingredient = db.session.query(Ingredient).filter(Ingredient.ingredient_id == ingredient_id).first()
+    ingredients = []
+    job_id = None
 
-        if not ingredient:
-            new_ingredient = Ingredient(ingredient_id=ingredient_id,
-                                        ingredient_name=aggregated_ingredients[ingredient_id]['name'],
-                                        base_unit=aggregated_ingredients[ingredient_id]['unit'],
-                                        ingredient_aisle=aggregated_ingredients[ingredient_id]['aisle'],
-                                        )
-            db.session.add(new_ingredient)
+    if shopping_list.status == 'ready':
+        ingredients = shopping_list.get_ingredients().items()
+    elif shopping_list.status == 'pending':
+        job = Job.query.filter(Job.shopping_list_id == shopping_list_id).first()
+        job_id = job.job_id if job else None
 
-        new_list_ingredient = ListIngredient(shopping_list_id=new_shopping_list.list_id,
-                                             ingredient_id=ingredient_id,
-                                             aggregate_quantity=aggregated_ingredients[ingredient_id]['quantity'],
-                                             )
-        db.session.add(new_list_ingredient)
+    return render_template("shopping.html", shopping_list=shopping_list, ingredients=ingredients, job_id=job_id)
 
-    # Update status of recipes added to shopping list to 'in progress'
-    update_recipes = UserRecipe.query.filter(UserRecipe.user_id == session['user_id'], UserRecipe.status == 'needs_ingredients').all()
-    for recipe in update_recipes:
-        recipe.status = 'in_progress'
 
-    db.session.commit()
+@app.route("/jobs/<int:job_id>.json")
+def show_job_status(job_id):
+    """ Returns a background job's status, polled by pages waiting on it."""
 
-    user_ingredients = new_shopping_list.get_ingredients()
-    
-    return render_template("shopping.html", ingredients=user_ingredients)
+    job = Job.query.filter(Job.job_id == job_id, Job.user_id == session['user_id']).first_or_404()
+
+    return jsonify({'job_id': job.job_id,
+                    'status': job.status,
+                    'shopping_list_id': job.shopping_list_id,
+                    'error': job.error,
+                    })
 
 
 @app.route("/confirm_list/<shopping_list_id>")
@@ -256,23 +317,12 @@ def add_inventory():
     inventory_dict = json.loads(inventory)
     shopping_list_id = int(request.form.get("listId"))
 
-    # Add each ingredient to inventory list
+    purchased_quantities = {}
     for ingredient_id in inventory_dict:
-        check_inventory = Inventory.query.filter(Inventory.user_id == session['user_id'], Inventory.ingredient_id == ingredient_id).first()
-        if not check_inventory:
-            new_inventory = Inventory(user_id=session['user_id'],
-                                      ingredient_id=int(ingredient_id),
-                                      current_quantity=round(float(inventory_dict[ingredient_id]['ingredientQty']),2),
-                                      )
-            db.session.add(new_inventory)
-        else:
-            check_inventory.current_quantity += round(float(inventory_dict[ingredient_id]['ingredientQty']),2)
+        purchased_quantities[int(ingredient_id)] = round(float(inventory_dict[ingredient_id]['ingredientQty']),2)
 
-    # Change status of shopping list since list has been used by user
-    shopping_list = ShoppingList.query.filter(ShoppingList.list_id == shopping_list_id).one()
-    shopping_list.has_shopped = True
-
-    db.session.commit()
+    # Add ingredients to inventory and mark the shopping list as used in one transaction
+    add_purchases(session['user_id'], shopping_list_id, purchased_quantities)
 
     return jsonify({'success': True})
 
@@ -292,45 +342,41 @@ def display_current_inventory():
 def show_search_by_results():
     """ Takes user's selected ingredients to search for recipes and displays results."""
 
-    # Retrieve list of selected ingredients by name and transform to search string
+    # Retrieve list of selected ingredients by name
     search_ingredients = request.args.getlist("ingredient")
-    ingredients = "%2C+".join(search_ingredients)
 
-    search_results = search_api_by_ingredient(ingredients)
+    current_user = User.query.get(session['user_id'])
 
-    # After getting search results, check if inventory quantity >= recipe quantity
-    # since API only searches by ingredient name and doesn't include quantities.
-    # Only display results that pass this criteria.
+    def _results_recipes():
+        # Rank the recipes we have stored by how much of them is in inventory
+        filter_recipes = find_cookable_recipes(current_user, search_ingredients)
 
-    # Filtered list of recipes to display to user
-    filter_recipes = []
+        # Until recipes using these ingredients have been stored, ask the API
+        if not filter_recipes:
+            filter_recipes = search_api_for_cookable_recipes(search_ingredients)
 
-    for recipe in search_results['results']:
-        enough_ingredients = True
+        for recipe_results in current_user.iter_used_and_missing_ingredients(filter_recipes):
+            yield recipe_results
 
-        for ingredient in recipe['usedIngredients']:
-            check_ingredient = Inventory.query.filter(Inventory.ingredient_id == int(ingredient['id']), Inventory.user_id == session['user_id']).first()
+    # The page shell is sent before searching, then each recipe card when it's ready
+    return stream_template("recipes-by-ingredient.html", results_recipes=_results_recipes())
 
-            # If the recipe ingredient's unit != inventory unit, convert it
-            if ingredient['unitLong'] != check_ingredient.ingredients.base_unit:
-                (converted_amount, converted_unit) = convert_to_base_unit(round(float(ingredient['amount']),2), ingredient['unitLong'])
-                # If recipe amount > inventory amount, don't add recipe to list
-                if converted_amount > check_ingredient.current_quantity:
-                    enough_ingredients = False
-            else:
-                # If recipe amount > inventory amount, don't add recipe to list
-                if round(float(ingredient['amount']),2) > check_ingredient.current_quantity:
-                    enough_ingredients = False
 
-        # If inventory quantities >= respective recipe quantities, add to list
-        if enough_ingredients == True:
-            filter_recipes.append(recipe['id'])
+def search_api_for_cookable_recipes(search_ingredients):
+    """ Searches the API by ingredient names and returns ids of recipes with enough of each in inventory."""
 
-    current_user = User.query.get(session['user_id'])
+    ingredients = "%2C+".join(search_ingredients)
+
+    search_results = search_api_by_ingredient(ingredients)
 
-    results_recipes = current_user.get_used_and_missing_ingredients(filter_recipes)
+    # The API only searches by ingredient name and doesn't include quantities,
+    # so keep recipes where inventory covers every ingredient they use.
+    matrix = RequirementMatrix([(recipe['id'], recipe['usedIngredients']) for recipe in search_results['results']])
 
-    return render_template("recipes-by-ingredient.html", results_recipes=results_recipes)
+    current_user = User.query.get(session['user_id'])
+    inventory_quantities = current_user.get_inventory_quantities(matrix.ingredient_ids)
+
+    return matrix.check(inventory_quantities).feasible_ids()
 
 
 @app.route("/add-recipe-id.json", methods=['POST'])
@@ -340,15 +386,8 @@ def add_recipe_id():
     # Get recipe id for recipe selected by user
     recipe_id = request.form.get('recipe_id')
 
-    # Check if recipe id already exists
-    recipe = Recipe.query.get(int(recipe_id))
-
-    # If recipe does not already exist, add it
-    if not recipe:
-        new_recipe = Recipe(recipe_id=recipe_id,
-                            )
-        db.session.add(new_recipe)
-        db.session.commit()
+    # Add recipe with its summary if it does not already exist
+    record_recipe(recipe_id)
 
     # Add recipe with status 'needs_missing_ingredients'
     new_user_recipe = UserRecipe(user_id=session['user_id'],
@@ -366,48 +405,7 @@ def add_recipe_id():
 def add_missing_ingredients():
     """ Displays shopping list with missing ingredients."""
 
-    new_recipes_to_add = db.session.query(UserRecipe.recipe_id).filter(UserRecipe.user_id == session['user_id'], UserRecipe.status == 'needs_missing_ingredients').all()
-
-    new_recipe_list = []
-    for recipe in new_recipes_to_add:
-        new_recipe_list.append(recipe[0])
-
-    new_shopping_list = ShoppingList(user_id=session['user_id'],
-                                     has_shopped=False,
-                                    )
-    db.session.add(new_shopping_list)
-
-    current_user = User.query.get(session['user_id'])
-
-    results_recipes = current_user.get_used_and_missing_ingredients(new_recipe_list)
-
-    for recipe in results_recipes:
-        for missing_ingredient in results_recipes[recipe]['missing_ing']:
-            ingredient = Ingredient.query.filter(Ingredient.ingredient_id == missing_ingredient[0]).first()
-            if not ingredient:
-                new_missing_ingredient = Ingredient(ingredient_id=missing_ingredient[0],
-                                                    ingredient_name=missing_ingredient[3],
-                                                    base_unit=missing_ingredient[2],
-                                                    ingredient_aisle=missing_ingredient[4],
-                                                    )
-                db.session.add(new_missing_ingredient)
-
-            new_list_ingredient = ListIngredient(shopping_list_id=new_shopping_list.list_id,
-                                                 ingredient_id=missing_ingredient[0],
-                                                 aggregate_quantity=missing_ingredient[1],
-                                                 )
-
-            db.session.add(new_list_ingredient)
-
-    # Update status of recipes added to shopping list to 'in progress'
-    update_recipes = UserRecipe.query.filter(UserRecipe.user_id == session['user_id'], UserRecipe.status == 'needs_missing_ingredients').all()
-    for recipe in update_recipes:
-        recipe.status = 'in_progress'
-        db.session.commit()
-
-    user_ingredients = new_shopping_list.get_ingredients()
-
-    return render_template("shopping.html", ingredients=user_ingredients)
+    return queue_shopping_list('needs_missing_ingredients')
 
 
 @app.route("/logout")
@@ -422,6 +420,10 @@ def logs_user_out():
 if __name__ == "__main__":
     # the toolbar is only enabled in debug mode:
     app.debug = False
-    connect_to_db(app)
+    logging.basicConfig(level=logging.INFO)
+    connect_to_db(app, os.environ.get("DATABASE_URL", "postgresql:///food"))
+    if os.environ.get("RECIPE_STORE_PATH"):
+        open_recipe_store(os.environ["RECIPE_STORE_PATH"])
+    recover_jobs()
     DebugToolbarExtension(app)
     app.run(host="0.0.0.0")
\ No newline at end of file
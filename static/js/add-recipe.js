@@ -25,4 +25,51 @@ function addRecipe(evt) {
 
 }
 
-$('.green.button.add-recipe').on('click', addRecipe);
\ No newline at end of file
+function placeholderCard(recipeId) {
+    return $('<div class="card recipe-placeholder">')
+        .attr('data-card-recipe-id', recipeId)
+        .append('<div class="content"><div class="ui active centered inline loader"></div></div>');
+}
+
+function loadRecipeCards() {
+    var cards = $('#recipe-cards');
+    var source = new EventSource(cards.data('events-url'));
+
+    function finish() {
+        // without close() the browser would reconnect and search again
+        source.close();
+        $('#recipes-loading').remove();
+        cards.find('.recipe-placeholder').remove();
+        if (cards.children('.card').length === 0) {
+            $('#no-recipes').removeClass('hidden');
+        }
+    }
+
+    // recipe ids come first, so cards keep search order as they fill in
+    source.addEventListener('ids', function(evt) {
+        $('#recipes-loading').remove();
+        $.each(JSON.parse(evt.data), function(index, recipeId) {
+            cards.append(placeholderCard(recipeId));
+        });
+    });
+
+    source.addEventListener('recipe', function(evt) {
+        var recipe = JSON.parse(evt.data);
+        cards.find('.recipe-placeholder[data-card-recipe-id=' + recipe['id'] + ']').first().replaceWith(recipe['html']);
+    });
+
+    source.addEventListener('failed', function(evt) {
+        var recipe = JSON.parse(evt.data);
+        cards.find('.recipe-placeholder[data-card-recipe-id=' + recipe['id'] + ']').first().remove();
+    });
+
+    source.addEventListener('done', finish);
+    source.onerror = finish;
+}
+
+// cards arrive after page load, so listen on the page rather than each button
+$(document).on('click', '.green.button.add-recipe', addRecipe);
+
+if ($('#recipe-cards').length) {
+    loadRecipeCards();
+}
@@ -0,0 +1,21 @@
+"use strict";
+
+// Seconds between checks on a pending shopping list's job
+var JOB_POLL_INTERVAL = 2;
+
+// Checks a pending shopping list's job until it's finished, then reloads to show the list
+function waitForList(jobUrl) {
+    $.get(jobUrl, function(job) {
+        if (job['status'] === 'done' || job['status'] === 'failed') {
+            window.location.reload();
+        } else {
+            setTimeout(function() {
+                waitForList(jobUrl);
+            }, JOB_POLL_INTERVAL * 1000);
+        }
+    });
+}
+
+if ($('#list-pending').data('job-url')) {
+    waitForList($('#list-pending').data('job-url'));
+}
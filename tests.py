@@ -1,10 +1,54 @@
 from unittest import TestCase
 from server import app
-from model import connect_to_db, db, example_data, User, UserRecipe, Recipe, ShoppingList, convert_to_base_unit, aggregate_ingredients, search_recipes
+from model import connect_to_db, db, example_data, User, UserRecipe, Recipe, ShoppingList, ListIngredient, Ingredient, Inventory, convert_to_base_unit, aggregate_ingredients, search_recipes, build_shopping_list
+from datetime import datetime
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from aggregation import aggregate_ingredient_lists, aggregate_recipes
+from api_client import ApiClient, ApiError, ApiResponse
+from cache import SingleFlight
+from compact_recipe import CompactRecipe, pack, unpack
+from fanout import fan_out, fan_out_iter, fan_out_as_completed
+from feasibility import RequirementMatrix
+from instrumentation import RequestStats, use_stats
+from flask import Flask, Response, stream_with_context
+from jobs import JobRunner
+from recipe_index import RecipeIndex
+from recipe_store import RecipeStore
+from io import BytesIO
+import json
 import os
+import re
+import units
+import gzip
+import instrumentation
+import shutil
+import tempfile
+import threading
+import time
 import server
 import model
 
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+
+class QueryCounter(object):
+    """ Counts SQL statements run on the database while in use."""
+
+    def __enter__(self):
+        self.count = 0
+        event.listen(db.engine, 'before_cursor_execute', self._count)
+        return self
+
+    def __exit__(self, *args):
+        event.remove(db.engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self.count += 1
+
 
 class FlaskTestsBasic(TestCase):
     """ Flask Tests"""
@@ -48,6 +92,35 @@ class FlaskTestsBasic(TestCase):
         result = self.client.get("/main")
         self.assertIn("Sign Up", result.data)
 
+    def test_metrics_latency_histogram(self):
+        """ Test requests show up in the metrics latency histogram."""
+
+        self.client.get("/login")
+        result = self.client.get("/metrics")
+        self.assertIn('http_request_duration_seconds_bucket{route="/login",method="GET",le="+Inf"}', result.data)
+        self.assertIn('http_requests_total{route="/login",method="GET",status="200"}', result.data)
+
+    def test_metrics_cover_streamed_body(self):
+        """ Test a streamed response is recorded with the work done while streaming it."""
+
+        streaming_app = Flask(__name__)
+        instrumentation.init_app(streaming_app)
+
+        @streaming_app.route("/streamed")
+        def _streamed():
+            def _body():
+                yield 'first '
+                instrumentation.record_api_call(0.25)
+                yield 'last'
+            return Response(stream_with_context(_body()))
+
+        client = streaming_app.test_client()
+        self.assertEqual(client.get("/streamed").data, 'first last')
+
+        metrics = instrumentation.metrics.render()
+        self.assertIn('api_calls_total{route="/streamed",method="GET"} 1', metrics)
+        self.assertIn('http_request_duration_seconds_count{route="/streamed",method="GET"} 1', metrics)
+
 
 class FlaskTestsDatabase(TestCase):
     """Flask tests that use the database."""
@@ -65,6 +138,7 @@ class FlaskTestsDatabase(TestCase):
         # Create tables and add sample data
         db.create_all()
         example_data()
+        model.inventory_snapshots.clear()
 
     def tearDown(self):
         """ Things to do after every test."""
@@ -113,6 +187,7 @@ class FlaskTestsLoggedIn(TestCase):
         # Create tables and add sample data
         db.create_all()
         example_data()
+        model.inventory_snapshots.clear()
 
         # Create a session
         app.config['SECRET_KEY'] = os.environ["testing_secret_key"]
@@ -175,6 +250,74 @@ class FlaskTestsLoggedIn(TestCase):
         current_user = User.query.get(1)
         self.assertEqual(current_user.get_current_inventory(), [(5.0, 'ounces', 'apple')])
 
+    def test_get_current_inventory_one_query(self):
+        """ Test current inventory runs one query however many ingredients."""
+
+        db.session.add_all([Ingredient(ingredient_id=ingredient_id, ingredient_name='ingredient %s' % ingredient_id, base_unit='ounces')
+                            for ingredient_id in range(10, 60)])
+        db.session.add_all([Inventory(user_id=1, ingredient_id=ingredient_id, current_quantity=1)
+                            for ingredient_id in range(10, 60)])
+        db.session.commit()
+        current_user = User.query.get(1)
+
+        with QueryCounter() as counter:
+            current_inventory = current_user.get_current_inventory()
+
+        self.assertEqual(counter.count, 1)
+        self.assertEqual(len(current_inventory), 51)
+
+    def test_current_inventory_snapshot_warm_hit(self):
+        """ Test current inventory is read once until the inventory changes."""
+
+        # Kept in a local so the user row stays in the session between reads
+        user = User.query.get(1)
+        user.get_current_inventory()
+
+        with QueryCounter() as counter:
+            current_inventory = user.get_current_inventory()
+
+        self.assertEqual(counter.count, 0)
+        self.assertEqual(current_inventory, [(5.0, 'ounces', 'apple')])
+
+    def test_purchases_invalidate_inventory_snapshot(self):
+        """ Test confirming purchases shows up in the next inventory read."""
+
+        User.query.get(1).get_current_inventory()
+        self.client.post("/inventory.json",
+                         data={"data": json.dumps({"2": {"ingredientQty": "3"}}),
+                               "listId": "1"})
+
+        db.session.expire_all()
+        self.assertEqual(User.query.get(1).get_current_inventory(), [(5.0, 'ounces', 'apple'), (3.0, 'ounces', 'banana')])
+
+    def test_shopping_list_get_ingredients(self):
+        """ Test shopping list ingredients are grouped by aisle in one query."""
+
+        db.session.add(Ingredient(ingredient_id=4, ingredient_name='milk', base_unit='cups', ingredient_aisle='Dairy'))
+        db.session.query(Ingredient).filter(Ingredient.ingredient_id.in_([1, 2])).update({'ingredient_aisle': 'Produce'}, synchronize_session=False)
+        db.session.add_all([ListIngredient(shopping_list_id=1, ingredient_id=2, aggregate_quantity=3),
+                            ListIngredient(shopping_list_id=1, ingredient_id=4, aggregate_quantity=1),
+                            ListIngredient(shopping_list_id=1, ingredient_id=1, aggregate_quantity=2),
+                            ])
+        db.session.commit()
+        shopping_list = ShoppingList.query.get(1)
+
+        with QueryCounter() as counter:
+            ingredients = shopping_list.get_ingredients()
+
+        self.assertEqual(counter.count, 1)
+        self.assertEqual(list(ingredients.items()), [('Dairy', [(4, 1.0, 'cups', 'milk')]),
+                                                     ('Produce', [(1, 2.0, 'ounces', 'apple'), (2, 3.0, 'ounces', 'banana')]),
+                                                     ])
+
+    def test_request_stats_count_sql(self):
+        """ Test SQL statements are counted into the current request stats."""
+
+        with use_stats(RequestStats()) as stats:
+            User.query.get(1).get_current_inventory()
+
+        self.assertEqual(stats.sql_count, 2)
+
     def test_user_recipe_repr(self):
         """ Test representation of a user recipe."""
 
@@ -193,6 +336,25 @@ class FlaskTestsLoggedIn(TestCase):
         shopping_list = ShoppingList.query.filter(ShoppingList.user_id == 1).first()
         assert shopping_list.__repr__() == '<ShoppingList list_id=1 user_id=1 has_shopped=False>'
 
+    def test_add_inventory(self):
+        """ Test confirming purchases adds to existing and new inventory."""
+
+        self.client.post("/inventory.json",
+                         data={"data": json.dumps({"1": {"ingredientQty": "2.5"},
+                                                   "3": {"ingredientQty": "4"}}),
+                               "listId": "1"})
+
+        inventory = db.session.query(Inventory.ingredient_id, Inventory.current_quantity).filter(Inventory.user_id == 1).order_by(Inventory.ingredient_id).all()
+        self.assertEqual(inventory, [(1, 7.5), (2, 0.0), (3, 4.0)])
+        self.assertTrue(ShoppingList.query.get(1).has_shopped)
+
+    def test_inventory_unique_per_user_ingredient(self):
+        """ Test a user can't have two inventory rows for one ingredient."""
+
+        db.session.add(Inventory(user_id=1, ingredient_id=1, current_quantity=1))
+        self.assertRaises(IntegrityError, db.session.commit)
+        db.session.rollback()
+
     def test_log_out(self):
         """ Test user log out."""
 
@@ -237,6 +399,7 @@ class MockTests(TestCase):
         db.drop_all()
         db.create_all()
         example_data()
+        model.inventory_snapshots.clear()
 
         # Create a session
         app.config['SECRET_KEY'] = os.environ["testing_secret_key"]
@@ -281,6 +444,7 @@ class MockTests(TestCase):
     def tearDown(self):
         """ Things to do after every test."""
 
+        model.prefetch_runner.join(5)
         db.session.remove()
         db.session.close()
         db.drop_all()
@@ -343,6 +507,1018 @@ class MockTests(TestCase):
                                                                     })
                         )
 
+    def test_used_and_missing_ingredients(self):
+        """ Test recipe ingredients are split by what's in inventory."""
+
+        sally = User.query.get(1)
+        results = sally.get_used_and_missing_ingredients([1])
+        self.assertEqual(results[1]['inventory_ing'], [(1, 16.00, 'ounces', 'apple', 'Fruit')])
+        self.assertEqual(results[1]['missing_ing'], [(2, 3, 'ounces', 'banana', 'Fruit')])
+
+    def test_used_and_missing_ingredients_query_count(self):
+        """ Test inventory is checked in one query however many recipes and ingredients."""
+
+        def _mock_many_ingredients(recipe_id):
+            """ Mock recipe info with more ingredients for larger ids."""
+
+            ingredients = [{"id": ingredient_id,
+                            "aisle": "Produce",
+                            "name": "ingredient %s" % ingredient_id,
+                            "amount": 1,
+                            "unit": "ounces",
+                            "unitLong": "ounces"}
+                           for ingredient_id in range(1, int(recipe_id) * 5)]
+            return {"id": recipe_id, "title": "Test Recipe", "extendedIngredients": ingredients}
+
+        model.recipe_info_by_id = _mock_many_ingredients
+        sally = User.query.get(1)
+
+        with QueryCounter() as one_recipe:
+            sally.get_used_and_missing_ingredients([1])
+        with QueryCounter() as many_recipes:
+            sally.get_used_and_missing_ingredients([1, 2, 3, 4, 5])
+
+        # One inventory read, then served from the inventory snapshot
+        self.assertEqual(one_recipe.count, 1)
+        self.assertEqual(many_recipes.count, 0)
+
+    def test_verify_recipe_not_enough(self):
+        """ Test recipe can't be cooked when inventory is short."""
+
+        result = self.client.post("/verify_recipe.json", data={"data": "1"})
+        self.assertFalse(json.loads(result.data)['result'])
+        self.assertEqual(Inventory.query.filter(Inventory.user_id == 1, Inventory.ingredient_id == 1).one().current_quantity, 5)
+
+    def test_verify_recipe_cooks(self):
+        """ Test cooking a recipe subtracts its ingredients and marks it cooked."""
+
+        db.session.query(Inventory).filter(Inventory.user_id == 1, Inventory.ingredient_id == 1).update({'current_quantity': 20})
+        db.session.query(Inventory).filter(Inventory.user_id == 1, Inventory.ingredient_id == 2).update({'current_quantity': 3})
+        db.session.query(UserRecipe).filter(UserRecipe.user_id == 1).update({'status': 'in_progress'})
+        db.session.commit()
+
+        result = self.client.post("/verify_recipe.json", data={"data": "1"})
+        self.assertTrue(json.loads(result.data)['result'])
+
+        db.session.expire_all()
+        inventory = db.session.query(Inventory.ingredient_id, Inventory.current_quantity).filter(Inventory.user_id == 1).order_by(Inventory.ingredient_id).all()
+        self.assertEqual(inventory, [(1, 4.0), (2, 0.0)])
+        self.assertEqual(UserRecipe.query.filter(UserRecipe.user_id == 1).one().status, 'cooked')
+
+    def test_verify_recipe_not_in_progress(self):
+        """ Test a recipe that isn't in progress can't be cooked, even twice in a row."""
+
+        db.session.query(Inventory).filter(Inventory.user_id == 1, Inventory.ingredient_id == 1).update({'current_quantity': 40})
+        db.session.query(Inventory).filter(Inventory.user_id == 1, Inventory.ingredient_id == 2).update({'current_quantity': 6})
+        db.session.query(UserRecipe).filter(UserRecipe.user_id == 1).update({'status': 'in_progress'})
+        db.session.commit()
+
+        self.assertTrue(json.loads(self.client.post("/verify_recipe.json", data={"data": "1"}).data)['result'])
+        self.assertFalse(json.loads(self.client.post("/verify_recipe.json", data={"data": "1"}).data)['result'])
+        self.assertFalse(json.loads(self.client.post("/verify_recipe.json", data={"data": "2"}).data)['result'])
+
+        db.session.expire_all()
+        inventory = db.session.query(Inventory.ingredient_id, Inventory.current_quantity).filter(Inventory.user_id == 1).order_by(Inventory.ingredient_id).all()
+        self.assertEqual(inventory, [(1, 24.0), (2, 3.0)])
+
+    def test_main_page_ready_to_cook(self):
+        """ Test dashboard marks selected recipes the inventory covers."""
+
+        db.session.query(UserRecipe).filter(UserRecipe.user_id == 1).update({'status': 'in_progress'})
+        db.session.commit()
+
+        result = self.client.get("/main")
+        self.assertNotIn('Ready to cook', result.data)
+
+        db.session.query(Inventory).filter(Inventory.user_id == 1, Inventory.ingredient_id == 1).update({'current_quantity': 20})
+        db.session.query(Inventory).filter(Inventory.user_id == 1, Inventory.ingredient_id == 2).update({'current_quantity': 3})
+        model.bump_inventory_version(1)
+        db.session.commit()
+
+        result = self.client.get("/main")
+        self.assertIn('Ready to cook', result.data)
+
+    def test_shopping_list_page(self):
+        """ Test shopping list shows aggregated ingredients and moves recipes in progress."""
+
+        result = self.client.post("/shopping_list")
+        self.assertEqual(result.status_code, 303)
+        self.assertTrue(model.job_runner.join(5))
+
+        result = self.client.get(result.headers['Location'])
+        self.assertIn("16.00 ounces apple", result.data)
+        self.assertEqual(UserRecipe.query.filter(UserRecipe.user_id == 1).one().status, 'in_progress')
+
+    def test_shopping_list_pending(self):
+        """ Test a list is shown as pending until its job has run."""
+
+        real_run = model.job_runner.run
+        model.job_runner.run = lambda job_id: None
+
+        try:
+            result = self.client.post("/shopping_list", follow_redirects=True)
+            self.assertIn('id="list-pending"', result.data)
+            self.assertIn('being put together', self.client.get("/main").data)
+        finally:
+            model.job_runner.run = real_run
+
+    def test_shopping_list_idempotent(self):
+        """ Test submitting the same form twice queues one list."""
+
+        lists_before = ShoppingList.query.count()
+
+        first = self.client.post("/shopping_list", data={"idempotency_key": "page-1"})
+        second = self.client.post("/shopping_list", data={"idempotency_key": "page-1"})
+        self.assertTrue(model.job_runner.join(5))
+
+        self.assertEqual(first.headers['Location'], second.headers['Location'])
+        self.assertEqual(ShoppingList.query.count(), lists_before + 1)
+        self.assertEqual(model.Job.query.count(), 1)
+
+    def test_job_status(self):
+        """ Test job status reports the finished job and points to its list."""
+
+        self.client.post("/shopping_list", data={"idempotency_key": "page-1"})
+        self.assertTrue(model.job_runner.join(5))
+        job = model.Job.query.one()
+
+        status = json.loads(self.client.get("/jobs/%s.json" % job.job_id).data)
+        self.assertEqual(status['status'], 'done')
+        self.assertEqual(ShoppingList.query.get(status['shopping_list_id']).status, 'ready')
+
+    def test_failed_shopping_list_not_pending(self):
+        """ Test a list whose job failed isn't offered for confirmation."""
+
+        failed_list = ShoppingList(user_id=1, has_shopped=False, status='failed')
+        db.session.add(failed_list)
+        db.session.commit()
+
+        self.assertNotIn('/confirm_list/%s"' % failed_list.list_id, self.client.get("/main").data)
+
+        result = self.client.get("/shopping_list/%s" % failed_list.list_id)
+        self.assertIn("couldn't put this shopping list together", result.data)
+        self.assertNotIn('data-job-url', result.data)
+
+    def test_pending_list_without_job(self):
+        """ Test a pending list with no job found isn't polled for."""
+
+        pending_list = ShoppingList(user_id=1, has_shopped=False, status='pending')
+        db.session.add(pending_list)
+        db.session.commit()
+
+        result = self.client.get("/shopping_list/%s" % pending_list.list_id)
+        self.assertIn('id="list-pending"', result.data)
+        self.assertNotIn('data-job-url', result.data)
+
+    def test_recipes_page_events(self):
+        """ Test recipe search results are sent as events, ids first."""
+
+        real_cached_search = model.cached_search
+        model.cached_search = lambda key, url: {'results': [{'id': 1}, {'id': 2}]}
+
+        try:
+            result = self.client.get("/recipes?diet=&query=pasta")
+            self.assertIn('data-events-url="/recipes/events?', result.data)
+
+            result = self.client.get("/recipes/events?diet=&query=pasta")
+            self.assertTrue(result.is_streamed)
+            self.assertEqual(result.mimetype, 'text/event-stream')
+            self.assertTrue(result.data.startswith('event: ids\ndata: [1, 2]\n\n'))
+            self.assertEqual(result.data.count('event: recipe\n'), 2)
+            self.assertIn("Test Recipe", result.data)
+            self.assertTrue(result.data.endswith('event: done\ndata: {}\n\n'))
+        finally:
+            model.cached_search = real_cached_search
+
+    def test_partial_shopping_list_page(self):
+        """ Test partial shopping list is queued and shown once built."""
+
+        result = self.client.post("/partial_shopping_list")
+        self.assertTrue(model.job_runner.join(5))
+
+        result = self.client.get(result.headers['Location'])
+        self.assertIn("Shopping List", result.data)
+        self.assertNotIn('id="list-pending"', result.data)
+
+    def test_partial_shopping_list_missing_only(self):
+        """ Test partial shopping list only has ingredients missing from inventory."""
+
+        db.session.query(UserRecipe).filter(UserRecipe.user_id == 1).update({'status': 'needs_missing_ingredients'})
+        db.session.commit()
+
+        shopping_list = build_shopping_list(1, 'needs_missing_ingredients')
+        self.assertEqual(shopping_list.get_ingredients(), {None: [(2, 3.0, 'ounces', 'banana')]})
+
+    def test_build_shopping_list_skips_unloaded_recipe(self):
+        """ Test a recipe whose info can't be loaded stays off the list and keeps its status."""
+
+        mock_recipe_info_by_id = model.recipe_info_by_id
+
+        def _fail_recipe_2(recipe_id):
+            if int(recipe_id) == 2:
+                raise ApiError(ApiResponse(500, 'error'))
+            return mock_recipe_info_by_id(recipe_id)
+
+        model.recipe_info_by_id = _fail_recipe_2
+        db.session.add(UserRecipe(user_id=1, recipe_id=2, status='needs_ingredients'))
+        db.session.commit()
+
+        shopping_list = build_shopping_list(1, 'needs_ingredients')
+        self.assertEqual(shopping_list.get_ingredients(), {None: [(1, 16.0, 'ounces', 'apple'), (2, 3.0, 'ounces', 'banana')]})
+
+        statuses = dict(db.session.query(UserRecipe.recipe_id, UserRecipe.status).filter(UserRecipe.user_id == 1))
+        self.assertEqual(statuses, {1: 'in_progress', 2: 'needs_ingredients'})
+
+        # With nothing loadable the job fails instead of making an empty list
+        self.assertRaises(model.RecipesUnavailable, build_shopping_list, 1, 'needs_ingredients')
+
+    def test_build_shopping_list_query_count(self):
+        """ Test building a list runs the same statements for 1 or 30 recipes."""
+
+        def _build_for(recipe_ids):
+            db.session.add_all([Recipe(recipe_id=recipe_id) for recipe_id in recipe_ids])
+            db.session.add_all([UserRecipe(user_id=1, recipe_id=recipe_id, status='needs_ingredients') for recipe_id in recipe_ids])
+            db.session.commit()
+            with QueryCounter() as counter:
+                build_shopping_list(1, 'needs_ingredients')
+            return counter.count
+
+        self.assertEqual(_build_for(range(100, 101)), _build_for(range(200, 230)))
+
+    def test_add_recipe_stores_summary(self):
+        """ Test selecting a recipe stores its summary."""
+
+        self.client.post("/user-recipes", data={"recipe_id": "5"})
+        self.assertTrue(model.prefetch_runner.join(5))
+        recipe = Recipe.query.get(5)
+        self.assertEqual((recipe.title, recipe.servings), ('Test Recipe', 4))
+        self.assertEqual(recipe.ingredients[0]['name'], 'apple')
+
+    def test_add_recipe_prefetched_in_background(self):
+        """ Test selecting a recipe doesn't wait for its recipe info."""
+
+        release = threading.Event()
+        mock_recipe_info_by_id = model.recipe_info_by_id
+
+        def _slow_recipe_info_by_id(recipe_id):
+            release.wait(5)
+            return mock_recipe_info_by_id(recipe_id)
+
+        model.recipe_info_by_id = _slow_recipe_info_by_id
+
+        self.client.post("/add-recipe-id.json", data={"recipe_id": "5"})
+        self.assertIsNone(Recipe.query.get(5).title)
+
+        release.set()
+        self.assertTrue(model.prefetch_runner.join(5))
+        db.session.expire_all()
+        self.assertEqual(Recipe.query.get(5).title, 'Test Recipe')
+
+    def test_cook_after_base_unit_migration(self):
+        """ Test inventory stored in grams before the unit registry is cooked from in ounces once migrated."""
+
+        db.session.query(Ingredient).filter(Ingredient.ingredient_id == 1).update({'base_unit': 'grams'})
+        db.session.query(Inventory).filter(Inventory.user_id == 1, Inventory.ingredient_id == 1).update({'current_quantity': 907.18474})
+        db.session.query(Inventory).filter(Inventory.user_id == 1, Inventory.ingredient_id == 2).update({'current_quantity': 3})
+        db.session.query(UserRecipe).filter(UserRecipe.user_id == 1).update({'status': 'in_progress'})
+        db.session.commit()
+
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations', '008_ingredient_base_units.sql')) as migration_file:
+            with db.engine.begin() as connection:
+                connection.execute(migration_file.read())
+
+        self.assertTrue(model.cook_recipe(1, 1))
+
+        db.session.expire_all()
+        self.assertEqual(Ingredient.query.get(1).base_unit, 'ounces')
+        self.assertAlmostEqual(Inventory.query.filter(Inventory.user_id == 1, Inventory.ingredient_id == 1).one().current_quantity, 16.0)
+
+    def test_pending_recipes_from_summary(self):
+        """ Test dashboard recipes are read from stored summaries after the first load."""
+
+        tom = User.query.get(2)
+        self.assertEqual(tom.get_pending_recipes()[0]['title'], 'Test Recipe')
+
+        def _fail_recipe_info_by_id(recipe_id):
+            raise AssertionError('API should not be called')
+
+        model.recipe_info_by_id = _fail_recipe_info_by_id
+        self.assertEqual(tom.get_pending_recipes()[0]['title'], 'Test Recipe')
+
+    def test_find_cookable_recipes(self):
+        """ Test stored recipes are found from inventory without the API."""
+
+        Recipe.query.get(1).set_summary({'title': 'Apple Snack', 'extendedIngredients': [
+            {'id': 1, 'amount': 2, 'unitLong': 'ounces', 'name': 'apple'},
+            {'id': 3, 'amount': 1, 'unitLong': 'ounces', 'name': 'carrot'}]})
+        Recipe.query.get(2).set_summary({'title': 'Apple Pie', 'extendedIngredients': [
+            {'id': 1, 'amount': 1, 'unitLong': 'pound', 'name': 'apple'}]})
+        db.session.commit()
+        model.recipe_index.built_at = None
+
+        sally = User.query.get(1)
+        self.assertEqual(model.find_cookable_recipes(sally, ['apple']), [1])
+        self.assertEqual(model.find_cookable_recipes(sally, ['banana']), [])
+
+    def test_search_by_ingredient_page_streamed(self):
+        """ Test the streamed search page renders stored and API results and is counted once."""
+
+        def _requests_total():
+            match = re.search(r'^http_requests_total\{route="/search_by_ingredient",method="GET",status="200"\} (\d+)$',
+                              instrumentation.metrics.render(), re.M)
+            return int(match.group(1)) if match else 0
+
+        def _mock_search_api_by_ingredient(ingredients):
+            return {'results': [{'id': 2, 'usedIngredients': [
+                {'id': 1, 'amount': 1, 'unitLong': 'ounces', 'name': 'apple'}]}]}
+
+        Recipe.query.get(1).set_summary({'title': 'Apple Snack', 'extendedIngredients': [
+            {'id': 1, 'amount': 2, 'unitLong': 'ounces', 'name': 'apple'}]})
+        db.session.commit()
+        model.recipe_index.built_at = None
+        self.addCleanup(setattr, server, 'search_api_by_ingredient', server.search_api_by_ingredient)
+        server.search_api_by_ingredient = _mock_search_api_by_ingredient
+        requests_before = _requests_total()
+
+        # A stored recipe is found without asking the API
+        result = self.client.get("/search_by_ingredient?ingredient=apple")
+        self.assertTrue(result.is_streamed)
+        self.assertIn('data-card-recipe-id="1"', result.data)
+        self.assertIn("Test Recipe", result.data)
+        self.assertIn('/static/js/recipes-by-ingredient.js', result.data)
+
+        # No stored recipe uses banana, so the API results are shown instead
+        result = self.client.get("/search_by_ingredient?ingredient=banana")
+        self.assertTrue(result.is_streamed)
+        self.assertIn('data-card-recipe-id="2"', result.data)
+        self.assertNotIn('data-card-recipe-id="1"', result.data)
+        self.assertIn('/static/js/recipes-by-ingredient.js', result.data)
+
+        self.assertEqual(_requests_total(), requests_before + 2)
+
+
+class RecipeIndexTests(TestCase):
+    """Tests for the in-process ingredient index."""
+
+    def setUp(self):
+        """ Things to do before every test."""
+
+        self.index = RecipeIndex()
+        self.index.rebuild([(1, [{'id': 10, 'amount': 2, 'unitLong': 'cups'},
+                                 {'id': 11, 'amount': 1, 'unitLong': 'pound'}]),
+                            (2, [{'id': 10, 'amount': 1, 'unitLong': 'cup'}]),
+                            (3, [{'id': 12, 'amount': 1, 'unitLong': 'ounce'}]),
+                            ])
+
+    def test_rank_by_fraction_on_hand(self):
+        """ Test recipes are ranked by the share of ingredients with enough quantity."""
+
+        self.assertEqual(self.index.rank({10: 96.0}), [(2, 1.0, 1, 1), (1, 0.5, 1, 2)])
+        self.assertEqual(self.index.rank({10: 96.0, 11: 16.0}, limit=1), [(1, 1.0, 2, 2)])
+        self.assertEqual(self.index.rank({10: 60.0}), [(2, 1.0, 1, 1)])
+
+    def test_rank_selected_ingredients(self):
+        """ Test selected ingredients must all be sufficient in recipes that use them."""
+
+        self.assertEqual(self.index.rank({10: 60.0, 11: 16.0}, ingredient_ids=[10]), [(2, 1.0, 1, 1)])
+        self.assertEqual(self.index.rank({10: 96.0, 12: 5.0}, ingredient_ids=[12]), [(3, 1.0, 1, 1)])
+
+    def test_add_recipe_replaces(self):
+        """ Test adding a recipe again replaces its ingredients."""
+
+        self.index.add_recipe(2, [{'id': 12, 'amount': 1, 'unitLong': 'ounce'}])
+        self.assertEqual(self.index.rank({10: 96.0}), [(1, 0.5, 1, 2)])
+        self.assertEqual(len(self.index), 3)
+
+
+class FeasibilityTests(TestCase):
+    """Tests for the sparse requirement matrix."""
+
+    def setUp(self):
+        """ Things to do before every test."""
+
+        self.matrix = RequirementMatrix([(1, [{'id': 10, 'amount': 2, 'unitLong': 'cups'},
+                                              {'id': 11, 'amount': 1, 'unitLong': 'pound'}]),
+                                         (2, [{'id': 10, 'amount': 1, 'unitLong': 'cup'},
+                                              {'id': 10, 'amount': 1, 'unitLong': 'tablespoon'}]),
+                                         (3, [{'id': 12, 'amount': 0, 'unitLong': 'pinch'}]),
+                                         ])
+
+    def test_check_all_recipes(self):
+        """ Test every recipe's sufficiency comes from one check."""
+
+        feasibility = self.matrix.check({10: 60.0, 11: 16.0})
+        self.assertEqual(feasibility.feasible_ids(), [2])
+        self.assertEqual(feasibility.shortfalls(1), {10: 36.0})
+        self.assertEqual(feasibility.shortfalls(2), {})
+
+    def test_missing_ingredient_is_short(self):
+        """ Test an ingredient with no inventory row is short even if none is needed."""
+
+        feasibility = self.matrix.check({10: 96.0})
+        self.assertFalse(feasibility.is_feasible(3))
+        self.assertEqual(feasibility.shortfalls(1), {11: 16.0})
+        self.assertTrue(self.matrix.check({12: 0}).is_feasible(3))
+
+    def test_requirements_sum_duplicates(self):
+        """ Test an ingredient listed twice in a recipe is needed in total."""
+
+        self.assertEqual(self.matrix.requirements(2), {10: 51.0})
+
+
+class RecipeCacheTests(TestCase):
+    """Tests for the two-tier recipe info cache."""
+
+    def setUp(self):
+        """ Things to do before every test."""
+
+        connect_to_db(app, "postgresql:///testfood")
+        db.create_all()
+
+        self.fetched = []
+
+        def _mock_fetch_recipe_info(recipe_id):
+            """ Mock API call that records each request."""
+
+            self.fetched.append(recipe_id)
+            return {"id": recipe_id, "title": "Recipe %s" % recipe_id, "extendedIngredients": []}
+
+        self.real_fetch_recipe_info = model.fetch_recipe_info
+        model.fetch_recipe_info = _mock_fetch_recipe_info
+        self.cache = model.RecipeInfoCache(max_size=2, ttl=60, stale_ttl=60)
+
+    def tearDown(self):
+        """ Things to do after every test."""
+
+        model.fetch_recipe_info = self.real_fetch_recipe_info
+        db.session.remove()
+        db.drop_all()
+
+    def test_memory_hit(self):
+        """ Test second lookup is served without calling the API."""
+
+        self.cache.get(10)
+        self.assertEqual(self.cache.get('10')['title'], 'Recipe 10')
+        self.assertEqual(self.fetched, [10])
+        self.assertEqual(self.cache.get_stats()['memory_hits'], 1)
+
+    def test_error_response_not_cached(self):
+        """ Test an API error raises and leaves every tier empty."""
+
+        model.fetch_recipe_info = self.real_fetch_recipe_info
+        real_call_api = model.call_api
+        model.call_api = lambda url: ApiResponse(402, {'message': 'quota exceeded'})
+
+        try:
+            self.assertRaises(ApiError, self.cache.get, 10)
+        finally:
+            model.call_api = real_call_api
+
+        self.assertEqual(len(self.cache.memory), 0)
+        self.assertEqual(model.RecipeCache.query.count(), 0)
+
+    def test_failed_revalidation_keeps_copy(self):
+        """ Test an API error while revalidating keeps the cached copy."""
+
+        self.cache.get(10)
+        model.fetch_recipe_info = self.real_fetch_recipe_info
+        real_call_api = model.call_api
+        model.call_api = lambda url: ApiResponse(500, 'Internal Server Error')
+
+        try:
+            self.cache.revalidate(10)
+        finally:
+            model.call_api = real_call_api
+
+        self.assertEqual(self.cache.get(10)['title'], 'Recipe 10')
+        self.assertEqual(self.cache.get_stats()['revalidation_errors'], 1)
+
+    def test_database_hit(self):
+        """ Test lookup falls back to the recipe_cache table."""
+
+        self.cache.get(10)
+        self.cache.memory.clear()
+        self.assertEqual(self.cache.get(10)['title'], 'Recipe 10')
+        self.assertEqual(self.fetched, [10])
+        self.assertEqual(self.cache.get_stats()['db_hits'], 1)
+
+    def test_lru_eviction(self):
+        """ Test least recently used recipe is evicted from memory."""
+
+        self.cache.get(1)
+        self.cache.get(2)
+        self.cache.get(1)
+        self.cache.get(3)
+        self.assertIsNone(self.cache.memory.get(2))
+        self.assertIsNotNone(self.cache.memory.get(1))
+
+    def test_stale_while_revalidate(self):
+        """ Test stale entry is served while a refresh is scheduled."""
+
+        revalidated = []
+        self.cache.revalidate_async = revalidated.append
+
+        self.cache.get(10)
+        self.cache.memory.set(10, {"id": 10, "title": "Old"}, stored_at=time.time() - 90)
+
+        self.assertEqual(self.cache.get(10)['title'], 'Old')
+        self.assertEqual(revalidated, [10])
+        self.assertEqual(self.cache.get_stats()['stale_hits'], 1)
+
+    def test_expired_entry_refetched(self):
+        """ Test entry past the stale window is fetched again."""
+
+        self.cache.get(10)
+        self.cache.memory.set(10, {"id": 10, "title": "Old"}, stored_at=time.time() - 150)
+        db.engine.execute(model.RecipeCache.__table__.update().values(fetched_at=datetime(2000, 1, 1)))
+
+        self.assertEqual(self.cache.get(10)['title'], 'Recipe 10')
+        self.assertEqual(self.fetched, [10, 10])
+
+    def test_shared_store_hit(self):
+        """ Test a recipe fetched by one worker is read from the shared store by another."""
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        self.cache.shared = RecipeStore(os.path.join(directory, 'recipes'))
+        self.cache.get(10)
+        self.assertTrue(self.cache.shared.flush(5))
+
+        other_worker = model.RecipeInfoCache(max_size=2, ttl=60, stale_ttl=60)
+        other_worker.shared = RecipeStore(os.path.join(directory, 'recipes'))
+
+        self.assertEqual(other_worker.get(10)['title'], 'Recipe 10')
+        self.assertEqual(self.fetched, [10])
+        self.assertEqual(other_worker.get_stats()['shared_hits'], 1)
+
+
+class RecipeStoreTests(TestCase):
+    """Tests for the memory-mapped recipe store."""
+
+    def setUp(self):
+        """ Things to do before every test."""
+
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'recipes')
+        self.store = RecipeStore(self.path, refresh_interval=0, write_delay=0)
+
+    def tearDown(self):
+        """ Things to do after every test."""
+
+        shutil.rmtree(self.directory)
+
+    def packed(self, recipe_id, title):
+        return pack(CompactRecipe.from_info({'id': recipe_id, 'title': title, 'extendedIngredients': []}))
+
+    def test_put_and_get(self):
+        """ Test stored recipes are found by id and missing ones are not."""
+
+        self.store.put_many([(recipe_id, self.packed(recipe_id, 'Recipe %s' % recipe_id), 100.0) for recipe_id in (30, 10, 20)])
+
+        (recipe, stored_at) = self.store.get(20)
+        self.assertEqual(recipe['title'], 'Recipe 20')
+        self.assertEqual(stored_at, 100.0)
+        self.assertIsNone(self.store.get(15))
+        self.assertEqual(len(self.store), 3)
+
+    def test_replace(self):
+        """ Test storing a recipe again replaces the earlier copy."""
+
+        self.store.put(10, self.packed(10, 'Old'))
+        self.assertTrue(self.store.flush(5))
+        self.store.put(10, self.packed(10, 'New'))
+        self.assertTrue(self.store.flush(5))
+
+        self.assertEqual(self.store.get(10)[0]['title'], 'New')
+        self.assertEqual(len(self.store), 1)
+
+    def test_published_to_other_readers(self):
+        """ Test a reader opened earlier sees recipes published after it."""
+
+        reader = RecipeStore(self.path, refresh_interval=0)
+        self.store.put(10, self.packed(10, 'Recipe 10'))
+        self.assertTrue(self.store.flush(5))
+
+        self.assertEqual(reader.get(10)[0]['title'], 'Recipe 10')
+
+    def test_queued_puts_published_together(self):
+        """ Test recipes put close together are published in one batch, off the caller's thread."""
+
+        self.store.write_delay = 0.2
+        published = []
+        put_many = self.store.put_many
+        self.store.put_many = lambda records, **kwargs: published.append(len(records)) or put_many(records, **kwargs)
+
+        for recipe_id in range(1, 6):
+            self.store.put(recipe_id, self.packed(recipe_id, 'Recipe %s' % recipe_id))
+        self.assertIsNone(self.store.get(1))
+
+        self.assertTrue(self.store.flush(5))
+        self.assertEqual(published, [5])
+        self.assertEqual(self.store.get(5)[0]['title'], 'Recipe 5')
+
+    def test_fill_if_empty(self):
+        """ Test filling only happens while the store is empty."""
+
+        self.assertEqual(self.store.put_many([(10, self.packed(10, 'First'), 100.0)], if_empty=True), 1)
+        self.assertEqual(self.store.put_many([(10, self.packed(10, 'Second'), 100.0)], if_empty=True), 0)
+        self.assertEqual(RecipeStore(self.path).get(10)[0]['title'], 'First')
+
+
+class StandInApiHandler(BaseHTTPRequestHandler):
+    """ Local stand-in for the API that gzips JSON responses."""
+
+    protocol_version = 'HTTP/1.1'
+    # Buffer each response into one write so keep-alive isn't held up by Nagle
+    wbufsize = -1
+
+    def do_GET(self):
+        self.server.clients.append(self.client_address)
+        self.server.headers.append(dict(self.headers.items()))
+
+        buffer = BytesIO()
+        with gzip.GzipFile(fileobj=buffer, mode='wb') as compressed:
+            compressed.write(json.dumps({'path': self.path}).encode('utf-8'))
+        body = buffer.getvalue()
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ApiClientTests(TestCase):
+    """Tests for the pooled API client against a local server."""
+
+    def setUp(self):
+        """ Things to do before every test."""
+
+        self.server = HTTPServer(('127.0.0.1', 0), StandInApiHandler)
+        self.server.clients = []
+        self.server.headers = []
+        self.url = 'http://127.0.0.1:%s' % self.server.server_port
+
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        self.client = ApiClient(headers={'X-Test': 'yes'}, pool_size=2, connect_timeout=1, read_timeout=1)
+
+    def tearDown(self):
+        """ Things to do after every test."""
+
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_get_parses_gzipped_json(self):
+        """ Test responses are decompressed and parsed, with default headers sent."""
+
+        response = self.client.get(self.url + '/recipes/1/information', headers={'X-Mashape-Key': 'key'})
+
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.body, {'path': '/recipes/1/information'})
+        headers = dict((name.lower(), value) for name, value in self.server.headers[0].items())
+        self.assertIn('gzip', headers['accept-encoding'])
+        self.assertEqual(headers['x-test'], 'yes')
+        self.assertEqual(headers['x-mashape-key'], 'key')
+
+    def test_connection_reused(self):
+        """ Test consecutive calls share one kept-alive connection."""
+
+        self.client.get(self.url + '/one')
+        self.client.get(self.url + '/two')
+
+        self.assertEqual(len(self.server.clients), 2)
+        self.assertEqual(self.server.clients[0], self.server.clients[1])
+
+
+class SearchCacheTests(TestCase):
+    """Tests for the search result cache and single-flight calls."""
+
+    def setUp(self):
+        """ Things to do before every test."""
+
+        self.urls = []
+        self.release = threading.Event()
+        self.release.set()
+
+        def _mock_call_api(url):
+            """ Mock API call that records each request."""
+
+            self.urls.append(url)
+            self.release.wait()
+            return ApiResponse(200, {'results': []})
+
+        self.real_call_api = model.call_api
+        model.call_api = _mock_call_api
+        model.search_cache.clear()
+
+    def tearDown(self):
+        """ Things to do after every test."""
+
+        model.call_api = self.real_call_api
+        model.search_cache.clear()
+
+    def test_normalized_searches_share_entry(self):
+        """ Test searches differing in case, spacing and order call the API once."""
+
+        search_recipes('Vegetarian', 'dairy%2C+gluten', 'Pasta  Salad')
+        search_recipes('vegetarian', 'Gluten%2C+dairy', ' pasta salad')
+        model.search_api_by_ingredient('tomato%2C+Basil')
+        model.search_api_by_ingredient('basil%2C+tomato')
+
+        self.assertEqual(len(self.urls), 2)
+        self.assertIn('intolerances=dairy%2C+gluten&', self.urls[0])
+
+    def test_failed_search_not_cached(self):
+        """ Test an error response is returned but not cached."""
+
+        model.call_api = lambda url: ApiResponse(500, {'message': 'error'})
+        self.assertEqual(model.search_api_by_ingredient('tomato'), {'message': 'error'})
+        self.assertEqual(len(model.search_cache), 0)
+
+    def test_concurrent_searches_coalesce(self):
+        """ Test identical searches in flight together share one API call."""
+
+        # Hold the first call until the others are waiting on it
+        self.release.clear()
+        threading.Timer(0.2, self.release.set).start()
+        results = fan_out(model.search_api_by_ingredient, ['tomato'] * 4, max_workers=4, timeout=5)
+        self.assertEqual(results, [{'results': []}] * 4)
+        self.assertEqual(len(self.urls), 1)
+
+    def test_single_flight_shares_errors(self):
+        """ Test callers waiting on a failed call get its exception."""
+
+        flights = SingleFlight()
+
+        def _fail():
+            raise ValueError('upstream down')
+
+        self.assertRaises(ValueError, flights.do, 'key', _fail)
+        self.assertEqual(flights.do('key', lambda: 1), 1)
+
+
+class UnitConversionTests(TestCase):
+    """Tests for the unit conversion registry."""
+
+    def test_convert_aliases_and_case(self):
+        """ Test abbreviations and capitalized units convert like full names."""
+
+        self.assertEqual(units.convert(2, 'Tbsp'), (6, 'teaspoons'))
+        self.assertEqual(units.convert(2, 'oz.'), (2, 'ounces'))
+        self.assertEqual(units.convert(1, ' Cups '), (48, 'teaspoons'))
+
+    def test_convert_metric(self):
+        """ Test metric units convert to customary base units."""
+
+        (amount, unit) = units.convert(28.349523125, 'grams')
+        self.assertEqual(unit, 'ounces')
+        self.assertAlmostEqual(amount, 1.0)
+        self.assertAlmostEqual(units.convert(1, 'kg')[0], 35.27396195)
+        self.assertAlmostEqual(units.convert(4.92892159375, 'ml')[0], 1.0)
+
+    def test_convert_count_and_unknown(self):
+        """ Test count units merge singular and plural and unknown units pass through."""
+
+        self.assertEqual(units.convert(1, 'serving'), (1, 'servings'))
+        self.assertEqual(units.convert(3, 'handful'), (3, 'handful'))
+        self.assertEqual(units.unit_dimension('pints'), units.VOLUME)
+
+    def test_convert_ingredients(self):
+        """ Test a recipe's ingredients convert in one call, in order."""
+
+        ingredients = [{'amount': 1, 'unitLong': 'pound'},
+                       {'amount': 2, 'unitLong': 'tablespoons'},
+                       {'amount': 3, 'unitLong': ''},
+                       ]
+        self.assertEqual(units.convert_ingredients(ingredients), [(16, 'ounces'), (6, 'teaspoons'), (3, '')])
+
+    def test_base_unit_migration_matches_registry(self):
+        """ Test the base unit data migration converts every unit as the registry does."""
+
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations', '008_ingredient_base_units.sql')) as migration_file:
+            rows = re.findall(r"\('([^']+)', '([^']+)', ([^)]+)\)", migration_file.read())
+
+        conversions = dict((unit, (base_unit, float(factor))) for unit, base_unit, factor in rows)
+        self.assertEqual(conversions, dict((unit, (entry[1], entry[2])) for unit, entry in units.REGISTRY.items()))
+
+
+class AggregationTests(TestCase):
+    """Tests for vectorized ingredient aggregation."""
+
+    def test_aggregate_converts_before_summing(self):
+        """ Test the same ingredient in different units of one dimension is merged."""
+
+        recipes = [[{'id': 5, 'amount': 8, 'unitLong': 'ounces', 'name': 'flour', 'aisle': 'Baking'}],
+                   [{'id': 5, 'amount': 1, 'unitLong': 'pound', 'name': 'flour', 'aisle': 'Baking'},
+                    {'id': 6, 'amount': 1, 'unitLong': 'cup', 'name': 'milk', 'aisle': 'Dairy'}],
+                   [{'id': 6, 'amount': 2, 'unitLong': 'tablespoons', 'name': 'milk', 'aisle': 'Dairy'}],
+                   ]
+        self.assertEqual(aggregate_ingredient_lists(recipes), {5: {'quantity': 24.0, 'unit': 'ounces', 'name': 'flour', 'aisle': 'Baking'},
+                                                               6: {'quantity': 54.0, 'unit': 'teaspoons', 'name': 'milk', 'aisle': 'Dairy'},
+                                                               })
+
+    def test_aggregate_keeps_units_apart(self):
+        """ Test an ingredient in units of different dimensions isn't summed across them."""
+
+        recipes = [[{'id': 5, 'amount': 2, 'unitLong': 'cups', 'name': 'flour', 'aisle': 'Baking'}],
+                   [{'id': 5, 'amount': 1, 'unitLong': 'pound', 'name': 'flour', 'aisle': 'Baking'}],
+                   [{'id': 5, 'amount': 1, 'unitLong': 'cup', 'name': 'flour', 'aisle': 'Baking'}],
+                   ]
+        self.assertEqual(aggregate_ingredient_lists(recipes), {5: {'quantity': 144.0, 'unit': 'teaspoons', 'name': 'flour', 'aisle': 'Baking',
+                                                                   'other_units': [(16.0, 'ounces')]},
+                                                               })
+
+    def test_aggregate_no_recipes(self):
+        """ Test aggregating nothing returns no ingredients."""
+
+        self.assertEqual(aggregate_ingredient_lists([]), {})
+        self.assertEqual(aggregate_ingredient_lists([[], []]), {})
+
+    def test_aggregate_compact_recipes(self):
+        """ Test compact recipes aggregate the same as ingredient dictionaries."""
+
+        recipes = [[{'id': 5, 'amount': 8, 'unitLong': 'ounces', 'name': 'flour', 'aisle': 'Baking'}],
+                   [],
+                   [{'id': 5, 'amount': 1, 'unitLong': 'pound', 'name': 'flour', 'aisle': 'Baking'},
+                    {'id': 6, 'amount': 1, 'unitLong': 'cup', 'name': 'milk', 'aisle': 'Dairy'}],
+                   ]
+        compact_recipes = [CompactRecipe.from_info({'id': recipe_id, 'extendedIngredients': ingredients})
+                           for recipe_id, ingredients in enumerate(recipes)]
+
+        self.assertEqual(aggregate_recipes(compact_recipes), aggregate_ingredient_lists(recipes))
+
+
+class CompactRecipeTests(TestCase):
+    """Tests for the compact recipe info format."""
+
+    recipe_info = {'id': 7,
+                   'title': u'Cr\xe8me Br\xfbl\xe9e',
+                   'image': None,
+                   'servings': 4,
+                   'readyInMinutes': 45,
+                   'nutrition': {'calories': 300},
+                   'extendedIngredients': [{'id': 1123, 'amount': 4, 'unit': '', 'unitLong': 'servings',
+                                            'name': 'egg yolks', 'aisle': 'Milk, Eggs, Other Dairy',
+                                            'originalString': '4 egg yolks'},
+                                           {'id': 1053, 'amount': 2.5, 'unit': 'c', 'unitLong': 'cups',
+                                            'name': 'cream', 'aisle': 'Milk, Eggs, Other Dairy', 'image': 'cream.jpg'},
+                                           ],
+                   }
+
+    def test_reads_like_recipe_info(self):
+        """ Test only used fields are kept and are read like the dictionary."""
+
+        recipe = CompactRecipe.from_info(self.recipe_info)
+
+        self.assertEqual(recipe['title'], u'Cr\xe8me Br\xfbl\xe9e')
+        self.assertIn('image', recipe)
+        self.assertNotIn('sourceName', recipe)
+        self.assertNotIn('nutrition', recipe)
+        self.assertIsNone(recipe.get('sourceName'))
+        self.assertEqual([ingredient['name'] for ingredient in recipe['extendedIngredients']], ['egg yolks', 'cream'])
+        self.assertIsNone(recipe['extendedIngredients'][0].get('originalString'))
+
+    def test_pack_round_trip(self):
+        """ Test packed recipes unpack to the same fields, compressed or not."""
+
+        recipe = CompactRecipe.from_info(self.recipe_info)
+
+        for compress in (True, False):
+            unpacked = unpack(pack(recipe, compress=compress))
+            self.assertEqual(unpacked.to_info(), recipe.to_info())
+            self.assertEqual(unpacked.to_info()['servings'], 4)
+
+    def test_ingredient_strings_shared(self):
+        """ Test ingredient strings repeated across recipes are stored once."""
+
+        first = unpack(pack(CompactRecipe.from_info(self.recipe_info)))
+        second = CompactRecipe.from_info(json.loads(json.dumps(self.recipe_info)))
+
+        self.assertIs(first.aisles[0], second.aisles[1])
+
+
+class JobRunnerTests(TestCase):
+    """Tests for the background job runner."""
+
+    def test_join_waits_for_jobs(self):
+        """ Test joining returns once every submitted job has run."""
+
+        finished = []
+        runner = JobRunner(lambda job_id: time.sleep(0.1) or finished.append(job_id))
+
+        runner.submit(1)
+        runner.submit(2)
+        self.assertFalse(runner.join(timeout=0.01))
+        self.assertTrue(runner.join(timeout=5))
+        self.assertEqual(sorted(finished), [1, 2])
+
+    def test_failed_job_finishes(self):
+        """ Test a job that raises still counts as finished."""
+
+        def _fail(job_id):
+            raise ValueError('upstream error')
+
+        runner = JobRunner(_fail)
+        runner.submit(1)
+        self.assertTrue(runner.join(timeout=5))
+
+    def test_duplicate_job_queued_once(self):
+        """ Test a job id already queued or running isn't queued again."""
+
+        started = threading.Event()
+        release = threading.Event()
+        runs = []
+
+        def _run(job_id):
+            runs.append(job_id)
+            started.set()
+            release.wait(5)
+
+        runner = JobRunner(_run)
+        self.assertTrue(runner.submit(1))
+        started.wait(5)
+        self.assertFalse(runner.submit(1))
+
+        release.set()
+        self.assertTrue(runner.join(timeout=5))
+        self.assertEqual(runs, [1])
+
+
+class FanOutTests(TestCase):
+    """Tests for concurrent fan-out of slow calls."""
+
+    def test_fan_out_iter_yields_early(self):
+        """ Test the first result is yielded before slower later calls finish."""
+
+        def _sleep(seconds):
+            time.sleep(seconds)
+            return seconds
+
+        start = time.time()
+        results = fan_out_iter(_sleep, [0, 0.3], max_workers=2)
+
+        self.assertEqual(next(results), 0)
+        self.assertLess(time.time() - start, 0.2)
+        self.assertEqual(list(results), [0.3])
+
+    def test_fan_out_iter_deadline(self):
+        """ Test calls past the deadline come back as None without holding up the rest."""
+
+        results = list(fan_out_iter(lambda seconds: time.sleep(seconds) or seconds, [0, 1, 0], max_workers=3, timeout=0.1))
+        self.assertEqual(results, [0, None, 0])
+
+    def test_fan_out_as_completed(self):
+        """ Test results are yielded as calls finish, and unfinished calls are left out."""
+
+        results = list(fan_out_as_completed(lambda seconds: time.sleep(seconds) or seconds, [0.2, 0, 1], max_workers=3, timeout=0.5))
+        self.assertEqual(results, [(1, 0), (0, 0.2)])
+
+    def test_fan_out_keeps_order(self):
+        """ Test results come back in input order regardless of finish order."""
+
+        def _slow_double(number):
+            time.sleep(0.01 * (5 - number))
+            return number * 2
+
+        self.assertEqual(fan_out(_slow_double, [1, 2, 3, 4], max_workers=4), [2, 4, 6, 8])
+
+    def test_fan_out_partial_failure(self):
+        """ Test a failing call comes back as None without losing the others."""
+
+        def _fail_on_two(number):
+            if number == 2:
+                raise ValueError('upstream error')
+            return number
+
+        self.assertEqual(fan_out(_fail_on_two, [1, 2, 3], max_workers=2), [1, None, 3])
+
+    def test_fan_out_deadline(self):
+        """ Test calls still running at the deadline come back as None."""
+
+        def _sleep(seconds):
+            time.sleep(seconds)
+            return seconds
+
+        start = time.time()
+        self.assertEqual(fan_out(_sleep, [0, 1], max_workers=2, timeout=0.2), [0, None])
+        self.assertLess(time.time() - start, 0.5)
+
+    def test_fan_out_runs_concurrently(self):
+        """ Test total time follows the slowest call, not the sum."""
+
+        start = time.time()
+        fan_out(time.sleep, [0.1] * 4, max_workers=4)
+        self.assertLess(time.time() - start, 0.3)
+
 
 if __name__ == "__main__":
     import unittest
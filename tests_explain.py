@@ -0,0 +1,129 @@
+""" EXPLAIN-based regression tests for the user-scoped hot queries.
+
+Seeds the test database with a large dataset, runs each hot path while
+recording the SQL it issues, and fails if the plan for any of those
+statements uses a sequential scan on a user-scoped table.
+"""
+
+from unittest import TestCase
+from server import app
+from model import connect_to_db, db, User, ShoppingList
+from sqlalchemy import event
+import model
+import re
+
+USERS = 2000
+
+# Seeded with generate_series so the tables are big enough for the planner to
+# prefer indexes: 200k inventory rows, 40k user recipes and shopping lists,
+# and 200k shopping list ingredients.
+SEED_STATEMENTS = [
+    """INSERT INTO users (username, password)
+       SELECT 'user' || n, '' FROM generate_series(1, %(users)s) n""",
+    """INSERT INTO ingredients (ingredient_id, ingredient_name, base_unit, ingredient_aisle)
+       SELECT n, 'ingredient ' || n, 'ounces', 'Aisle ' || (n %% 20) FROM generate_series(1, 100) n""",
+    """INSERT INTO recipes (recipe_id, title, servings, ingredients, summary_updated_at)
+       SELECT n, 'Recipe ' || n, 2, '[]', now() FROM generate_series(1, 20) n""",
+    """INSERT INTO inventory (user_id, ingredient_id, current_quantity)
+       SELECT u, i, CASE WHEN i %% 2 = 0 THEN 0 ELSE i END
+       FROM generate_series(1, %(users)s) u, generate_series(1, 100) i""",
+    """INSERT INTO user_recipes (user_id, recipe_id, status)
+       SELECT u, r, CASE r %% 3 WHEN 0 THEN 'in_progress' WHEN 1 THEN 'cooked' ELSE 'needs_ingredients' END
+       FROM generate_series(1, %(users)s) u, generate_series(1, 20) r""",
+    """INSERT INTO shopping_lists (user_id, has_shopped)
+       SELECT u, l %% 4 <> 0 FROM generate_series(1, %(users)s) u, generate_series(1, 20) l""",
+    """INSERT INTO shopping_list_ingredients (shopping_list_id, ingredient_id, aggregate_quantity)
+       SELECT l, i, 1 FROM generate_series(1, %(users)s * 20) l, generate_series(1, 5) i""",
+]
+
+SEQ_SCAN = re.compile(r'Seq Scan on (inventory|user_recipes|shopping_lists|shopping_list_ingredients)\b')
+
+
+class ExplainTests(TestCase):
+    """Checks hot queries use indexes on a large dataset."""
+
+    @classmethod
+    def setUpClass(cls):
+        """ Things to do once before all tests."""
+
+        app.config['TESTING'] = True
+
+        connect_to_db(app, "postgresql:///testfood")
+
+        db.drop_all()
+        db.create_all()
+
+        for statement in SEED_STATEMENTS:
+            db.engine.execute(statement, {'users': USERS})
+        db.engine.execute("ANALYZE")
+
+    @classmethod
+    def tearDownClass(cls):
+        """ Things to do once after all tests."""
+
+        db.session.remove()
+        db.drop_all()
+
+    def tearDown(self):
+        """ Things to do after every test."""
+
+        db.session.rollback()
+
+    def assertNoSeqScan(self, hot_path):
+        """ Runs hot_path and checks the plan of every statement it issues."""
+
+        statements = []
+
+        # Inventory reads are cached per user, so start cold
+        model.inventory_snapshots.clear()
+
+        def _record(conn, cursor, statement, parameters, context, executemany):
+            statements.append((statement, parameters))
+
+        event.listen(db.engine, 'before_cursor_execute', _record)
+        try:
+            hot_path()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', _record)
+
+        self.assertTrue(statements)
+
+        for statement, parameters in statements:
+            plan = "\n".join(row[0] for row in db.engine.execute("EXPLAIN " + statement, parameters))
+            self.assertIsNone(SEQ_SCAN.search(plan), "Sequential scan for:\n%s\n%s" % (statement, plan))
+
+    def test_current_inventory(self):
+        """ Test the inventory snapshot read uses the user and ingredient index."""
+
+        user = User.query.get(USERS // 2)
+        self.assertNoSeqScan(user.get_current_inventory)
+
+    def test_inventory_quantities(self):
+        """ Test inventory lookup by ingredient uses the user and ingredient index."""
+
+        user = User.query.get(USERS // 2)
+        self.assertNoSeqScan(lambda: user.get_inventory_quantities([1, 2, 3, 4, 5]))
+
+    def test_pending_recipes(self):
+        """ Test pending recipes use the user and status index."""
+
+        user = User.query.get(USERS // 2)
+        self.assertNoSeqScan(user.get_pending_recipes)
+
+    def test_pending_shopping_lists(self):
+        """ Test pending shopping lists use the user and has_shopped index."""
+
+        user = User.query.get(USERS // 2)
+        self.assertNoSeqScan(user.get_pending_shopping_lists)
+
+    def test_shopping_list_ingredients(self):
+        """ Test shopping list ingredients use the shopping list index."""
+
+        shopping_list = ShoppingList.query.get(USERS * 10)
+        self.assertNoSeqScan(shopping_list.get_ingredients)
+
+
+if __name__ == "__main__":
+    import unittest
+
+    unittest.main()
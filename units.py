@@ -0,0 +1,130 @@
+""" Unit conversion to the base units used for inventory and shopping lists.
+
+Every known unit belongs to a dimension (mass, volume or count) and converts
+to that dimension's base unit by an exact factor. Unit names from the API are
+normalized (case, surrounding spaces, trailing periods) and looked up once in
+a precompiled alias table; unknown units pass through unchanged.
+"""
+
+MASS = 'mass'
+VOLUME = 'volume'
+COUNT = 'count'
+
+# US customary definitions, exact
+GRAMS_PER_OUNCE = 28.349523125
+MILLILITERS_PER_TEASPOON = 4.92892159375
+
+# unit: (dimension, base unit, base units per unit, aliases)
+UNIT_DEFINITIONS = {
+    'ounces': (MASS, 'ounces', 1.0, ['oz', 'ozs', 'ounce']),
+    'pounds': (MASS, 'ounces', 16.0, ['lb', 'lbs', 'pound']),
+    'grams': (MASS, 'ounces', 1 / GRAMS_PER_OUNCE, ['g', 'gs', 'gr', 'gram']),
+    'kilograms': (MASS, 'ounces', 1000 / GRAMS_PER_OUNCE, ['kg', 'kgs', 'kilogram']),
+    'milligrams': (MASS, 'ounces', 0.001 / GRAMS_PER_OUNCE, ['mg', 'milligram']),
+    'teaspoons': (VOLUME, 'teaspoons', 1.0, ['tsp', 'tsps', 'teaspoon']),
+    'tablespoons': (VOLUME, 'teaspoons', 3.0, ['tbsp', 'tbs', 'tbsps', 'tablespoon']),
+    'cups': (VOLUME, 'teaspoons', 48.0, ['c', 'cup']),
+    'fluid ounces': (VOLUME, 'teaspoons', 6.0, ['fl oz', 'fl. oz', 'fluid ounce']),
+    'pints': (VOLUME, 'teaspoons', 96.0, ['pt', 'pint']),
+    'quarts': (VOLUME, 'teaspoons', 192.0, ['qt', 'quart']),
+    'gallons': (VOLUME, 'teaspoons', 768.0, ['gal', 'gallon']),
+    'milliliters': (VOLUME, 'teaspoons', 1 / MILLILITERS_PER_TEASPOON, ['ml', 'milliliter', 'millilitre', 'millilitres']),
+    'liters': (VOLUME, 'teaspoons', 1000 / MILLILITERS_PER_TEASPOON, ['l', 'liter', 'litre', 'litres']),
+    'servings': (COUNT, 'servings', 1.0, ['serving']),
+    'pieces': (COUNT, 'pieces', 1.0, ['piece']),
+    'cloves': (COUNT, 'cloves', 1.0, ['clove']),
+    'slices': (COUNT, 'slices', 1.0, ['slice']),
+}
+
+
+def normalize_unit(unit):
+    """ Returns unit in the form used for alias lookup."""
+
+    return ' '.join(unit.lower().replace('.', ' ').split())
+
+
+def _build_registry():
+    registry = {}
+
+    for unit, (dimension, base_unit, factor, aliases) in UNIT_DEFINITIONS.items():
+        for name in [unit] + aliases:
+            registry[normalize_unit(name)] = (dimension, base_unit, factor)
+
+    return registry
+
+
+# normalized unit or alias: (dimension, base unit, factor)
+REGISTRY = _build_registry()
+
+# Raw unit strings seen so far, so each distinct string is only normalized once
+_resolved = {}
+_RESOLVED_MAX_SIZE = 10000
+
+
+def resolve_unit(unit):
+    """ Returns (dimension, base unit, factor) for unit, or None if unknown."""
+
+    try:
+        return _resolved[unit]
+    except KeyError:
+        pass
+
+    entry = REGISTRY.get(normalize_unit(unit or ''))
+
+    if len(_resolved) < _RESOLVED_MAX_SIZE:
+        _resolved[unit] = entry
+
+    return entry
+
+
+def unit_dimension(unit):
+    """ Returns the dimension of unit, or None if unknown."""
+
+    entry = resolve_unit(unit)
+
+    return entry[0] if entry else None
+
+
+def convert(amount, unit):
+    """ Takes in an amount and unit and returns (amount, base unit).
+
+    Unknown units are returned unchanged.
+    """
+
+    entry = resolve_unit(unit)
+
+    if entry is None:
+        return (amount, unit)
+
+    (dimension, base_unit, factor) = entry
+    if factor == 1.0:
+        return (amount, base_unit)
+
+    return (amount * factor, base_unit)
+
+
+def convert_ingredients(ingredients):
+    """ Takes in a list of API ingredients and returns a list of (amount, base unit).
+
+    Uses each ingredient's amount and unitLong, in the same order as ingredients.
+    """
+
+    converted = []
+    append = converted.append
+    resolved = _resolved
+
+    # Same as convert() per ingredient, with the lookups inlined
+    for ingredient in ingredients:
+        amount = ingredient['amount']
+        unit = ingredient['unitLong']
+
+        entry = resolved[unit] if unit in resolved else resolve_unit(unit)
+
+        if entry is None:
+            append((amount, unit))
+        elif entry[2] == 1.0:
+            append((amount, entry[1]))
+        else:
+            append((amount * entry[2], entry[1]))
+
+    return converted